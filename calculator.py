@@ -0,0 +1,378 @@
+import os
+import sys
+import ast
+import json
+import math
+import random
+import asyncio
+import logging
+from functools import lru_cache, reduce
+from collections import namedtuple
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger('Calculator_MCP')
+logger.setLevel(logging.INFO)
+file_handler = logging.FileHandler('Calculator_MCP.log')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# 計算的限制
+CALC_TIMEOUT = 2.0            # 單一算式最長計算時間 (秒)，超過就結束 worker
+CALC_WORKERS = 2              # 同時計算的 worker 行程數
+CALC_MAX_EXPR_LEN = 1000      # 算式最長字數
+MAX_RESULT_BITS = 100_000     # 整數結果最多幾個 bit (約三萬位數)
+MAX_RESULT_DIGITS = int(MAX_RESULT_BITS * math.log10(2)) + 1
+JSON_INT_MAX_BITS = 14_000    # 更大的整數以字串回傳，json 解析整數最多 4300 位數
+MAX_SEQUENCE_LEN = 100_000    # list/tuple 最多幾個元素
+WORKER_MEMORY_LIMIT = 512 * 1024 * 1024   # worker 記憶體上限 (只在支援 resource 的系統)
+COMPILE_CACHE_SIZE = 512
+CALC_MAX_BATCH_ROWS = 10_000  # 批次計算最多幾組變數值
+WORKER_STREAM_LIMIT = 16 * 1024 * 1024    # worker 單行回覆的最大長度
+
+class CalculatorError(Exception):
+    pass
+
+def checked_pow(base, exp):
+    # 先估計結果大小，9**9**9 這種算式不真的去算
+    if isinstance(base, int) and isinstance(exp, int) and exp > 0 and abs(base) > 1:
+        if exp * (abs(base).bit_length() - 1) > MAX_RESULT_BITS:
+            raise CalculatorError("result too large")
+    return base ** exp
+
+def checked_mul(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        if a.bit_length() + b.bit_length() > MAX_RESULT_BITS:
+            raise CalculatorError("result too large")
+    elif isinstance(a, (list, tuple)) or isinstance(b, (list, tuple)):
+        seq, n = (a, b) if isinstance(a, (list, tuple)) else (b, a)
+        if isinstance(n, int) and len(seq) * n > MAX_SEQUENCE_LEN:
+            raise CalculatorError("result too large")
+    return a * b
+
+def checked_lshift(a, b):
+    if isinstance(a, int) and isinstance(b, int) and a.bit_length() + b > MAX_RESULT_BITS:
+        raise CalculatorError("result too large")
+    return a << b
+
+# 算式可以使用的名稱，只建立一次
+ALLOWED_NAMES = {
+    k: v for k, v in math.__dict__.items()
+    if not k.startswith("_")  # Exclude private methods
+}
+ALLOWED_NAMES.update({"abs": abs, "min": min, "max": max, "round": round, "sum": sum,
+                      "math": math, "random": random})
+# 只能用點號存取這些模組的公開函式
+ALLOWED_MODULES = {"math", "random"}
+
+CHECKED_OPS = {ast.Pow: 'checked_pow', ast.Mult: 'checked_mul', ast.LShift: 'checked_lshift'}
+NAMESPACE = dict(ALLOWED_NAMES)
+NAMESPACE.update({'checked_pow': checked_pow, 'checked_mul': checked_mul, 'checked_lshift': checked_lshift})
+# 批次計算時變數放在 locals，名稱放在 globals
+PYTHON_GLOBALS = dict(NAMESPACE, __builtins__=None)
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.List, ast.Attribute,
+    ast.operator, ast.unaryop, ast.boolop, ast.cmpop
+)
+
+# 批次計算時可以直接換成 NumPy 函式的名稱 (算式名稱: numpy 名稱)
+VECTOR_FUNCS = {
+    'sqrt': 'sqrt', 'exp': 'exp', 'expm1': 'expm1', 'log10': 'log10', 'log2': 'log2', 'log1p': 'log1p',
+    'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan',
+    'atan2': 'arctan2', 'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh', 'asinh': 'arcsinh',
+    'acosh': 'arccosh', 'atanh': 'arctanh', 'hypot': 'hypot', 'degrees': 'degrees', 'radians': 'radians',
+    'floor': 'floor', 'ceil': 'ceil', 'trunc': 'trunc', 'fabs': 'fabs', 'copysign': 'copysign',
+    'fmod': 'fmod', 'pow': 'power', 'abs': 'abs'
+}
+VECTOR_NAMES = set(VECTOR_FUNCS) | {'log', 'min', 'max', 'round', 'pi', 'e', 'tau', 'inf', 'nan'}
+# 這些語法對陣列的意思和對單一數值不同，只能逐組計算
+SCALAR_ONLY_NODES = (ast.Compare, ast.BoolOp, ast.IfExp, ast.Attribute, ast.Tuple, ast.List)
+
+CompiledExpression = namedtuple('CompiledExpression', ['code', 'vectorizable'])
+
+class CheckedOps(ast.NodeTransformer):
+    """把 **、*、<< 換成會先檢查結果大小的函式"""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        name = CHECKED_OPS.get(type(node.op))
+        if name is None:
+            return node
+        return ast.copy_location(
+            ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[node.left, node.right], keywords=[]),
+            node)
+
+def validate(tree: ast.AST, variables: tuple = ()):
+    """只允許數學運算、允許的名稱、批次變數與 math/random 的公開函式"""
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise CalculatorError(f"'{type(node).__name__}' is not allowed")
+        if isinstance(node, ast.Name) and node.id not in ALLOWED_NAMES and node.id not in variables:
+            raise CalculatorError(f"name '{node.id}' is not allowed")
+        if isinstance(node, ast.Attribute):
+            if (not isinstance(node.value, ast.Name) or node.value.id not in ALLOWED_MODULES
+                    or node.attr.startswith('_')):
+                raise CalculatorError(f"attribute '{node.attr}' is not allowed")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise CalculatorError(f"constant {node.value!r} is not allowed")
+
+def is_vectorizable(tree: ast.AST, variables: tuple) -> bool:
+    for node in ast.walk(tree):
+        if isinstance(node, SCALAR_ONLY_NODES):
+            return False
+        if isinstance(node, ast.Name) and node.id not in variables and node.id not in VECTOR_NAMES:
+            return False
+    return True
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_expression(expr: str, variables: tuple = ()) -> CompiledExpression:
+    """檢查並編譯算式，同一個算式 (與同一組變數名稱) 只編譯一次"""
+    if len(expr) > CALC_MAX_EXPR_LEN:
+        raise CalculatorError("expression too long")
+    tree = ast.parse(expr.strip(), mode='eval')
+    validate(tree, variables)
+    vectorizable = is_vectorizable(tree, variables)
+    tree = ast.fix_missing_locations(CheckedOps().visit(tree))
+    return CompiledExpression(compile(tree, '<calculator>', 'eval'), vectorizable)
+
+def safe_math_eval(expr: str):
+    result = eval(compile_expression(expr).code, {"__builtins__": None}, NAMESPACE)
+    if isinstance(result, int) and result.bit_length() > MAX_RESULT_BITS:
+        raise CalculatorError("result too large")
+    return result
+
+def check_variables(variables: Dict[str, Any]) -> int:
+    """檢查批次變數，回傳組數；只有一個值的變數套用到每一組"""
+    if not variables:
+        raise CalculatorError("no variables given")
+    rows = 1
+    for name, values in variables.items():
+        if not name.isidentifier() or name.startswith('_') or name in NAMESPACE:
+            raise CalculatorError(f"variable name '{name}' is not allowed")
+        if not isinstance(values, list):
+            values = [values]
+        if not values or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            raise CalculatorError(f"variable '{name}' must be a list of numbers")
+        if len(values) != 1:
+            if rows != 1 and len(values) != rows:
+                raise CalculatorError("all variables must have the same number of values")
+            rows = len(values)
+    if rows > CALC_MAX_BATCH_ROWS:
+        raise CalculatorError(f"at most {CALC_MAX_BATCH_ROWS} rows")
+    return rows
+
+numpy_globals = None
+
+def get_numpy_globals() -> Optional[Dict[str, Any]]:
+    """NumPy 版的算式名稱，沒有安裝 NumPy 時回傳 None"""
+    global numpy_globals
+    if numpy_globals is None:
+        try:
+            import numpy as np
+        except ImportError:
+            numpy_globals = {}
+            return None
+        numpy_globals = {name: getattr(np, np_name) for name, np_name in VECTOR_FUNCS.items()}
+        numpy_globals.update({
+            'log': lambda x, base=None: np.log(x) if base is None else np.log(x) / np.log(base),
+            'min': lambda *args: reduce(np.minimum, args),
+            'max': lambda *args: reduce(np.maximum, args),
+            'round': lambda x, ndigits=0: np.round(x, ndigits),
+            'pi': np.pi, 'e': np.e, 'tau': 2 * np.pi, 'inf': np.inf, 'nan': np.nan,
+            'checked_pow': checked_pow, 'checked_mul': checked_mul, 'checked_lshift': checked_lshift,
+            '__builtins__': None, 'np': np
+        })
+    return numpy_globals or None
+
+def batch_math_eval(expr: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    對每一組變數值計算同一個算式
+
+    算式可以向量化且有 NumPy 時整批一次計算，否則逐組用 Python 計算，
+    某一組算錯只影響那一組的結果。
+    """
+    rows = check_variables(variables)
+    names = tuple(sorted(variables))
+    compiled = compile_expression(expr, names)
+    columns = {}
+    for name, values in variables.items():
+        values = values if isinstance(values, list) else [values]
+        columns[name] = values if len(values) == rows else values * rows
+
+    results = None
+    engine = 'python'
+    np_globals = get_numpy_globals() if compiled.vectorizable else None
+    if np_globals is not None:
+        np = np_globals['np']
+        try:
+            with np.errstate(all='ignore'):
+                arrays = {name: np.asarray(values, dtype=float) for name, values in columns.items()}
+                results = np.broadcast_to(eval(compiled.code, np_globals, arrays), (rows,)).tolist()
+            engine = 'numpy'
+        except Exception as e:
+            logger.info(f"vectorized calculation failed, evaluating row by row: {e}")
+    if results is None:
+        results = []
+        for i in range(rows):
+            try:
+                results.append(eval(compiled.code, PYTHON_GLOBALS, {name: values[i] for name, values in columns.items()}))
+            except Exception as e:
+                results.append(f"error: {str(e) or type(e).__name__}")
+
+    return {
+        "success": True,
+        "engine": engine,
+        "columns": list(variables) + ["result"],
+        "rows": [[columns[name][i] for name in variables] + [to_json_result(results[i])] for i in range(rows)]
+    }
+
+def to_json_result(result):
+    # 複數、inf、nan 等 JSON 不支援的值與很大的整數轉成字串
+    if isinstance(result, bool) or (isinstance(result, int) and result.bit_length() <= JSON_INT_MAX_BITS):
+        return result
+    if isinstance(result, float) and math.isfinite(result):
+        return result
+    if isinstance(result, (list, tuple)):
+        return [to_json_result(v) for v in result]
+    return str(result)
+
+def worker_main():
+    """worker 行程: 每行讀一個算式，每行回覆一個 JSON 結果"""
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (WORKER_MEMORY_LIMIT, WORKER_MEMORY_LIMIT))
+    except (ImportError, ValueError, OSError):
+        pass
+    # NumPy 的 BLAS 執行緒會預留大量虛擬記憶體
+    os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+    # 整數轉字串預設最多 4300 位數，放寬到 MAX_RESULT_BITS 允許的位數
+    if hasattr(sys, 'set_int_max_str_digits'):
+        sys.set_int_max_str_digits(max(sys.get_int_max_str_digits(), MAX_RESULT_DIGITS))
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+            if isinstance(request, dict):
+                result = batch_math_eval(request['expr'], request['variables'])
+            else:
+                result = {"success": True, "result": to_json_result(safe_math_eval(request))}
+            reply = json.dumps(result)
+        except Exception as e:
+            reply = json.dumps({"success": False, "error": str(e) or type(e).__name__})
+        sys.stdout.write(reply + '\n')
+        sys.stdout.flush()
+
+class CalculatorWorker:
+    """一個計算用的子行程，計算超時就直接結束它"""
+
+    def __init__(self):
+        self.process = None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--worker',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=WORKER_STREAM_LIMIT
+        )
+
+    async def evaluate(self, request, timeout: float) -> Dict[str, Any]:
+        """request 是算式字串，或批次計算的 {'expr', 'variables'}"""
+        if self.process is None or self.process.returncode is not None:
+            await self.start()
+        try:
+            self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+            await self.process.stdin.drain()
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"calculation timed out after {timeout}s: {request}")
+            self.kill()
+            return {"success": False, "error": f"calculation exceeded {timeout} seconds"}
+        except (BrokenPipeError, ConnectionResetError, ValueError) as e:
+            # ValueError: 回覆超過 WORKER_STREAM_LIMIT
+            self.kill()
+            return {"success": False, "error": f"calculator worker failed: {e}"}
+        if not line:
+            # 例如超過記憶體上限被結束
+            self.kill()
+            return {"success": False, "error": "calculation ran out of resources"}
+        return json.loads(line)
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+        self.process = None
+
+class CalculatorPool:
+    """
+    算式計算池
+
+    算式在父行程先做 AST 檢查 (有快取)，不合法的直接回錯誤；
+    合法的交給最多 CALC_WORKERS 個 worker 行程計算，超過 CALC_TIMEOUT
+    秒就結束該 worker，不會卡住 MCP 伺服器的其他工具。
+    """
+
+    def __init__(self, size: int = CALC_WORKERS, timeout: float = CALC_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.idle = None        # asyncio.Queue，綁定建立時的 event loop
+        self.loop = None
+
+    def get_idle(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self.idle is None or self.loop is not loop:
+            if self.idle is not None:
+                while not self.idle.empty():
+                    self.idle.get_nowait().kill()
+            self.idle = asyncio.Queue()
+            for _ in range(self.size):
+                self.idle.put_nowait(CalculatorWorker())
+            self.loop = loop
+        return self.idle
+
+    async def evaluate(self, expr: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        try:
+            if variables is None:
+                compile_expression(expr)
+                request = expr
+            else:
+                check_variables(variables)
+                compile_expression(expr, tuple(sorted(variables)))
+                request = {'expr': expr, 'variables': variables}
+        except (CalculatorError, SyntaxError, ValueError) as e:
+            return {"success": False, "error": str(e)}
+        except (RecursionError, MemoryError) as e:
+            # 巢狀太深或太大的算式在解析、編譯時就會失敗
+            return {"success": False, "error": str(e) or type(e).__name__}
+        idle = self.get_idle()
+        worker = await idle.get()
+        try:
+            return await worker.evaluate(request, self.timeout)
+        except BaseException:
+            # 例如呼叫被取消，worker 可能還在計算，它的回覆會被下一個呼叫讀到，
+            # 結束它，下次使用時重新啟動
+            worker.kill()
+            raise
+        finally:
+            idle.put_nowait(worker)
+
+    def close(self):
+        if self.idle is not None:
+            while not self.idle.empty():
+                self.idle.get_nowait().kill()
+
+calculator_pool = CalculatorPool()
+
+async def calculator_mcp_call_async(expr: str) -> Dict[str, Any]:
+    return await calculator_pool.evaluate(expr)
+
+async def calculator_batch_mcp_call_async(expr: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+    return await calculator_pool.evaluate(expr, variables)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        worker_main()
+    else:
+        for expr in sys.argv[1:]:
+            print(f"{expr} = {asyncio.run(calculator_mcp_call_async(expr))}")
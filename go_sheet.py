@@ -1,13 +1,34 @@
 
 # pip3 install google-api-python-client google-auth-httplib2 google-auth-oauthlib gspread
 
+import os
 import sys
 import json
+import time
+import atexit
 import logging
-from typing import Dict, Any, Optional
+import sqlite3
+import bisect
+import asyncio
+import threading
+import glob
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional, Union
 from datetime import datetime
 import gspread
+import aiohttp
+import requests
+from urllib.parse import quote
+from google.auth.exceptions import GoogleAuthError
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
+from http_session import close_session
+try:
+    import fcntl
+except ImportError:
+    # Windows 沒有 fcntl，改用 msvcrt 鎖檔
+    fcntl = None
+    import msvcrt
 
 logger = logging.getLogger('GGSheet_MCP')
 logger.setLevel(logging.INFO)
@@ -23,11 +44,65 @@ SCOPES = [
 
 # go_config.json = {
 #   "CredentialFile": "./path_of/goapi-credentials.json",
-#   "SPREADSHEET_ID": "google_sheet_id-xxxx"
+#   "SPREADSHEET_ID": "google_sheet_id-xxxx",
+#   "WriteBehind": false,
+#   "LocalMirror": false,
+#   "Storage": "sheets",
+#   "LedgerDBFile": "ledger.db",
+#   "ReplicateToSheet": true
 # }
 GOCONF_FILE = 'go_config.json'
 
-class GoSheetEditor:
+# 延遲寫入 (write-behind) 設定
+GOSHEET_JOURNAL_FILE = 'go_sheet_journal.jsonl'  # 尚未寫入 Google Sheet 的操作日誌
+WRITE_BEHIND_INTERVAL = 2.0   # 最長多久寫入一次 (秒)
+WRITE_BEHIND_BATCH = 20       # 累積多少筆操作就立即寫入
+GRID_GROW_ROWS = 500          # 工作表列數不夠時一次增加的列數
+
+# 本地鏡像設定
+LEDGER_COLUMNS = 7                  # 日期A, 時間B, 名稱C, 個數D, 小計價格E, 狀態F, 備註G
+LEDGER_LAST_COLUMN = 'G'
+MIRROR_REFRESH_INTERVAL = 60        # 多久抓一次新增的列 (秒)
+MIRROR_FULL_RELOAD_INTERVAL = 600   # 多久整張重新載入一次 (秒)，同步別人修改過的舊列
+
+# 非同步 Sheets v4 REST API 設定
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets'
+SHEETS_POOL_LIMIT = 10        # 連線池最大連線數
+SHEETS_TIMEOUT = 30           # 單次請求逾時 (秒)
+
+# 本地帳本設定 ("Storage": "sqlite")
+LEDGER_DB_FILE = 'ledger.db'
+
+class LedgerStore(ABC):
+    """
+    帳本儲存介面
+
+    account_book_mcp_call 透過這些方法讀寫帳本。new_entry 是
+    {'id', 'name', 'count', 'subtotal'}，多筆修改時每筆另有 'method'，
+    item ID 就是項目在工作表上的列號。回傳給 LLM 的訊息字串。
+    """
+
+    @abstractmethod
+    def account_book_create(self, new_entry) -> str:
+        ...
+
+    @abstractmethod
+    def account_book_read(self, new_entry) -> str:
+        ...
+
+    @abstractmethod
+    def account_book_update(self, new_entry) -> str:
+        ...
+
+    @abstractmethod
+    def account_book_delete(self, new_entry) -> str:
+        ...
+
+    @abstractmethod
+    def account_book_batch(self, entries) -> list:
+        ...
+
+class GoSheetEditor(LedgerStore):
     
     def __init__(self, file_path: str = ''):
         # 打開 Google Sheet (透過 ID)
@@ -40,8 +115,16 @@ class GoSheetEditor:
         self.SPREADSHEET_ID = ''
         self.client = None
         self.sheetFile = None
+        self.worksheet = None
         self.worksheetName = "Notebook"
         self.CredentialFile = './authcreds/ggapi-credentials.json'
+        self.WriteBehind = False
+        self.LocalMirror = False
+        self.mirror = None
+        self.write_queue = None
+        self.Storage = 'sheets'
+        self.LedgerDBFile = LEDGER_DB_FILE
+        self.ReplicateToSheet = True
         
         try:
             with open(file_path, 'r', encoding='utf-8') as file:
@@ -53,6 +136,16 @@ class GoSheetEditor:
                     self.SPREADSHEET_ID = data['SPREADSHEET_ID']
                 if "SPREADSHEET_NAME" in data:
                     self.SPREADSHEET_NAME = data['SPREADSHEET_NAME']
+                if "WriteBehind" in data:
+                    self.WriteBehind = bool(data['WriteBehind'])
+                if "LocalMirror" in data:
+                    self.LocalMirror = bool(data['LocalMirror'])
+                if "Storage" in data:
+                    self.Storage = data['Storage']
+                if "LedgerDBFile" in data:
+                    self.LedgerDBFile = data['LedgerDBFile']
+                if "ReplicateToSheet" in data:
+                    self.ReplicateToSheet = bool(data['ReplicateToSheet'])
                 self.is_init = True
         except FileNotFoundError:
             print(f"Error: File not found '{file_path}'")
@@ -93,11 +186,24 @@ class GoSheetEditor:
             print(f"Error: Failed to open Google Sheet '{self.SPREADSHEET_NAME}'. Not found or permission denied")
             return False
 
+    def get_worksheet(self):
+        # 工作表只在第一次使用時打開，之後重複使用同一個 handle
+        if self.worksheet is None:
+            self.worksheet = self.sheetFile.worksheet(self.worksheetName)
+        return self.worksheet
+
+    def reconnect(self) -> bool:
+        # 丟掉舊的 client/sheet/worksheet，重新授權並打開
+        self.client = None
+        self.sheetFile = None
+        self.worksheet = None
+        return self.gg_authorize() and self.gsheet_open_file()
+
     def account_book_create(self, new_entry):
        
         # worksheet = gosheet.sheetFile.sheet1
         # worksheet = gosheet.sheetFile.get_worksheet(0)
-        worksheet = self.sheetFile.worksheet(self.worksheetName)
+        worksheet = self.get_worksheet()
         
         # 清除工作表內容 (可選)
         # worksheet.clear()
@@ -111,11 +217,17 @@ class GoSheetEditor:
             nowT['date_str'], nowT['time_str'], 
             new_entry['name'], new_entry['count'], new_entry['subtotal']
         ]
-        worksheet.append_row(new_row_data)
+        response = worksheet.append_row(new_row_data)
         print(f"a new entry added: {new_row_data}")
     
-        current_data_rows = len(worksheet.get_all_values())
-        item_id = current_data_rows
+        # item ID 就是新增的列號，直接從 append 回應的 updatedRange 取得
+        # 不需要再下載整張工作表來算列數
+        item_id = appended_row_number(response)
+        if item_id is None:
+            current_data_rows = len(worksheet.get_all_values())
+            item_id = current_data_rows
+        if self.mirror:
+            self.mirror.apply(item_id, 1, new_row_data)
         return f"Successfully created entry. Item ID is {item_id}, available for future reference."
         
         # Sample
@@ -136,7 +248,7 @@ class GoSheetEditor:
         
     
     def account_book_update(self, new_entry):
-        worksheet = self.sheetFile.worksheet(self.worksheetName)
+        worksheet = self.get_worksheet()
     
         print(f"updating an entry on '{worksheet.title}'")
         nowT = get_current_datetime()
@@ -147,7 +259,9 @@ class GoSheetEditor:
         # 要新增的單行資料
         # 日期, 時間, 名稱, 個數, 小計價格, 狀態, 備註
         # 寫入多個儲存格 (單行)
-        origData = worksheet.row_values(int(new_entry['id']))
+        origData = self.mirror.row(int(new_entry['id'])) if self.mirror else None
+        if not origData:
+            origData = worksheet.row_values(int(new_entry['id']))
         rowId = f"A{new_entry['id']}"
         new_row_data = [ 
             origData[0], origData[1], 
@@ -155,6 +269,8 @@ class GoSheetEditor:
             'update', f"{nowT['time_str']} {nowT['date_str']} 更新"
         ]
         worksheet.update([new_row_data], rowId)
+        if self.mirror:
+            self.mirror.apply(int(item_id), 1, new_row_data)
         print(f"an entry updated {item_id}")
         return f"Successfully updated entry. Item ID: {item_id}."
         
@@ -169,7 +285,7 @@ class GoSheetEditor:
         
     
     def account_book_delete(self, new_entry):
-        worksheet = self.sheetFile.worksheet(self.worksheetName)
+        worksheet = self.get_worksheet()
     
         print(f"deleting a entry on '{worksheet.title}'")
         nowT = get_current_datetime()
@@ -183,12 +299,58 @@ class GoSheetEditor:
         rowId = f"F{new_entry['id']}"
         # 寫入單個儲存格
         worksheet.update_acell(rowId, 'deleted')
+        if self.mirror:
+            self.mirror.apply(int(item_id), 6, ['deleted'])
         print(f"a entry deleted {item_id}")
           
         return f"Successfully deleted entry with Item ID: {item_id}."
     
+    def account_book_batch(self, entries):
+        """多筆修改: 修改與刪除合成一次 batch_update，新增合成一次 append_rows"""
+        worksheet = self.get_worksheet()
+
+        print(f"writing {len(entries)} entries on '{worksheet.title}'")
+        # (列, 起始欄, 值)
+        cells = []
+        for new_entry in entries:
+            if new_entry['method'] == 'update':
+                cells.append((int(new_entry['id']), 3, ledger_update_values(new_entry)))
+            elif new_entry['method'] == 'delete':
+                cells.append((int(new_entry['id']), 6, ['deleted']))
+        # 先寫修改再新增，新增之後才失敗時重試不會重複新增
+        if cells:
+            worksheet.batch_update([{
+                'range': f"{gspread.utils.rowcol_to_a1(row, col)}:{gspread.utils.rowcol_to_a1(row, col + len(values) - 1)}",
+                'values': [values]
+            } for row, col, values in cells])
+
+        new_rows = [ledger_create_values(e) for e in entries if e['method'] == 'create']
+        created_ids = []
+        if new_rows:
+            response = worksheet.append_rows(new_rows)
+            first_row = appended_row_number(response)
+            if first_row is None:
+                first_row = len(worksheet.get_all_values()) - len(new_rows) + 1
+            created_ids = list(range(first_row, first_row + len(new_rows)))
+            cells += [(row, 1, values) for row, values in zip(created_ids, new_rows)]
+        if self.mirror:
+            for row, col, values in cells:
+                self.mirror.apply(row, col, values)
+        print(f"{len(entries)} entries written")
+
+        results = []
+        created = iter(created_ids)
+        for new_entry in entries:
+            if new_entry['method'] == 'create':
+                results.append(f"Successfully created entry. Item ID is {next(created)}.")
+            elif new_entry['method'] == 'update':
+                results.append(f"Successfully updated entry. Item ID: {new_entry['id']}.")
+            else:
+                results.append(f"Successfully deleted entry with Item ID: {new_entry['id']}.")
+        return results
+
     def account_book_read(self, new_entry):
-        worksheet = self.sheetFile.worksheet(self.worksheetName)
+        worksheet = self.get_worksheet()
     
         print(f"reading a entry on '{worksheet.title}'")
         item_id = new_entry['id']
@@ -199,12 +361,12 @@ class GoSheetEditor:
         # for row in all_sheet_values:
         #     print(row)
         rowId = int(new_entry['id'])
-        read_row_data = worksheet.row_values(rowId)
+        # 有本地鏡像時直接從記憶體讀取
+        read_row_data = self.mirror.row(rowId) if self.mirror else None
+        if read_row_data is None:
+            read_row_data = worksheet.row_values(rowId)
         
-        mcp_result = f"Successfully retrieved entry details for Item ID: {item_id}."
-        mcp_result += f"\n{'日期,':<6} {'時間,':<6} {'名稱,':<6} {'個數,':<6} {'小計價格,':<8} {'狀態,':<6} {'備註':<8}\n"
-        mcp_result += f"{', '.join(read_row_data)}"
-        return mcp_result
+        return format_ledger_row(item_id, read_row_data)
         
         # Sample
         # first_column_data = worksheet.col_values(1)
@@ -228,6 +390,23 @@ class GoSheetEditor:
         # # print("\nValues in range A1:C5 (as list of lists):")
         # # print(all_values_in_range)
 
+def format_ledger_row(item_id, read_row_data) -> str:
+    mcp_result = f"Successfully retrieved entry details for Item ID: {item_id}."
+    mcp_result += f"\n{'日期,':<6} {'時間,':<6} {'名稱,':<6} {'個數,':<6} {'小計價格,':<8} {'狀態,':<6} {'備註':<8}\n"
+    mcp_result += f"{', '.join(read_row_data)}"
+    return mcp_result
+
+def appended_row_number(response) -> Optional[int]:
+    # append 回應: {'updates': {'updatedRange': "Notebook!A5:E5", ...}, ...}
+    try:
+        updated_range = response['updates']['updatedRange']
+        first_cell = updated_range.split('!')[-1].split(':')[0]
+        row, _ = gspread.utils.a1_to_rowcol(first_cell.replace('$', ''))
+        return row
+    except (KeyError, TypeError, IndexError, gspread.exceptions.IncorrectCellLabel):
+        logger.warning(f"cannot find the appended row in response: {response}")
+        return None
+
 def get_current_datetime() -> Dict[Any, Any]:
     # 取得當前日期與時間
     current_time = datetime.now()
@@ -245,6 +424,1185 @@ def get_current_datetime() -> Dict[Any, Any]:
         'time_str': time_str
     }
 
+def ledger_create_values(new_entry) -> list:
+    # 新增項目的 日期A, 時間B, 名稱C, 個數D, 小計價格E
+    nowT = get_current_datetime()
+    return [
+        nowT['date_str'], nowT['time_str'],
+        new_entry['name'], new_entry['count'], new_entry['subtotal']
+    ]
+
+def ledger_update_values(new_entry) -> list:
+    # 修改項目時從 C 欄開始寫: 名稱C, 個數D, 小計價格E, 狀態F, 備註G
+    nowT = get_current_datetime()
+    return [
+        new_entry['name'], new_entry['count'], new_entry['subtotal'],
+        'update', f"{nowT['time_str']} {nowT['date_str']} 更新"
+    ]
+
+class ProcessLock:
+    """
+    行程存活期間一直持有的檔案鎖
+
+    其他行程拿得到這個鎖，就表示持有的行程已經結束，可以接手它留下的日誌。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self) -> bool:
+        """不等待，鎖被其他行程持有時回傳 False"""
+        file = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        return True
+
+    def release(self, remove: bool = False):
+        if self.file is None:
+            return
+        if remove:
+            # 先刪檔再解鎖，等著拿鎖的行程拿到的是已經刪除的檔案
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.file.close()
+        self.file = None
+
+class LedgerWriteQueue:
+    """
+    帳本延遲寫入佇列
+
+    update/delete 先寫入本地日誌 (fsync) 後立即回應，背景執行緒
+    每隔 WRITE_BEHIND_INTERVAL 秒或累積 WRITE_BEHIND_BATCH 筆操作時，
+    把同一格的多次修改合併，用一次 batch_update 寫入 Google Sheet。
+
+    create 直接用 append_rows 新增，item ID 取自 API 回應的列號：
+    多個 mcp_script 行程、手動或其他裝置都可能同時在同一張工作表新增，
+    本地自己分配的列號會互相覆蓋。
+
+    每個行程寫自己的日誌 (go_sheet_journal.<pid>.jsonl)，存活期間持有它的檔案鎖；
+    行程中斷時，下一個啟動的行程拿得到鎖，就接手補寫它留下的操作。
+    """
+
+    def __init__(self, editor: 'GoSheetEditor', journal_file: str = GOSHEET_JOURNAL_FILE,
+                 interval: float = WRITE_BEHIND_INTERVAL, batch_size: int = WRITE_BEHIND_BATCH):
+        self.editor = editor
+        self.journal_file = journal_file
+        self.interval = interval
+        self.batch_size = batch_size
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.pending = []       # [{'seq', 'row', 'col', 'values'}]
+        self.seq = 0
+        self.known_rows = 0     # 工作表 A 欄有資料的列數，確認項目存在用
+        self.process_lock = None
+        self.closed = False
+        self.load_journal()
+        self.thread = threading.Thread(target=self.run, name='ledger-write-behind', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def process_journal(self, pid: int) -> str:
+        root, ext = os.path.splitext(self.journal_file)
+        return f"{root}.{pid}{ext}"
+
+    @staticmethod
+    def read_journal(path: str) -> list:
+        ops = []
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        ops.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError as e:
+            # 最後一行可能只寫了一半
+            logger.warning(f"journal '{path}' has a broken line: {e}")
+        return ops
+
+    def load_journal(self):
+        # 先拿到自己的鎖，同一個 pid 以前留下的日誌也一起補寫
+        own_journal = self.process_journal(os.getpid())
+        self.process_lock = ProcessLock(own_journal + '.lock')
+        if not self.process_lock.acquire():
+            raise RuntimeError(f"journal '{own_journal}' is locked by another queue")
+        ops = self.read_journal(own_journal)
+        # 接手已經結束的行程 (和舊版的共用日誌) 留下的操作
+        root, ext = os.path.splitext(self.journal_file)
+        adopted = []
+        for path in [self.journal_file] + sorted(glob.glob(glob.escape(root) + '.*' + ext)):
+            if path == own_journal or not os.path.exists(path):
+                continue
+            lock = ProcessLock(path + '.lock')
+            if not lock.acquire():
+                continue    # 那個行程還在執行
+            try:
+                orphan_ops = self.read_journal(path)
+                if orphan_ops:
+                    self.write_journal(orphan_ops, 'a', own_journal)
+                    adopted.append(path)
+                    ops += orphan_ops
+                os.remove(path)
+            except FileNotFoundError:
+                pass        # 另一個行程先接手了
+            finally:
+                lock.release(remove=True)
+        for seq, op in enumerate(ops, 1):
+            op['seq'] = seq
+        self.pending = ops
+        self.seq = len(ops)
+        if adopted:
+            logger.info(f"adopted ledger journals {adopted}")
+        if self.pending:
+            self.trim_journal(0)
+            logger.info(f"replaying {len(self.pending)} ledger operations from journal")
+
+    def write_journal(self, ops, mode: str, path: str = ''):
+        with open(path or self.process_journal(os.getpid()), mode, encoding='utf-8') as file:
+            for op in ops:
+                file.write(json.dumps(op, ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def trim_journal(self, done_seq: int):
+        # 日誌只保留還沒寫入的操作，只改寫自己行程的日誌
+        own_journal = self.process_journal(os.getpid())
+        tmp_file = own_journal + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as file:
+            for op in self.pending:
+                file.write(json.dumps(op, ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file, own_journal)
+
+    def enqueue(self, *cells):
+        """cells: (row, col, values)，多筆一起寫入日誌只需要一次 fsync"""
+        with self.cond:
+            ops = []
+            for row, col, values in cells:
+                self.seq += 1
+                ops.append({'seq': self.seq, 'row': row, 'col': col, 'values': values})
+            self.write_journal(ops, 'a')
+            self.pending.extend(ops)
+        if self.editor.mirror:
+            for row, col, values in cells:
+                self.editor.mirror.apply(row, col, values)
+        with self.cond:
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify()
+
+    def pending_ops(self) -> list:
+        with self.cond:
+            return list(self.pending)
+
+    def row_exists(self, row: int) -> bool:
+        """update/delete 只能寫已經存在的項目，不然會在空白列寫出一筆不完整的項目"""
+        mirror = self.editor.mirror
+        if mirror and mirror.row(row):
+            return True
+        if row <= self.known_rows:
+            return True
+        # 其他行程或裝置新增的列，重新讀一次 A 欄
+        self.known_rows = len(self.editor.get_worksheet().col_values(1))
+        return row <= self.known_rows
+
+    def check_row(self, item_id) -> str:
+        """項目存在時回傳空字串，否則回傳錯誤訊息"""
+        exists = run_with_reconnect(self.editor, 'read', self.row_exists, int(item_id))
+        if isinstance(exists, str):
+            return exists
+        return '' if exists else f"Error: Item ID {item_id} not found."
+
+    def create(self, new_entry) -> str:
+        # 新增不進佇列，列號要由 Google 決定
+        return run_with_reconnect(self.editor, 'create', self.editor.account_book_create, new_entry)
+
+    def update(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        error = self.check_row(item_id)
+        if error:
+            return error
+        # 日期與時間不變，只寫 名稱C, 個數D, 小計價格E, 狀態F, 備註G
+        self.enqueue((int(item_id), 3, ledger_update_values(new_entry)))
+        return f"Successfully updated entry. Item ID: {item_id}."
+
+    def delete(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        error = self.check_row(item_id)
+        if error:
+            return error
+        # 狀態F
+        self.enqueue((int(item_id), 6, ['deleted']))
+        return f"Successfully deleted entry with Item ID: {item_id}."
+
+    def batch(self, entries) -> list:
+        """修改與刪除一起進佇列，新增用一次 append_rows 直接寫入，回傳每一筆的結果"""
+        cells, results = [], []
+        creates = [new_entry for new_entry in entries if new_entry['method'] == 'create']
+        created = []
+        if creates:
+            created = run_with_reconnect(self.editor, 'create', self.editor.account_book_batch, creates)
+            if isinstance(created, str):
+                created = [created] * len(creates)
+        created = iter(created)
+        for new_entry in entries:
+            method = new_entry['method']
+            if method == 'create':
+                results.append(next(created))
+                continue
+            error = self.check_row(new_entry['id'])
+            if error:
+                results.append(error)
+            elif method == 'update':
+                cells.append((int(new_entry['id']), 3, ledger_update_values(new_entry)))
+                results.append(f"Successfully updated entry. Item ID: {new_entry['id']}.")
+            else:
+                cells.append((int(new_entry['id']), 6, ['deleted']))
+                results.append(f"Successfully deleted entry with Item ID: {new_entry['id']}.")
+        if cells:
+            self.enqueue(*cells)
+        return results
+
+    @staticmethod
+    def coalesce(ops) -> list:
+        # 同一格只保留最後一次的值，每列連續的儲存格合成一個範圍
+        cells = {}
+        for op in ops:
+            for i, value in enumerate(op['values']):
+                cells[(op['row'], op['col'] + i)] = value
+        data = []
+        for row in sorted({row for row, _ in cells}):
+            cols = sorted(col for r, col in cells if r == row)
+            start = prev = cols[0]
+            for col in cols[1:] + [None]:
+                if col is not None and col == prev + 1:
+                    prev = col
+                    continue
+                data.append({
+                    'range': f"{gspread.utils.rowcol_to_a1(row, start)}:{gspread.utils.rowcol_to_a1(row, prev)}",
+                    'values': [[cells[(row, c)] for c in range(start, prev + 1)]]
+                })
+                if col is not None:
+                    start = prev = col
+        return data
+
+    def flush(self) -> bool:
+        """把目前佇列中的操作寫入 Google Sheet"""
+        with self.flush_lock:
+            with self.cond:
+                ops = list(self.pending)
+            if not ops:
+                return True
+            rejected = False
+            try:
+                if self.editor.sheetFile is None:
+                    # SQLite 後端的複寫佇列在第一次寫入時才授權
+                    with shared_editor_lock:
+                        if not self.editor.reconnect():
+                            logger.warning(f"write-behind cannot open the sheet, {len(ops)} operations kept")
+                            return False
+                worksheet = self.editor.get_worksheet()
+                max_row = max(op['row'] for op in ops)
+                if max_row > worksheet.row_count:
+                    worksheet.add_rows(max_row - worksheet.row_count + GRID_GROW_ROWS)
+                worksheet.batch_update(self.coalesce(ops))
+            except (gspread.exceptions.APIError, requests.exceptions.ConnectionError) as e:
+                status = e.response.status_code if isinstance(e, gspread.exceptions.APIError) else 0
+                if not 400 <= status < 500 or status in (401, 408, 429):
+                    logger.warning(f"write-behind flush of {len(ops)} operations failed, will retry: {e}")
+                    with shared_editor_lock:
+                        self.editor.reconnect()
+                    return False
+                # 請求本身被拒絕 (例如範圍錯誤)，重試也不會成功，記錄下來後丟棄
+                logger.error(f"write-behind dropped {len(ops)} operations rejected by the sheet: {e} "
+                             f"{json.dumps(ops, ensure_ascii=False)}")
+                rejected = True
+            done_seq = ops[-1]['seq']
+            with self.cond:
+                self.pending = [op for op in self.pending if op['seq'] > done_seq]
+                self.trim_journal(done_seq)
+            if not rejected:
+                logger.info(f"write-behind flushed {len(ops)} operations")
+            return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                if len(self.pending) < self.batch_size and not self.closed:
+                    self.cond.wait(self.interval)
+                if self.closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"write-behind flush error: {e}")
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout=self.interval + 1)
+        self.flush()
+        if self.process_lock is not None:
+            # 全部寫完就不留日誌；還有沒寫完的操作時保留日誌，解鎖後由下一個行程接手
+            if not self.pending:
+                try:
+                    os.remove(self.process_journal(os.getpid()))
+                except FileNotFoundError:
+                    pass
+            self.process_lock.release(remove=not self.pending)
+
+class LedgerMirror:
+    """
+    帳本工作表的本地鏡像
+
+    第一次使用時用一次 get_all_values 載入整張工作表，之後自己的寫入
+    直接更新鏡像，背景執行緒定期只抓最後一列之後新增的列，
+    並每隔 MIRROR_FULL_RELOAD_INTERVAL 秒整張重新載入一次。
+    讀取都從記憶體回答，只有寫入需要連到 Google。
+    """
+
+    def __init__(self, editor: 'GoSheetEditor', refresh_interval: float = MIRROR_REFRESH_INTERVAL,
+                 full_reload_interval: float = MIRROR_FULL_RELOAD_INTERVAL):
+        self.editor = editor
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.rows = []          # rows[0] 是第 1 列 (標題)
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.loaded_at = 0.0
+        self.thread = None
+        self.version = 0        # 每次內容改變就加一，查詢索引用來判斷要不要重建
+        self.ledger_index = None
+
+    @staticmethod
+    def pad(values) -> list:
+        values = [str(v) for v in values[:LEDGER_COLUMNS]]
+        return values + [''] * (LEDGER_COLUMNS - len(values))
+
+    def load(self):
+        """
+        一次抓回整張工作表
+
+        抓取期間持有鎖，這段時間自己的寫入會等載入完成後才套用；
+        延遲寫入佇列中還沒寫進工作表的修改在載入後重新套用，不會被舊資料蓋掉。
+        """
+        with self.lock:
+            # 先取佇列再抓工作表，抓取期間才寫完的操作兩邊都有，重新套用也不會錯
+            queue = self.editor.write_queue
+            pending = queue.pending_ops() if queue is not None else []
+            values = self.editor.get_worksheet().get_all_values()
+            self.rows = [self.pad(row) for row in values]
+            self.loaded = True
+            for op in pending:
+                self.apply(op['row'], op['col'], op['values'])
+            self.version += 1
+            self.loaded_at = time.monotonic()
+        logger.info(f"ledger mirror loaded {len(values)} rows, {len(pending)} pending operations applied")
+
+    def ensure_loaded(self):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='ledger-mirror', daemon=True)
+                self.thread.start()
+
+    def refresh(self):
+        """只抓最後一列之後新增的列，隔一段時間整張重新載入"""
+        if time.monotonic() - self.loaded_at >= self.full_reload_interval:
+            self.load()
+            return
+        with self.lock:
+            known_rows = len(self.rows)
+        # worksheet.row_count 是打開工作表時的快取值，直接讀最後一列之後的範圍，沒有新列時回傳空的
+        new_rows = self.editor.get_worksheet().get(f"A{known_rows + 1}:{LEDGER_LAST_COLUMN}")
+        with self.lock:
+            # 背景抓取期間自己可能已經寫入了這些列，自己的寫入比較新
+            for offset, values in enumerate(new_rows):
+                if known_rows + offset >= len(self.rows):
+                    self.rows.append(self.pad(values))
+                    self.version += 1
+        if new_rows:
+            logger.info(f"ledger mirror fetched {len(new_rows)} new rows")
+
+    def run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"ledger mirror refresh failed: {e}")
+
+    def apply(self, row: int, col: int, values: list):
+        """自己的寫入直接更新鏡像"""
+        with self.lock:
+            if not self.loaded:
+                return
+            while len(self.rows) < row:
+                self.rows.append([''] * LEDGER_COLUMNS)
+            for i, value in enumerate(values):
+                if col - 1 + i < LEDGER_COLUMNS:
+                    self.rows[row - 1][col - 1 + i] = str(value)
+            self.version += 1
+
+    def row(self, row: int) -> Optional[list]:
+        """和 row_values 一樣去掉尾端的空白格，不在鏡像範圍內時回傳 None"""
+        with self.lock:
+            if not self.loaded or row < 1 or row > len(self.rows):
+                return None
+            values = list(self.rows[row - 1])
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def snapshot(self) -> list:
+        with self.lock:
+            return [list(row) for row in self.rows]
+
+    def index(self) -> 'LedgerIndex':
+        """鏡像內容沒變時重複使用同一份索引"""
+        with self.lock:
+            if self.ledger_index is None or self.ledger_index.version != self.version:
+                self.ledger_index = LedgerIndex(self.rows, self.version)
+            return self.ledger_index
+
+def parse_amount(value: str) -> int:
+    # 個數、小計價格可能是空白或有千分位
+    try:
+        return int(float(str(value).replace(',', '').strip() or 0))
+    except ValueError:
+        return 0
+
+def normalize_date(date_str: str) -> str:
+    # 帳本日期是 YYYY-MM-DD，查詢也接受 YYYY/MM/DD
+    # 手動輸入的 2025/5/1 補零成 2025-05-01，字串比較與排序才會正確
+    date_str = date_str.strip().replace('/', '-') if date_str else ''
+    parts = date_str.split('-')
+    if len(parts) == 3 and all(part.isdigit() for part in parts):
+        return f"{int(parts[0]):04d}-{int(parts[1]):02d}-{int(parts[2]):02d}"
+    return date_str
+
+class LedgerIndex:
+    """
+    帳本查詢索引
+
+    把鏡像的每一欄各存成一個 list (欄式儲存)，依日期排序的列號配上
+    個數、小計價格的前綴和，日期區間的加總只要兩次 bisect；
+    名稱、狀態各建一個 dict 對應到列號。
+    已刪除 (deleted) 的項目不算在加總裡。
+    新增的項目不寫狀態欄，查詢狀態 'create' 就是狀態欄空白的項目。
+    """
+
+    def __init__(self, rows: list, version: int):
+        self.version = version
+        body = rows[1:]     # 第 1 列是標題
+        self.ids = list(range(2, len(body) + 2))
+        self.dates = [normalize_date(row[0]) for row in body]
+        self.times = [row[1] for row in body]
+        self.names = [row[2] for row in body]
+        self.counts = [parse_amount(row[3]) for row in body]
+        self.prices = [parse_amount(row[4]) for row in body]
+        self.statuses = [row[5] for row in body]
+        self.notes = [row[6] for row in body]
+
+        # 依日期排序，空白的列 (例如預先增加的格子) 不列入
+        self.date_order = sorted((i for i in range(len(body)) if self.dates[i]),
+                                 key=lambda i: (self.dates[i], self.times[i]))
+        self.sorted_dates = [self.dates[i] for i in self.date_order]
+        self.live_prefix = [0]
+        self.count_prefix = [0]
+        self.price_prefix = [0]
+        for i in self.date_order:
+            live = self.statuses[i] != 'deleted'
+            self.live_prefix.append(self.live_prefix[-1] + live)
+            self.count_prefix.append(self.count_prefix[-1] + (self.counts[i] if live else 0))
+            self.price_prefix.append(self.price_prefix[-1] + (self.prices[i] if live else 0))
+
+        self.by_name = {}
+        self.by_status = {}
+        for i in self.date_order:
+            self.by_name.setdefault(self.names[i].strip().lower(), []).append(i)
+            self.by_status.setdefault(self.statuses[i], []).append(i)
+
+    def date_range(self, start_date: str = '', end_date: str = ''):
+        """日期區間在 date_order 裡的 [lo, hi)"""
+        lo = bisect.bisect_left(self.sorted_dates, start_date) if start_date else 0
+        hi = bisect.bisect_right(self.sorted_dates, end_date) if end_date else len(self.sorted_dates)
+        return lo, max(lo, hi)
+
+    def select(self, start_date: str = '', end_date: str = '', name: str = '', status: str = '') -> list:
+        """符合條件的列 (依日期排序)，沒有指定狀態時不含已刪除的項目"""
+        if name:
+            key = name.strip().lower()
+            rows = self.by_name.get(key)
+            if rows is None:
+                # 沒有完全相同的名稱時找包含這個字的名稱
+                rows = sorted((i for n, found in self.by_name.items() if key in n for i in found),
+                              key=lambda i: (self.dates[i], self.times[i]))
+        elif status:
+            rows = self.by_status.get(self.status_key(status), [])
+        else:
+            lo, hi = self.date_range(start_date, end_date)
+            rows = self.date_order[lo:hi]
+            start_date = end_date = ''
+        if start_date or end_date:
+            rows = [i for i in rows
+                    if (not start_date or self.dates[i] >= start_date)
+                    and (not end_date or self.dates[i] <= end_date)]
+        if status:
+            key = self.status_key(status)
+            return [i for i in rows if self.statuses[i] == key]
+        return [i for i in rows if self.statuses[i] != 'deleted']
+
+    @staticmethod
+    def status_key(status: str) -> str:
+        return '' if status == 'create' else status
+
+    def totals(self, start_date: str = '', end_date: str = '', name: str = '', status: str = '') -> Dict[str, int]:
+        if not name and not status:
+            # 只有日期條件時直接用前綴和
+            lo, hi = self.date_range(start_date, end_date)
+            return {
+                'entries': self.live_prefix[hi] - self.live_prefix[lo],
+                'count': self.count_prefix[hi] - self.count_prefix[lo],
+                'total_price': self.price_prefix[hi] - self.price_prefix[lo],
+            }
+        rows = self.select(start_date, end_date, name, status)
+        return {
+            'entries': len(rows),
+            'count': sum(map(self.counts.__getitem__, rows)),
+            'total_price': sum(map(self.prices.__getitem__, rows)),
+        }
+
+    def top(self, rows: list, n: int) -> list:
+        """小計價格最高的 n 筆"""
+        return sorted(rows, key=self.prices.__getitem__, reverse=True)[:n]
+
+    def entry(self, i: int) -> str:
+        return ', '.join([str(self.ids[i]), self.dates[i], self.times[i], self.names[i],
+                          str(self.counts[i]), str(self.prices[i]), self.statuses[i], self.notes[i]]).rstrip(', ')
+
+class SQLiteLedgerStore(LedgerStore):
+    """
+    本地帳本 (SQLite, WAL 模式)
+
+    每一筆項目存成 ledger 表的一列，id 與工作表列號相同，
+    讀寫都在本地完成。設定 replica (LedgerReplicaQueue) 時，
+    每次修改同時放進 outbox，由背景執行緒批次複寫到 Google Sheet。
+
+    多個行程可以共用同一個資料庫：寫入交易一開始就拿寫入鎖 (BEGIN IMMEDIATE)，
+    新項目的 id 在交易中由 SQLite 分配，不會有兩個行程拿到同一個 id。
+    """
+
+    def __init__(self, path: str = LEDGER_DB_FILE):
+        self.path = path
+        self.replica = None     # LedgerReplicaQueue，沒有設定時不複寫
+        self.lock = threading.Lock()
+        self.version = 0
+        self.ledger_index = None
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level='IMMEDIATE')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY,
+                date TEXT, time TEXT, name TEXT, count INTEGER, subtotal INTEGER,
+                status TEXT DEFAULT '', note TEXT DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS ledger_date ON ledger (date);
+            CREATE INDEX IF NOT EXISTS ledger_name ON ledger (name);
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY, row INTEGER, col INTEGER, ops TEXT, owner INTEGER
+            );
+        """)
+        # 舊版的 outbox 沒有 owner 欄 (寫入這筆操作的行程 pid)
+        if 'owner' not in [column[1] for column in self.conn.execute('PRAGMA table_info(outbox)')]:
+            with self.conn:
+                self.conn.execute('ALTER TABLE outbox ADD COLUMN owner INTEGER')
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM ledger LIMIT 1').fetchone() is None
+
+    def import_rows(self, rows: list):
+        """匯入工作表現有的內容 (含標題列)，讓 id 和工作表列號一致"""
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                (row_id, *LedgerMirror.pad(values)) for row_id, values in enumerate(rows[1:], 2)
+            ])
+            self.version += 1
+        logger.info(f"ledger store imported {len(rows) - 1} rows")
+
+    def apply(self, cells: list, replicate: bool = True):
+        """cells: (列, 起始欄, 值)，修改已經存在的項目並交給複寫佇列"""
+        columns = ['date', 'time', 'name', 'count', 'subtotal', 'status', 'note']
+        with self.lock, self.conn:
+            for row, col, values in cells:
+                names = columns[col - 1:col - 1 + len(values)]
+                self.conn.execute(
+                    f"UPDATE ledger SET {', '.join(f'{name}=?' for name in names)} WHERE id=?",
+                    (*values, row))
+            self.version += 1
+        if replicate and self.replica is not None:
+            self.replica.enqueue(*cells)
+
+    def insert(self, rows: list) -> list:
+        """新增項目並交給複寫佇列，回傳分配到的 id (第 1 列是標題，項目從第 2 列開始)"""
+        ids = []
+        with self.lock, self.conn:
+            for values in rows:
+                cursor = self.conn.execute(
+                    'INSERT INTO ledger VALUES ((SELECT IFNULL(MAX(id), 1) + 1 FROM ledger), ?, ?, ?, ?, ?, ?, ?)',
+                    LedgerMirror.pad(values))
+                ids.append(cursor.lastrowid)
+            self.version += 1
+        if self.replica is not None and ids:
+            self.replica.enqueue(*[(item_id, 1, values) for item_id, values in zip(ids, rows)])
+        return ids
+
+    def exists(self, item_id: int) -> bool:
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM ledger WHERE id=?', (item_id,)).fetchone() is not None
+
+    def account_book_create(self, new_entry) -> str:
+        item_id, = self.insert([ledger_create_values(new_entry)])
+        return f"Successfully created entry. Item ID is {item_id}, available for future reference."
+
+    def account_book_update(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        if not self.exists(int(item_id)):
+            return f"Error: Item ID {item_id} not found."
+        self.apply([(int(item_id), 3, ledger_update_values(new_entry))])
+        return f"Successfully updated entry. Item ID: {item_id}."
+
+    def account_book_delete(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        if not self.exists(int(item_id)):
+            return f"Error: Item ID {item_id} not found."
+        self.apply([(int(item_id), 6, ['deleted'])])
+        return f"Successfully deleted entry with Item ID: {item_id}."
+
+    def account_book_read(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT date, time, name, count, subtotal, status, note FROM ledger WHERE id=?',
+                (int(item_id),)).fetchone()
+        read_row_data = ['' if value is None else str(value) for value in row] if row else []
+        while read_row_data and read_row_data[-1] == '':
+            read_row_data.pop()
+        return format_ledger_row(item_id, read_row_data)
+
+    def account_book_batch(self, entries) -> list:
+        cells, results = [], []
+        created = iter(self.insert([ledger_create_values(e) for e in entries if e['method'] == 'create']))
+        for new_entry in entries:
+            method = new_entry['method']
+            item_id = int(new_entry['id'])
+            if method == 'create':
+                results.append(f"Successfully created entry. Item ID is {next(created)}.")
+            elif not self.exists(item_id):
+                results.append(f"Error: Item ID {item_id} not found.")
+            elif method == 'update':
+                cells.append((item_id, 3, ledger_update_values(new_entry)))
+                results.append(f"Successfully updated entry. Item ID: {item_id}.")
+            else:
+                cells.append((item_id, 6, ['deleted']))
+                results.append(f"Successfully deleted entry with Item ID: {item_id}.")
+        if cells:
+            self.apply(cells)
+        return results
+
+    def index(self) -> LedgerIndex:
+        """和 LedgerMirror.index 一樣，內容沒變時重複使用同一份查詢索引"""
+        with self.lock:
+            # data_version 在其他行程寫入這個資料庫後會改變
+            version = (self.version, self.conn.execute('PRAGMA data_version').fetchone()[0])
+            if self.ledger_index is None or self.ledger_index.version != version:
+                table = self.conn.execute('SELECT * FROM ledger ORDER BY id').fetchall()
+                rows = [[''] * LEDGER_COLUMNS for _ in range(table[-1][0] if table else 1)]
+                for row in table:
+                    rows[row[0] - 1] = ['' if value is None else str(value) for value in row[1:]]
+                self.ledger_index = LedgerIndex(rows, version)
+            return self.ledger_index
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class LedgerReplicaQueue(LedgerWriteQueue):
+    """
+    SQLite 帳本複寫到 Google Sheet 的佇列
+
+    和 LedgerWriteQueue 相同，只是尚未寫入的操作存在帳本資料庫的
+    outbox 表，不另外寫日誌檔，本地修改不需要等 fsync。
+
+    outbox 的每一筆記錄寫入它的行程 (owner)，每個行程只複寫、只刪除自己的操作；
+    行程結束後 (拿得到它的 ProcessLock)，下一個啟動的行程接手它留下的操作。
+    """
+
+    def __init__(self, editor: GoSheetEditor, store: 'SQLiteLedgerStore', **kwargs):
+        self.store = store
+        super().__init__(editor, journal_file=store.path, **kwargs)
+
+    def load_journal(self):
+        pid = os.getpid()
+        self.process_lock = ProcessLock(self.process_journal(pid) + '.lock')
+        if not self.process_lock.acquire():
+            raise RuntimeError(f"outbox of process {pid} is locked by another queue")
+        conn = self.store.conn
+        with self.store.lock:
+            owners = [owner for owner, in conn.execute('SELECT DISTINCT owner FROM outbox')]
+            for owner in owners:
+                if owner == pid:
+                    continue
+                # 舊版沒有記錄 owner 的操作直接接手
+                lock = ProcessLock(self.process_journal(owner) + '.lock') if owner is not None else None
+                if lock is not None and not lock.acquire():
+                    continue    # 那個行程還在執行
+                try:
+                    with conn:
+                        conn.execute('UPDATE outbox SET owner=? WHERE owner IS ?', (pid, owner))
+                finally:
+                    if lock is not None:
+                        lock.release(remove=True)
+                logger.info(f"adopted outbox operations of process {owner}")
+            rows = conn.execute('SELECT seq, row, col, ops FROM outbox WHERE owner=? ORDER BY seq', (pid,)).fetchall()
+        self.pending = [{'seq': seq, 'row': row, 'col': col, 'values': json.loads(values)}
+                        for seq, row, col, values in rows]
+        if self.pending:
+            logger.info(f"replicating {len(self.pending)} ledger operations from outbox")
+
+    def write_journal(self, ops, mode: str, path: str = ''):
+        # seq 由 SQLite 分配，比 outbox 中所有的操作都大，自己的操作仍然依序排列
+        with self.store.lock, self.store.conn:
+            for op in ops:
+                op['seq'] = self.store.conn.execute(
+                    'INSERT INTO outbox (row, col, ops, owner) VALUES (?, ?, ?, ?)',
+                    (op['row'], op['col'], json.dumps(op['values'], ensure_ascii=False), os.getpid())).lastrowid
+
+    def trim_journal(self, done_seq: int):
+        with self.store.lock, self.store.conn:
+            self.store.conn.execute('DELETE FROM outbox WHERE owner=? AND seq <= ?', (os.getpid(), done_seq))
+
+class SheetsAPIError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Sheets API error {status}: {message}")
+        self.status = status
+
+class AsyncSheetsClient:
+    """
+    帳本的非同步後端
+
+    直接用 aiohttp 呼叫 Sheets v4 REST API，所有請求共用同一個連線池，
+    帳本操作在等待 Google 回應時不會卡住 event loop，可以和時刻表查詢
+    或其他帳本操作同時進行。試算表設定與本地鏡像沿用 GoSheetEditor。
+    """
+
+    def __init__(self, editor: GoSheetEditor, limit: int = SHEETS_POOL_LIMIT, timeout: float = SHEETS_TIMEOUT):
+        self.editor = editor
+        self.limit = limit
+        self.timeout = timeout
+        self.spreadsheet_id = editor.SPREADSHEET_ID or editor.sheetFile.id
+        self.credentials = None
+        self.token_lock = threading.Lock()
+        self.known_rows = 0           # 工作表 A 欄有資料的列數，確認項目存在用
+        self._session = None          # aiohttp.ClientSession，綁定建立時的 event loop
+        self._session_loop = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """取得共用的 aiohttp 會話，不同 event loop 會重新建立"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._session_loop is loop:
+            return self._session
+        old_session, old_loop = self._session, self._session_loop
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self._session_loop = loop
+        await close_session(old_session, old_loop)
+        return self._session
+
+    def refresh_token(self, force: bool = False):
+        # google-auth 只有同步的 refresh，放到執行緒裡做
+        with self.token_lock:
+            if self.credentials is None:
+                self.credentials = Credentials.from_service_account_file(self.editor.CredentialFile, scopes=SCOPES)
+            if force or not self.credentials.valid:
+                self.credentials.refresh(Request())
+
+    async def reconnect(self) -> bool:
+        """重新讀取憑證並換新的 token，和 GoSheetEditor.reconnect 一樣失敗時回傳 False"""
+        with self.token_lock:
+            self.credentials = None
+        try:
+            await self.auth_headers(force=True)
+        except (GoogleAuthError, OSError, ValueError) as e:
+            logger.error(f"async sheets client cannot refresh credentials: {e}")
+            return False
+        return True
+
+    async def auth_headers(self, force: bool = False) -> Dict[str, str]:
+        if force or self.credentials is None or not self.credentials.valid:
+            await asyncio.to_thread(self.refresh_token, force)
+        return {'Authorization': f"Bearer {self.credentials.token}"}
+
+    async def request(self, method: str, path: str, retry: bool = True, **kwargs) -> Dict[Any, Any]:
+        """
+        送出一個 REST 請求
+
+        401 時換新的 token 重試，連線錯誤或 5xx 只有在 retry 為 True
+        (重送不會重複寫入) 時才重試一次。
+        """
+        session = await self.get_session()
+        url = f"{SHEETS_API_URL}/{self.spreadsheet_id}{path}"
+        force_token = False
+        for attempt in range(2):
+            headers = await self.auth_headers(force_token)
+            try:
+                async with session.request(method, url, headers=headers, **kwargs) as response:
+                    if response.status < 400:
+                        return await response.json()
+                    error = SheetsAPIError(response.status, await response.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt == 1:
+                break
+            if isinstance(error, SheetsAPIError) and error.status == 401:
+                force_token = True
+            elif not retry or (isinstance(error, SheetsAPIError) and error.status < 500):
+                break
+            logger.warning(f"account book {method} {path} failed, retrying: {error}")
+        raise error
+
+    def a1(self, cell_range: str) -> str:
+        return f"'{self.editor.worksheetName}'!{cell_range}"
+
+    async def get_values(self, cell_range: str) -> list:
+        data = await self.request('GET', f"/values/{quote(self.a1(cell_range), safe='')}")
+        return data.get('values', [])
+
+    async def batch_update(self, cells: list):
+        """cells: (列, 起始欄, 值)"""
+        await self.request('POST', '/values:batchUpdate', json={
+            'valueInputOption': 'RAW',
+            'data': [{
+                'range': self.a1(f"{gspread.utils.rowcol_to_a1(row, col)}:{gspread.utils.rowcol_to_a1(row, col + len(values) - 1)}"),
+                'values': [values]
+            } for row, col, values in cells]
+        })
+
+    async def append_rows(self, rows: list) -> Dict[Any, Any]:
+        # 新增不能自動重試，重試可能新增兩次
+        return await self.request('POST', f"/values/{quote(self.a1('A1'), safe='')}:append",
+                                  retry=False, params={'valueInputOption': 'RAW'}, json={'values': rows})
+
+    async def write(self, cells: list, new_rows: list) -> list:
+        """先寫修改再新增，回傳新增項目的 item ID"""
+        if cells:
+            await self.batch_update(cells)
+        created_ids = []
+        if new_rows:
+            response = await self.append_rows(new_rows)
+            first_row = appended_row_number(response)
+            if first_row is None:
+                first_row = len(await self.get_values('A:A')) - len(new_rows) + 1
+            created_ids = list(range(first_row, first_row + len(new_rows)))
+            self.known_rows = max(self.known_rows, created_ids[-1])
+        mirror = self.editor.mirror
+        if mirror:
+            for row, col, values in cells:
+                mirror.apply(row, col, values)
+            for row, values in zip(created_ids, new_rows):
+                mirror.apply(row, 1, values)
+        return created_ids
+
+    async def row_exists(self, row: int) -> bool:
+        """和 LedgerWriteQueue.row_exists 相同，update/delete 只能寫已經存在的項目"""
+        mirror = self.editor.mirror
+        if mirror and mirror.row(row):
+            return True
+        if row <= self.known_rows:
+            return True
+        self.known_rows = len(await self.get_values('A:A'))
+        return row <= self.known_rows
+
+    async def account_book_create(self, new_entry) -> str:
+        new_row_data = ledger_create_values(new_entry)
+        item_id, = await self.write([], [new_row_data])
+        print(f"a new entry added: {new_row_data}")
+        return f"Successfully created entry. Item ID is {item_id}, available for future reference."
+
+    async def account_book_update(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        if not await self.row_exists(int(item_id)):
+            return f"Error: Item ID {item_id} not found."
+        # 日期與時間不變，只寫 名稱C, 個數D, 小計價格E, 狀態F, 備註G
+        await self.write([(int(item_id), 3, ledger_update_values(new_entry))], [])
+        print(f"an entry updated {item_id}")
+        return f"Successfully updated entry. Item ID: {item_id}."
+
+    async def account_book_delete(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        if not await self.row_exists(int(item_id)):
+            return f"Error: Item ID {item_id} not found."
+        await self.write([(int(item_id), 6, ['deleted'])], [])
+        print(f"a entry deleted {item_id}")
+        return f"Successfully deleted entry with Item ID: {item_id}."
+
+    async def account_book_read(self, new_entry) -> str:
+        item_id = new_entry['id']
+        if item_id <= 1:
+            return f"failee to delete. Item ID must be greater than 1."
+        rowId = int(item_id)
+        read_row_data = self.editor.mirror.row(rowId) if self.editor.mirror else None
+        if read_row_data is None:
+            values = await self.get_values(f"A{rowId}:{LEDGER_LAST_COLUMN}{rowId}")
+            read_row_data = values[0] if values else []
+        return format_ledger_row(item_id, read_row_data)
+
+    async def account_book_batch(self, entries) -> list:
+        cells, missing = [], set()
+        for new_entry in entries:
+            if new_entry['method'] == 'create':
+                continue
+            item_id = int(new_entry['id'])
+            if not await self.row_exists(item_id):
+                missing.add(item_id)
+            elif new_entry['method'] == 'update':
+                cells.append((item_id, 3, ledger_update_values(new_entry)))
+            else:
+                cells.append((item_id, 6, ['deleted']))
+        new_rows = [ledger_create_values(e) for e in entries if e['method'] == 'create']
+        created = iter(await self.write(cells, new_rows))
+        print(f"{len(entries)} entries written")
+
+        results = []
+        for new_entry in entries:
+            if new_entry['method'] == 'create':
+                results.append(f"Successfully created entry. Item ID is {next(created)}.")
+            elif int(new_entry['id']) in missing:
+                results.append(f"Error: Item ID {new_entry['id']} not found.")
+            elif new_entry['method'] == 'update':
+                results.append(f"Successfully updated entry. Item ID: {new_entry['id']}.")
+            else:
+                results.append(f"Successfully deleted entry with Item ID: {new_entry['id']}.")
+        return results
+
+    async def aclose(self):
+        """關閉連線池"""
+        session, self._session = self._session, None
+        await close_session(session, self._session_loop)
+
+# 行程內共用的帳本，授權與打開試算表只做一次
+shared_editor = None
+shared_editor_lock = threading.Lock()
+
+def get_shared_editor() -> Optional[GoSheetEditor]:
+    global shared_editor
+    with shared_editor_lock:
+        if shared_editor is None or not shared_editor.sheetFile:
+            gosheet = GoSheetEditor(file_path=GOCONF_FILE)
+            if not gosheet.gg_authorize(scopes=SCOPES) or not gosheet.gsheet_open_file():
+                return None
+            shared_editor = gosheet
+        return shared_editor
+
+def get_ledger_mirror(gosheet: GoSheetEditor) -> Optional[LedgerMirror]:
+    # 第一次使用時載入 (授權失效時重新連線一次)，之後所有讀取共用同一份鏡像
+    # 打不開試算表時回傳 None
+    mirror = gosheet.mirror
+    if mirror is not None and mirror.thread is not None:
+        return mirror
+    with shared_editor_lock:
+        if gosheet.mirror is None:
+            gosheet.mirror = LedgerMirror(gosheet)
+        mirror = gosheet.mirror
+    try:
+        mirror.ensure_loaded()
+    except (gspread.exceptions.APIError, requests.exceptions.ConnectionError) as e:
+        if not should_reconnect('read', e):
+            raise
+        logger.warning(f"ledger mirror load failed, reconnecting: {e}")
+        with shared_editor_lock:
+            if not gosheet.reconnect():
+                return None
+        mirror.ensure_loaded()
+    return mirror
+
+write_queue = None
+
+def get_write_queue(gosheet: GoSheetEditor) -> Optional[LedgerWriteQueue]:
+    # go_config.json 設定 "WriteBehind": true 才啟用延遲寫入
+    global write_queue
+    if not gosheet.WriteBehind:
+        return None
+    with shared_editor_lock:
+        if write_queue is None:
+            write_queue = LedgerWriteQueue(gosheet)
+            gosheet.write_queue = write_queue
+        return write_queue
+
+ledger_store = None
+
+def get_ledger_store() -> Union[LedgerStore, str, None]:
+    """
+    go_config.json 設定 "Storage": "sqlite" 時回傳本地帳本，否則回傳 None (使用 Google Sheet)。
+
+    開啟複寫 ("ReplicateToSheet") 而本地帳本是空的時候，先匯入工作表現有的
+    內容，讓新項目的 id 接在工作表最後一列之後；匯入失敗時回傳錯誤訊息，
+    不改用 Google Sheet，以免兩邊的 id 不一致。失敗的結果也會保留，
+    之後的呼叫不再重試，重新啟動行程才會再匯入一次。
+
+    匯入要從網路讀整張工作表，不持有 shared_editor_lock，其他帳本操作不用等它；
+    同時有兩個呼叫在匯入時，只有先完成的那一份會被採用。
+    """
+    global ledger_store
+    store = ledger_store
+    if store is not None:
+        return store or None
+    config = GoSheetEditor(file_path=GOCONF_FILE)
+    if config.Storage != 'sqlite':
+        store = False
+    else:
+        store = SQLiteLedgerStore(config.LedgerDBFile)
+        if config.ReplicateToSheet and store.is_empty():
+            error = ''
+            try:
+                if config.reconnect():
+                    store.import_rows(config.get_worksheet().get_all_values())
+                else:
+                    error = 'cannot open the sheet'
+            except (gspread.exceptions.APIError, requests.exceptions.ConnectionError) as e:
+                error = str(e)
+            if error:
+                logger.error(f"cannot import the worksheet into the ledger store: {error}")
+                store.close()
+                store = f"Cannot open accouont book: importing the worksheet into {config.LedgerDBFile} failed"
+    with shared_editor_lock:
+        if ledger_store is not None:
+            # 另一個呼叫先完成了
+            if isinstance(store, SQLiteLedgerStore):
+                store.close()
+            return ledger_store or None
+        if isinstance(store, SQLiteLedgerStore) and config.ReplicateToSheet:
+            store.replica = LedgerReplicaQueue(config, store)
+        ledger_store = store
+        return ledger_store or None
+
+async_client = None
+
+def get_async_client(gosheet: GoSheetEditor) -> AsyncSheetsClient:
+    # 行程內共用一個非同步後端與它的連線池
+    global async_client
+    with shared_editor_lock:
+        if async_client is None or async_client.editor is not gosheet:
+            client = AsyncSheetsClient(gosheet)
+            if async_client is not None:
+                # 重新打開試算表時沿用原來的連線池，舊的會話不會沒關就被丟掉
+                client._session, client._session_loop = async_client._session, async_client._session_loop
+            async_client = client
+        return async_client
+
+async def close_async_client():
+    """伺服器結束時關閉非同步後端的連線池"""
+    global async_client
+    client, async_client = async_client, None
+    if client is not None:
+        await client.aclose()
+
+def should_reconnect(method: str, e: Exception) -> bool:
+    # 授權失效 (401) 或換 token 失敗時請求一定沒有被執行，任何操作都可以重試
+    # 連線錯誤或伺服器錯誤時 create 可能已經寫入，只重試不會重複寫入的操作
+    if isinstance(e, GoogleAuthError):
+        return True
+    if isinstance(e, (gspread.exceptions.APIError, SheetsAPIError)):
+        status = e.response.status_code if isinstance(e, gspread.exceptions.APIError) else e.status
+        if status == 401:
+            return True
+        return status >= 500 and method != 'create'
+    return method != 'create'
+
+def run_with_reconnect(gosheet: GoSheetEditor, method: str, action, new_entry):
+    try:
+        return action(new_entry)
+    except (gspread.exceptions.APIError, requests.exceptions.ConnectionError) as e:
+        if not should_reconnect(method, e):
+            raise
+        logger.warning(f"account book {method} failed, reconnecting: {e}")
+        with shared_editor_lock:
+            if not gosheet.reconnect():
+                return f"Cannot open accouont book"
+        return action(new_entry)
+
+# 非同步後端的請求錯誤：API 錯誤、連線錯誤與逾時、換 token 失敗
+ASYNC_SHEETS_ERRORS = (SheetsAPIError, aiohttp.ClientError, asyncio.TimeoutError, GoogleAuthError)
+
+async def run_with_reconnect_async(client: AsyncSheetsClient, method: str, action, new_entry):
+    """run_with_reconnect 的非同步版本，重新讀取憑證後重試一次，錯誤轉成回傳給 LLM 的訊息"""
+    try:
+        return await action(new_entry)
+    except ASYNC_SHEETS_ERRORS as e:
+        if not should_reconnect(method, e):
+            logger.error(f"account book {method} failed: {e}")
+            return f"Error: account book {method} failed: {e}"
+        logger.warning(f"account book {method} failed, reconnecting: {e}")
+    if not await client.reconnect():
+        return f"Cannot open accouont book"
+    try:
+        return await action(new_entry)
+    except ASYNC_SHEETS_ERRORS as e:
+        logger.error(f"account book {method} failed after reconnecting: {e}")
+        return f"Error: account book {method} failed: {e}"
+
+def ledger_store_call(store: LedgerStore, method: str, new_entry) -> str:
+    item_id = new_entry['id']
+    if method == 'create':
+        return store.account_book_create(new_entry)
+    elif method == 'update':
+        if item_id < 1:
+            return "Error: Cannot update with item_id < 1. Please provide a valid item_id for update."
+        return store.account_book_update(new_entry)
+    elif method == 'read':
+        if item_id < 1:
+            return "Error: Cannot update with item_id < 1. Please provide a valid item_id for read."
+        return store.account_book_read(new_entry)
+    elif method == 'delete':
+        if item_id < 1:
+            return "Error: Cannot delete with item_id < 1. Please provide a valid item_id for delete."
+        return store.account_book_delete(new_entry)
+    else:
+        return "Error: Invalid method specified. Please use 'create', 'read', 'update', or 'delete'."
+
 # 記帳本beta1
 def account_book_mcp_call(method:str, item_id:int, item_name:str, item_count:int, total_price:int):
     """
@@ -274,36 +1632,272 @@ def account_book_mcp_call(method:str, item_id:int, item_name:str, item_count:int
              and might include relevant details about the item or the outcome.
     """
    
-    gosheet = GoSheetEditor(file_path=GOCONF_FILE)
-    gosheet.gg_authorize(scopes=SCOPES)
-    gosheet.gsheet_open_file()
-    if not gosheet.sheetFile:
+    new_entry = {
+        'id': item_id,
+        'name': item_name,
+        'count': item_count,
+        'subtotal': total_price
+    }
+
+    # go_config.json 設定 "Storage": "sqlite" 時帳本存在本地，Google Sheet 只是複寫目標
+    store = get_ledger_store()
+    if isinstance(store, str):
+        return store
+    if store is not None:
+        return ledger_store_call(store, method, new_entry)
+
+    gosheet = get_shared_editor()
+    if not gosheet:
+        return f"Cannot open accouont book"
+
+    # 啟用延遲寫入時，修改先進佇列再批次寫入
+    queue = get_write_queue(gosheet)
+
+    # go_config.json 設定 "LocalMirror": true 時讀取由本地鏡像回答
+    # 鏡像在佇列之後載入，接手的日誌中還沒寫入的修改才會套用到鏡像
+    if gosheet.LocalMirror:
+        get_ledger_mirror(gosheet)
+
+    if method == 'create':
+        if queue is not None:
+            return queue.create(new_entry)
+        return run_with_reconnect(gosheet, method, gosheet.account_book_create, new_entry)
+    elif method == 'update':
+        if item_id < 1:
+            return "Error: Cannot update with item_id < 1. Please provide a valid item_id for update."
+        if queue is not None:
+            return queue.update(new_entry)
+        return run_with_reconnect(gosheet, method, gosheet.account_book_update, new_entry)
+    elif method == 'read':
+        if item_id < 1:
+            return "Error: Cannot update with item_id < 1. Please provide a valid item_id for read."
+        if queue is not None and not (gosheet.mirror and gosheet.mirror.row(item_id)):
+            # 要到工作表讀取時先把還沒寫入的修改寫進去，才讀得到最新資料
+            queue.flush()
+        return run_with_reconnect(gosheet, method, gosheet.account_book_read, new_entry)
+    elif method == 'delete':
+        if item_id < 1:
+            return "Error: Cannot delete with item_id < 1. Please provide a valid item_id for delete."
+        if queue is not None:
+            return queue.delete(new_entry)
+        return run_with_reconnect(gosheet, method, gosheet.account_book_delete, new_entry)
+    else:
+        return "Error: Invalid method specified. Please use 'create', 'read', 'update', or 'delete'."
+
+def check_batch_entries(entries: list):
+    # 先檢查每一筆，有問題的項目不寫入，直接回報錯誤
+    results = [None] * len(entries)
+    valid, positions = [], []
+    for pos, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            results[pos] = "Error: Each entry must be an object with method, item_id, item_name, item_count and total_price."
+            continue
+        method = entry.get('method')
+        try:
+            item_id = int(entry.get('item_id') or 0)
+        except (TypeError, ValueError):
+            results[pos] = f"Error: Invalid item_id {entry.get('item_id')!r}. Please provide an integer item_id."
+            continue
+        new_entry = {
+            'method': method,
+            'id': item_id,
+            'name': entry.get('item_name', ''),
+            'count': entry.get('item_count', 0),
+            'subtotal': entry.get('total_price', 0)
+        }
+        if method not in ('create', 'update', 'delete'):
+            results[pos] = "Error: Invalid method specified. Please use 'create', 'update', or 'delete'."
+        elif method != 'create' and new_entry['id'] <= 1:
+            results[pos] = f"Error: Cannot {method} with item_id <= 1. Please provide a valid item_id."
+        else:
+            valid.append(new_entry)
+            positions.append(pos)
+    return results, valid, positions
+
+def format_batch_results(results: list, written, positions: list) -> str:
+    if isinstance(written, str):
+        written = [written] * len(positions)
+    for pos, result in zip(positions, written):
+        results[pos] = result
+    return '\n'.join(f"{n}. {result}" for n, result in enumerate(results, 1))
+
+# 記帳本多筆修改
+def account_book_batch_mcp_call(entries: list):
+    """
+    Create, update or delete several ledger entries with one write to the sheet.
+
+    Args:
+        entries (list): A list of dicts with the keys `method` ('create', 'update' or 'delete'),
+                        `item_id`, `item_name`, `item_count` and `total_price`, used the same way
+                        as in `account_book_mcp_call`.
+
+    Returns:
+        str: One result line per entry, in the same order as `entries`.
+    """
+
+    store = get_ledger_store()
+    if isinstance(store, str):
+        return store
+    if store is not None:
+        results, valid, positions = check_batch_entries(entries)
+        return format_batch_results(results, store.account_book_batch(valid) if valid else [], positions)
+
+    gosheet = get_shared_editor()
+    if not gosheet:
         return f"Cannot open accouont book"
 
+    results, valid, positions = check_batch_entries(entries)
+    if valid:
+        queue = get_write_queue(gosheet)
+        if gosheet.LocalMirror:
+            get_ledger_mirror(gosheet)
+        if queue is not None:
+            written = queue.batch(valid)
+        else:
+            # 有新增時重試可能重複新增，和單筆 create 一樣處理
+            method = 'create' if any(e['method'] == 'create' for e in valid) else 'update'
+            written = run_with_reconnect(gosheet, method, gosheet.account_book_batch, valid)
+    else:
+        written = []
+
+    return format_batch_results(results, written, positions)
+
+async def account_book_mcp_call_async(method: str, item_id: int, item_name: str, item_count: int, total_price: int):
+    """
+    account_book_mcp_call 的非同步版本，參數與回傳值相同。
+
+    帳本讀寫透過 AsyncSheetsClient 進行，不會卡住 event loop；
+    啟用延遲寫入時修改只寫本地日誌，直接在執行緒中呼叫同步版本。
+    """
+
+    # 本地帳本的寫入交易可能要等其他行程的寫入鎖，在執行緒中呼叫同步版本
+    store = await asyncio.to_thread(get_ledger_store)
+    if store is not None:
+        return await asyncio.to_thread(account_book_mcp_call, method, item_id, item_name, item_count, total_price)
+
+    # 授權與打開試算表只有第一次需要，放到執行緒裡做
+    gosheet = await asyncio.to_thread(get_shared_editor)
+    if not gosheet:
+        return f"Cannot open accouont book"
+    if gosheet.WriteBehind:
+        return await asyncio.to_thread(account_book_mcp_call, method, item_id, item_name, item_count, total_price)
+    if gosheet.LocalMirror:
+        await asyncio.to_thread(get_ledger_mirror, gosheet)
+
     new_entry = {
         'id': item_id,
         'name': item_name,
         'count': item_count,
         'subtotal': total_price
     }
+    client = get_async_client(gosheet)
 
     if method == 'create':
-        return gosheet.account_book_create(new_entry)
+        return await run_with_reconnect_async(client, method, client.account_book_create, new_entry)
     elif method == 'update':
         if item_id < 1:
             return "Error: Cannot update with item_id < 1. Please provide a valid item_id for update."
-        return gosheet.account_book_update(new_entry)    
+        return await run_with_reconnect_async(client, method, client.account_book_update, new_entry)
     elif method == 'read':
         if item_id < 1:
             return "Error: Cannot update with item_id < 1. Please provide a valid item_id for read."
-        return gosheet.account_book_read(new_entry)
+        return await run_with_reconnect_async(client, method, client.account_book_read, new_entry)
     elif method == 'delete':
         if item_id < 1:
             return "Error: Cannot delete with item_id < 1. Please provide a valid item_id for delete."
-        return gosheet.account_book_delete(new_entry)
+        return await run_with_reconnect_async(client, method, client.account_book_delete, new_entry)
     else:
         return "Error: Invalid method specified. Please use 'create', 'read', 'update', or 'delete'."
 
+async def account_book_batch_mcp_call_async(entries: list):
+    """account_book_batch_mcp_call 的非同步版本，參數與回傳值相同。"""
+
+    store = await asyncio.to_thread(get_ledger_store)
+    if store is not None:
+        return await asyncio.to_thread(account_book_batch_mcp_call, entries)
+
+    gosheet = await asyncio.to_thread(get_shared_editor)
+    if not gosheet:
+        return f"Cannot open accouont book"
+    if gosheet.WriteBehind:
+        return await asyncio.to_thread(account_book_batch_mcp_call, entries)
+
+    results, valid, positions = check_batch_entries(entries)
+    written = []
+    if valid:
+        if gosheet.LocalMirror:
+            await asyncio.to_thread(get_ledger_mirror, gosheet)
+        client = get_async_client(gosheet)
+        # 有新增時重試可能重複新增，和單筆 create 一樣處理
+        method = 'create' if any(e['method'] == 'create' for e in valid) else 'update'
+        written = await run_with_reconnect_async(client, method, client.account_book_batch, valid)
+
+    return format_batch_results(results, written, positions)
+
+LEDGER_QUERY_LIMIT = 50     # list 最多列出幾筆
+
+# 帳本查詢
+def account_book_query_mcp_call(query: str, start_date: str = '', end_date: str = '',
+                                item_name: str = '', status: str = '', top_n: int = 10):
+    """
+    Query and aggregate ledger entries without reading them one by one.
+
+    Args:
+        query (str): 'sum' (entries, total count and total price), 'list' (matching entries) or 'top' (the `top_n` most expensive entries).
+        start_date (str): First date in 'YYYY-MM-DD' format, empty for no lower bound.
+        end_date (str): Last date in 'YYYY-MM-DD' format, empty for no upper bound.
+        item_name (str): Only entries with this name (or containing it), empty for all names.
+        status (str): Only entries with this status ('create' for entries never updated or deleted, 'update' or 'deleted'). Deleted entries are excluded when empty.
+        top_n (int): Number of entries for 'top'.
+
+    Returns:
+        str: The query result.
+    """
+
+    store = get_ledger_store()
+    if isinstance(store, str):
+        return store
+    if store is not None:
+        index = store.index()
+    else:
+        gosheet = get_shared_editor()
+        if not gosheet:
+            return f"Cannot open accouont book"
+
+        # 查詢一律在本地鏡像上做，只有第一次需要抓整張工作表
+        # 先接手延遲寫入的日誌，還沒寫入的修改才會出現在鏡像中
+        get_write_queue(gosheet)
+        mirror = get_ledger_mirror(gosheet)
+        if mirror is None:
+            return f"Cannot open accouont book"
+        index = mirror.index()
+    start_date = normalize_date(start_date)
+    end_date = normalize_date(end_date)
+
+    condition = f"date {start_date or '*'} ~ {end_date or '*'}"
+    if item_name:
+        condition += f", name '{item_name}'"
+    if status:
+        condition += f", status '{status}'"
+
+    if query == 'sum':
+        totals = index.totals(start_date, end_date, item_name, status)
+        return (f"Ledger summary ({condition}): {totals['entries']} entries, "
+                f"count {totals['count']}, total price {totals['total_price']}.")
+    elif query in ('list', 'top'):
+        rows = index.select(start_date, end_date, item_name, status)
+        if query == 'top':
+            rows = index.top(rows, max(1, top_n))
+        mcp_result = f"Found {len(rows)} entries ({condition})."
+        if len(rows) > LEDGER_QUERY_LIMIT:
+            mcp_result += f" Showing the first {LEDGER_QUERY_LIMIT}."
+        mcp_result += f"\n{'ID,':<4} {'日期,':<6} {'時間,':<6} {'名稱,':<6} {'個數,':<6} {'小計價格,':<8} {'狀態,':<6} {'備註':<8}"
+        for i in rows[:LEDGER_QUERY_LIMIT]:
+            mcp_result += f"\n{index.entry(i)}"
+        return mcp_result
+    else:
+        return "Error: Invalid query specified. Please use 'sum', 'list', or 'top'."
+
 if __name__ == "__main__":
     # print(f"程式名稱: {sys.argv[0]}")
     nowT = get_current_datetime()
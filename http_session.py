@@ -0,0 +1,11 @@
+# taiwan_hsr 與 go_sheet 的非同步客戶端共用的 aiohttp 會話工具
+import asyncio
+
+async def close_session(session, session_loop):
+    """關閉 aiohttp 會話，會話屬於其他執行緒仍在執行的 event loop 時交給那個 loop 關閉"""
+    if session is None or session.closed:
+        return
+    if session_loop is not None and session_loop is not asyncio.get_running_loop() and session_loop.is_running():
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), session_loop))
+    else:
+        await session.close()
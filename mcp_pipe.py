@@ -1,17 +1,41 @@
 """
 This script is used to connect to the MCP server and pipe the input and output to the websocket endpoint.
-Version: 0.1.0
+Version: 0.2.0
 
 Usage:
 
 export MCP_ENDPOINT=<mcp_endpoint>
 python mcp_pipe.py <mcp_script>
 
+Multiple endpoints can be served by one process, either with numbered
+environment variables or with a json config file:
+
+export MCP_ENDPOINT_1=<mcp_endpoint>
+export MCP_ENDPOINT_2=<mcp_endpoint>
+python mcp_pipe.py <mcp_script> [--config mcp_endpoints.json] [--shared]
+
+mcp_endpoints.json = {
+  "endpoints": [
+    {"name": "kitchen", "url": "wss://api.xiaozhi.me/mcp/?token=..."},
+    {"name": "office", "url": "wss://api.xiaozhi.me/mcp/?token=..."}
+  ]
+}
+
+With `--shared` all endpoints talk to a single `mcp_script` child process,
+otherwise every endpoint has its own child. Children are kept running while
+the websocket reconnects and are only restarted when they crash. With `--in-process` the
+FastMCP server object is imported from `mcp_script` and served directly
+from this process, reconnects then do not start any new interpreter.
+With `--workers N` a pool of N children is started up front and concurrent
+tool calls are spread over them.
+
 """
 
 import asyncio
 import websockets
-import subprocess
+import argparse
+import importlib.util
+import json
 import logging
 import os
 import signal
@@ -32,114 +56,622 @@ logger = logging.getLogger('MCP_PIPE')
 # Reconnection settings
 INITIAL_BACKOFF = 1  # Initial wait time in seconds
 MAX_BACKOFF = 600  # Maximum wait time in seconds
-reconnect_attempt = 0
-backoff = INITIAL_BACKOFF
 
-async def connect_with_retry(uri):
+# Process settings
+STREAM_LIMIT = 16 * 1024 * 1024  # Max size of a single JSON-RPC line read from the child
+TERMINATE_TIMEOUT = 5  # Seconds to wait for the child to exit before killing it
+INITIAL_RESTART_BACKOFF = 1  # Wait time in seconds before restarting a crashed child
+MAX_RESTART_BACKOFF = 60  # Maximum wait time in seconds between restarts
+
+# Handshake sent by the worker pool to warm up its workers
+POOL_INIT_PARAMS = {
+    'protocolVersion': '2024-11-05',
+    'capabilities': {},
+    'clientInfo': {'name': 'mcp_pipe', 'version': '0.2.0'}
+}
+
+class EndpointConnection:
+    """One websocket endpoint with its own reconnection state"""
+
+    def __init__(self, name: str, uri: str):
+        self.name = name
+        self.uri = uri
+        self.reconnect_attempt = 0
+        self.backoff = INITIAL_BACKOFF
+        self.logger = logging.getLogger(f'MCP_PIPE.{name}')
+
+    def reset_backoff(self):
+        self.reconnect_attempt = 0
+        self.backoff = INITIAL_BACKOFF
+
+class MCPProcess:
+    """
+    The `mcp_script` child process, it can be shared by several endpoint connections.
+
+    Every connection attaches a channel. Request ids coming from a channel are
+    rewritten to ids that are unique inside the child, so the responses can be
+    routed back to the connection that sent the request. Notifications from
+    the child are sent to every attached channel.
+
+    The child lives independently of the websockets: it is started once, kept
+    warm while connections come and go, and only restarted when it exits on its
+    own. After a restart the last `initialize` handshake is replayed so attached
+    connections can keep calling tools without reconnecting.
+    """
+
+    def __init__(self, mcp_script: str):
+        self.mcp_script = mcp_script
+        self.process = None
+        self.channels = {}  # channel name -> asyncio.Queue of messages for the websocket
+        self.pending = {}  # child request id -> (channel name, original request id)
+        self.next_id = 0
+        self.tasks = []
+        self.restart_task = None
+        self.start_lock = asyncio.Lock()
+        self.stopping = False
+        self.init_params = None  # params of the last client `initialize` request
+        self.restart_backoff = INITIAL_RESTART_BACKOFF
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        """Start the child process if it is not running"""
+        async with self.start_lock:
+            if self.running:
+                return
+            self.stopping = False
+            # Start mcp_script process, all pipes are asyncio streams so no helper threads are needed
+            self.process = await asyncio.create_subprocess_exec(
+                'python', self.mcp_script,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=STREAM_LIMIT
+            )
+            # Keep the restart task that is running this start, the pipes of the old child are done
+            self.tasks = [task for task in self.tasks if not task.done()] + [
+                asyncio.create_task(self.pipe_process_to_channels(self.process)),
+                asyncio.create_task(pipe_process_stderr_to_terminal(self.process))
+            ]
+            logger.info(f"Started {self.mcp_script} process (pid: {self.process.pid})")
+            if self.init_params is not None:
+                await self.replay_initialize()
+
+    async def stop(self):
+        """Terminate the child process"""
+        if self.process is None:
+            return
+        self.stopping = True
+        logger.info(f"Terminating {self.mcp_script} process")
+        await terminate_process(self.process)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # Wake up every attached connection, there is nothing left to talk to
+        for queue in self.channels.values():
+            queue.put_nowait(None)
+        logger.info(f"{self.mcp_script} process terminated")
+
+    async def restart(self):
+        """Restart the child after it exited on its own"""
+        returncode = self.process.returncode if self.process else None
+        logger.warning(f"{self.mcp_script} process exited (code: {returncode}), "
+                       f"restarting in {self.restart_backoff} seconds")
+        self.fail_pending("MCP server process exited")
+        await asyncio.sleep(self.restart_backoff)
+        self.restart_backoff = min(self.restart_backoff * 2, MAX_RESTART_BACKOFF)
+        if not self.stopping:
+            await self.start()
+
+    def schedule_restart(self) -> asyncio.Task:
+        """Restart the child once, callers noticing the same exit share the restart task"""
+        if self.restart_task is None or self.restart_task.done():
+            self.restart_task = asyncio.create_task(self.restart())
+            self.tasks.append(self.restart_task)
+        return self.restart_task
+
+    async def replay_initialize(self):
+        """Re-run the client handshake on a fresh child, the answer is not forwarded"""
+        self.next_id += 1
+        self.pending[self.next_id] = (None, None)
+        await self.write({'jsonrpc': '2.0', 'id': self.next_id, 'method': 'initialize', 'params': self.init_params})
+        await self.write({'jsonrpc': '2.0', 'method': 'notifications/initialized'})
+        logger.info(f"Replayed initialize handshake to {self.mcp_script} process")
+
+    def fail_pending(self, reason: str):
+        """Answer every in-flight request with an error so the clients do not wait forever"""
+        for name, original_id in self.pending.values():
+            queue = self.channels.get(name)
+            if queue is not None:
+                queue.put_nowait(json.dumps({
+                    'jsonrpc': '2.0',
+                    'id': original_id,
+                    'error': {'code': -32603, 'message': reason}
+                }, ensure_ascii=False))
+        self.pending.clear()
+
+    def attach(self, name: str) -> asyncio.Queue:
+        """Attach a channel, messages from the child for this channel are put on the returned queue"""
+        queue = asyncio.Queue()
+        self.channels[name] = queue
+        return queue
+
+    def detach(self, name: str):
+        """Detach a channel and forget its in-flight requests"""
+        self.channels.pop(name, None)
+        for child_id, (channel, _) in list(self.pending.items()):
+            if channel == name:
+                del self.pending[child_id]
+
+    async def send(self, name: str, message):
+        """Write a message from channel `name` to the child stdin"""
+        if not self.running:
+            if self.stopping:
+                raise ConnectionError(f"{self.mcp_script} process is not running")
+            if self.process is None:
+                await self.start()
+            else:
+                # The child crashed, wait for the restart so a crash loop still backs off
+                await asyncio.shield(self.schedule_restart())
+            if not self.running:
+                raise ConnectionError(f"{self.mcp_script} process is not running")
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            logger.warning(f"[{name}] Dropping invalid JSON message: {message[:120]}")
+            return
+        if isinstance(data, list):
+            data = [item for item in (self.rewrite_request_id(name, item) for item in data) if item is not None]
+        else:
+            data = self.rewrite_request_id(name, data)
+        if data:
+            await self.write(data)
+
+    async def write(self, data):
+        line = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        # Write to process stdin, drain() waits while the child's pipe is full
+        self.process.stdin.write(line.encode('utf-8') + b'\n')
+        await self.process.stdin.drain()
+
+    def rewrite_request_id(self, name: str, item):
+        """Give a request a child-unique id and remember where the response goes"""
+        if isinstance(item, dict) and item.get('method') == 'notifications/cancelled':
+            return self.rewrite_cancelled(name, item)
+        if not isinstance(item, dict) or 'method' not in item or 'id' not in item:
+            return item  # notifications and responses to child requests pass through
+        if item['method'] == 'initialize':
+            # Remember the handshake so it can be replayed to a restarted child
+            self.init_params = item.get('params')
+        self.next_id += 1
+        self.pending[self.next_id] = (name, item['id'])
+        return dict(item, id=self.next_id)
+
+    def find_child_id(self, name: str, original_id):
+        """The child-unique id of the in-flight request `original_id` of channel `name`"""
+        for child_id, target in self.pending.items():
+            if target == (name, original_id):
+                return child_id
+        return None
+
+    def rewrite_cancelled(self, name: str, item):
+        """Point a cancellation at the child-unique id, drop it when the request is not in flight"""
+        params = item.get('params') or {}
+        child_id = self.find_child_id(name, params.get('requestId'))
+        if child_id is None:
+            # Already answered, the original id may now belong to another channel's request
+            logger.debug(f"[{name}] Dropping cancellation of unknown request: {params.get('requestId')}")
+            return None
+        return dict(item, params=dict(params, requestId=child_id))
+
+    def route_message(self, item):
+        """Find the channel for a message from the child and restore the original request id"""
+        if isinstance(item, dict) and 'method' not in item and 'id' in item:
+            target = self.pending.pop(item['id'], None)
+            if target is None:
+                logger.warning(f"Dropping response with unknown id: {item['id']}")
+                return
+            name, original_id = target
+            queue = self.channels.get(name)
+            if queue is not None:
+                queue.put_nowait(json.dumps(dict(item, id=original_id), ensure_ascii=False))
+            if name is not None:
+                self.restart_backoff = INITIAL_RESTART_BACKOFF  # the child is healthy again
+            return
+        line = json.dumps(item, ensure_ascii=False)
+        if isinstance(item, dict) and 'id' in item:
+            # A request from the server, only one client should answer it
+            queues = list(self.channels.values())[:1]
+        else:
+            queues = list(self.channels.values())
+        for queue in queues:
+            queue.put_nowait(line)
+
+    async def pipe_process_to_channels(self, process):
+        """Read data from process stdout and route it to the attached channels"""
+        try:
+            while True:
+                # Read data from process stdout
+                data = await process.stdout.readline()
+
+                if not data:  # If no data, the process may have ended
+                    logger.info("Process has ended output")
+                    break
+
+                logger.debug(f">> {data[:120]}...")
+                try:
+                    message = json.loads(data)
+                except json.JSONDecodeError:
+                    # Tools print progress to stdout, it is not part of the protocol
+                    logger.debug(f"Ignoring non JSON-RPC output: {data[:120]}")
+                    continue
+                if isinstance(message, list):
+                    for item in message:
+                        self.route_message(item)
+                else:
+                    self.route_message(message)
+        except Exception as e:
+            logger.error(f"Error in process to WebSocket pipe: {e}")
+        if not self.stopping:
+            await terminate_process(process)
+            self.schedule_restart()
+
+class MCPWorkerPool:
+    """
+    A pool of pre-started `mcp_script` workers shared by all endpoints.
+
+    Requests are given a pool-unique id and sent to the least busy worker, the
+    response is routed back to the connection by that id. Requests from a worker
+    to the client get a pool-unique id too, so the client's answer goes back to
+    that worker only. Every worker is
+    initialized when it starts, the answers of `initialize` and `tools/list`
+    are cached and served by the pool without touching a worker.
+    """
+
+    CACHED_METHODS = ('initialize', 'tools/list')
+
+    def __init__(self, mcp_script: str, size: int):
+        self.mcp_script = mcp_script
+        self.workers = [MCPProcess(mcp_script) for _ in range(size)]
+        self.in_flight = [0] * size
+        self.channels = {}  # channel name -> asyncio.Queue of messages for the websocket
+        self.pending = {}  # pool request id -> (channel name, original request id, worker index, cache key)
+        self.cache = {}  # cache key -> result
+        self.worker_requests = {}  # pool request id -> (worker index, worker request id)
+        self.next_id = 0
+        self.tasks = []
+
+    @property
+    def running(self) -> bool:
+        return any(worker.running for worker in self.workers)
+
+    async def start(self):
+        """Start and initialize every worker"""
+        if self.tasks:
+            return
+        for index, worker in enumerate(self.workers):
+            worker.init_params = POOL_INIT_PARAMS
+            queue = worker.attach('pool')
+            self.tasks.append(asyncio.create_task(self.pipe_worker_to_channels(index, queue)))
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        logger.info(f"Started pool of {len(self.workers)} {self.mcp_script} workers")
+
+    async def stop(self):
+        """Terminate every worker"""
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for queue in self.channels.values():
+            queue.put_nowait(None)
+
+    def attach(self, name: str) -> asyncio.Queue:
+        """Attach a channel, responses for this channel are put on the returned queue"""
+        queue = asyncio.Queue()
+        self.channels[name] = queue
+        return queue
+
+    def detach(self, name: str):
+        """Detach a channel, responses to its in-flight requests are dropped"""
+        self.channels.pop(name, None)
+
+    async def send(self, name: str, message):
+        """Answer from the cache or dispatch a message from channel `name` to a worker"""
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            logger.warning(f"[{name}] Dropping invalid JSON message: {message[:120]}")
+            return
+        for item in data if isinstance(data, list) else [data]:
+            await self.dispatch(name, item)
+
+    async def dispatch(self, name: str, item):
+        if not isinstance(item, dict) or 'method' not in item:
+            # A response to a request of a worker, only the worker that asked gets it
+            target = self.worker_requests.pop(item.get('id'), None) if isinstance(item, dict) else None
+            if target is None:
+                logger.warning(f"[{name}] Dropping response with unknown id: {str(item)[:120]}")
+                return
+            index, worker_id = target
+            await self.workers[index].send('pool', json.dumps(dict(item, id=worker_id), ensure_ascii=False))
+            return
+        method = item['method']
+        if method == 'notifications/cancelled':
+            await self.dispatch_cancelled(name, item)
+            return
+        if 'id' not in item:
+            if method == 'notifications/initialized':
+                return  # the workers were initialized by the pool
+            for worker in self.workers:
+                await worker.send('pool', json.dumps(item, ensure_ascii=False))
+            return
+
+        cache_key = None
+        if method in self.CACHED_METHODS:
+            params = item.get('params') or {}
+            key_params = params.get('protocolVersion') if method == 'initialize' else params
+            cache_key = (method, json.dumps(key_params, sort_keys=True))
+            if cache_key in self.cache:
+                self.reply(name, {'jsonrpc': '2.0', 'id': item['id'], 'result': self.cache[cache_key]})
+                return
+
+        # Pick an idle worker, or the least busy one when all are busy
+        index = min(range(len(self.workers)), key=lambda i: self.in_flight[i])
+        self.in_flight[index] += 1
+        self.next_id += 1
+        self.pending[self.next_id] = (name, item['id'], index, cache_key)
+        await self.workers[index].send('pool', json.dumps(dict(item, id=self.next_id), ensure_ascii=False))
+
+    async def dispatch_cancelled(self, name: str, item):
+        """Send a cancellation only to the worker running the request, with the pool id"""
+        params = item.get('params') or {}
+        request_id = params.get('requestId')
+        pool_id = next((pool_id for pool_id, target in self.pending.items() if target[:2] == (name, request_id)), None)
+        if pool_id is None:
+            logger.debug(f"[{name}] Dropping cancellation of unknown request: {request_id}")
+            return
+        index = self.pending[pool_id][2]
+        message = dict(item, params=dict(params, requestId=pool_id))
+        await self.workers[index].send('pool', json.dumps(message, ensure_ascii=False))
+
+    def reply(self, name: str, item):
+        queue = self.channels.get(name)
+        if queue is not None:
+            queue.put_nowait(json.dumps(item, ensure_ascii=False))
+
+    async def pipe_worker_to_channels(self, index: int, queue: asyncio.Queue):
+        """Route the messages of one worker back to the connections"""
+        while True:
+            message = await queue.get()
+            if message is None:
+                continue  # the worker is stopped or restarting
+            item = json.loads(message)
+            if 'method' in item and 'id' in item:
+                # A request from the worker, ask the connection whose call is running on it
+                self.next_id += 1
+                self.worker_requests[self.next_id] = (index, item['id'])
+                names = [target[0] for target in self.pending.values() if target[2] == index]
+                name = next((name for name in names if name in self.channels), next(iter(self.channels), None))
+                self.reply(name, dict(item, id=self.next_id))
+                continue
+            if 'method' in item:
+                # Notifications from the worker
+                for channel in self.channels.values():
+                    channel.put_nowait(message)
+                continue
+            target = self.pending.pop(item.get('id'), None)
+            if target is None:
+                continue
+            name, original_id, worker_index, cache_key = target
+            self.in_flight[worker_index] -= 1
+            if cache_key is not None and 'result' in item:
+                self.cache[cache_key] = item['result']
+            self.reply(name, dict(item, id=original_id))
+
+class InProcessServer:
+    """
+    The FastMCP server of `mcp_script`, imported and run inside this process.
+
+    Every endpoint gets its own MCP session over in-memory streams. The session
+    outlives the websocket, a reconnect re-attaches to the same session and the
+    tools keep their state, so it only costs the websocket handshake.
+    """
+
+    def __init__(self, mcp_script: str):
+        self.mcp_script = mcp_script
+        self.module = None
+        self.server = None
+        self.channels = {}  # channel name -> asyncio.Queue of messages for the websocket
+        self.sessions = {}  # channel name -> (read stream writer, session task)
+
+    @property
+    def running(self) -> bool:
+        return self.server is not None
+
+    async def start(self):
+        """Import `mcp_script` once and keep its FastMCP server"""
+        if self.server is None:
+            self.module, self.server = load_fastmcp_server(self.mcp_script)
+            logger.info(f"Loaded {self.mcp_script} server '{self.server.name}' in process")
+
+    async def stop(self):
+        """Close every session"""
+        for writer, task in self.sessions.values():
+            writer.close()
+            task.cancel()
+        await asyncio.gather(*(task for _, task in self.sessions.values()), return_exceptions=True)
+        self.sessions.clear()
+        # Let the script close what its tools opened, e.g. pooled HTTP sessions
+        close_tool_clients = getattr(self.module, 'close_tool_clients', None)
+        if close_tool_clients is not None:
+            await close_tool_clients()
+
+    def attach(self, name: str) -> asyncio.Queue:
+        """Attach a channel, start its session if it has none yet"""
+        queue = asyncio.Queue()
+        self.channels[name] = queue
+        if name not in self.sessions:
+            self.sessions[name] = self.start_session(name)
+        return queue
+
+    def detach(self, name: str):
+        """Detach a channel, its session is kept for the next connection"""
+        self.channels.pop(name, None)
+
+    def start_session(self, name: str):
+        import anyio
+
+        read_writer, read_stream = anyio.create_memory_object_stream(0)
+        write_stream, write_reader = anyio.create_memory_object_stream(0)
+        lowlevel_server = self.server._mcp_server
+
+        async def run_session():
+            async def pipe_session_to_channel():
+                async with write_reader:
+                    async for session_message in write_reader:
+                        queue = self.channels.get(name)
+                        if queue is None:
+                            continue  # nobody to answer, the websocket is gone
+                        queue.put_nowait(session_message.message.model_dump_json(by_alias=True, exclude_none=True))
+            writer_task = asyncio.create_task(pipe_session_to_channel())
+            try:
+                await lowlevel_server.run(
+                    read_stream,
+                    write_stream,
+                    lowlevel_server.create_initialization_options()
+                )
+            except Exception as e:
+                logger.error(f"[{name}] MCP session error: {e}")
+            finally:
+                writer_task.cancel()
+                self.sessions.pop(name, None)
+                queue = self.channels.get(name)
+                if queue is not None:
+                    queue.put_nowait(None)
+
+        return read_writer, asyncio.create_task(run_session())
+
+    async def send(self, name: str, message):
+        """Feed a message from channel `name` to its MCP session"""
+        import mcp.types as types
+        from mcp.shared.message import SessionMessage
+
+        if name not in self.sessions:
+            raise ConnectionError(f"MCP session of {name} is closed")
+        writer, _ = self.sessions[name]
+        try:
+            item = SessionMessage(types.JSONRPCMessage.model_validate_json(message))
+        except Exception as e:
+            item = e  # the session answers invalid messages itself
+        await writer.send(item)
+
+def load_fastmcp_server(mcp_script: str):
+    """Import `mcp_script` as a module and return the module and its FastMCP instance"""
+    from mcp.server.fastmcp import FastMCP
+
+    script_path = os.path.abspath(mcp_script)
+    # Let the script import its own helper modules
+    script_dir = os.path.dirname(script_path)
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    module_name = os.path.splitext(os.path.basename(script_path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    server = getattr(module, 'mcp', None)
+    if not isinstance(server, FastMCP):
+        server = next((v for v in vars(module).values() if isinstance(v, FastMCP)), None)
+    if server is None:
+        raise RuntimeError(f"No FastMCP server found in {mcp_script}")
+    return module, server
+
+async def connect_with_retry(endpoint: EndpointConnection, server):
     """Connect to WebSocket server with retry mechanism"""
-    global reconnect_attempt, backoff
     while True:  # Infinite reconnection
         try:
-            if reconnect_attempt > 0:
-                wait_time = backoff * (1 + random.random() * 0.1)  # Add some random jitter
-                logger.info(f"Waiting {wait_time:.2f} seconds before reconnection attempt {reconnect_attempt}...")
+            if endpoint.reconnect_attempt > 0:
+                wait_time = endpoint.backoff * (1 + random.random() * 0.1)  # Add some random jitter
+                endpoint.logger.info(f"Waiting {wait_time:.2f} seconds before reconnection attempt {endpoint.reconnect_attempt}...")
                 await asyncio.sleep(wait_time)
-                
+
             # Attempt to connect
-            await connect_to_server(uri)
-        
+            await connect_to_server(endpoint, server)
+
         except Exception as e:
-            reconnect_attempt += 1
-            logger.warning(f"Connection closed (attempt: {reconnect_attempt}): {e}")            
+            endpoint.reconnect_attempt += 1
+            endpoint.logger.warning(f"Connection closed (attempt: {endpoint.reconnect_attempt}): {e}")
             # Calculate wait time for next reconnection (exponential backoff)
-            backoff = min(backoff * 2, MAX_BACKOFF)
+            endpoint.backoff = min(endpoint.backoff * 2, MAX_BACKOFF)
 
-async def connect_to_server(uri):
-    """Connect to WebSocket server and establish bidirectional communication with `mcp_script`"""
-    global reconnect_attempt, backoff
+async def connect_to_server(endpoint: EndpointConnection, process):
+    """
+    Connect to WebSocket server and establish bidirectional communication with `mcp_script`.
+    `process` is a MCPProcess or InProcessServer, it outlives the websocket.
+    """
+    log = endpoint.logger
+    attached = False
     try:
-        logger.info(f"Connecting to WebSocket server...")
-        async with websockets.connect(uri) as websocket:
-            logger.info(f"Successfully connected to WebSocket server")
-            
+        log.info(f"Connecting to WebSocket server...")
+        async with websockets.connect(endpoint.uri) as websocket:
+            log.info(f"Successfully connected to WebSocket server")
+
             # Reset reconnection counter if connection closes normally
-            reconnect_attempt = 0
-            backoff = INITIAL_BACKOFF
-            
-            # Start mcp_script process
-            process = subprocess.Popen(
-                ['python', mcp_script],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8',
-                text=True  # Use text mode
-            )
-            logger.info(f"Started {mcp_script} process")
-            
+            endpoint.reset_backoff()
+
+            # Make sure mcp_script is running, a warm process is re-attached as is
+            await process.start()
+            queue = process.attach(endpoint.name)
+            attached = True
+
             # Create two tasks: read from WebSocket and write to process, read from process and write to WebSocket
             await asyncio.gather(
-                pipe_websocket_to_process(websocket, process),
-                pipe_process_to_websocket(process, websocket),
-                pipe_process_stderr_to_terminal(process)
+                pipe_websocket_to_process(websocket, process, endpoint),
+                pipe_channel_to_websocket(queue, websocket, endpoint)
             )
     except websockets.exceptions.ConnectionClosed as e:
-        logger.error(f"WebSocket connection closed: {e}")
+        log.error(f"WebSocket connection closed: {e}")
         raise  # Re-throw exception to trigger reconnection
     except Exception as e:
-        logger.error(f"Connection error: {e}")
+        log.error(f"Connection error: {e}")
         raise  # Re-throw exception
     finally:
-        # Ensure the child process is properly terminated
-        if 'process' in locals():
-            logger.info(f"Terminating {mcp_script} process")
-            try:
-                process.terminate()
-                process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                process.kill()
-            logger.info(f"{mcp_script} process terminated")
+        # Keep the process running for the next connection
+        if attached:
+            process.detach(endpoint.name)
 
-async def pipe_websocket_to_process(websocket, process):
+async def pipe_websocket_to_process(websocket, process, endpoint: EndpointConnection):
     """Read data from WebSocket and write to process stdin"""
     try:
         while True:
             # Read message from WebSocket
             message = await websocket.recv()
-            logger.debug(f"<< {message[:120]}...")
-            
-            # Write to process stdin (in text mode)
+            endpoint.logger.debug(f"<< {message[:120]}...")
+
             if isinstance(message, bytes):
                 message = message.decode('utf-8')
-            process.stdin.write(message + '\n')
-            process.stdin.flush()
+            await process.send(endpoint.name, message)
     except Exception as e:
-        logger.error(f"Error in WebSocket to process pipe: {e}")
+        endpoint.logger.error(f"Error in WebSocket to process pipe: {e}")
         raise  # Re-throw exception to trigger reconnection
-    finally:
-        # Close process stdin
-        if not process.stdin.closed:
-            process.stdin.close()
 
-async def pipe_process_to_websocket(process, websocket):
-    """Read data from process stdout and send to WebSocket"""
+async def pipe_channel_to_websocket(queue: asyncio.Queue, websocket, endpoint: EndpointConnection):
+    """Read messages routed to this connection and send to WebSocket"""
     try:
         while True:
-            # Read data from process stdout
-            data = await asyncio.get_event_loop().run_in_executor(
-                None, process.stdout.readline
-            )
-            
-            if not data:  # If no data, the process may have ended
-                logger.info("Process has ended output")
-                break
-                
+            message = await queue.get()
+            if message is None:  # The process has ended
+                raise ConnectionError("MCP process has ended")
+
             # Send data to WebSocket
-            logger.debug(f">> {data[:120]}...")
-            # In text mode, data is already a string, no need to decode
-            await websocket.send(data)
+            endpoint.logger.debug(f">> {message[:120]}...")
+            await websocket.send(message)
     except Exception as e:
-        logger.error(f"Error in process to WebSocket pipe: {e}")
+        endpoint.logger.error(f"Error in process to WebSocket pipe: {e}")
         raise  # Re-throw exception to trigger reconnection
 
 async def pipe_process_stderr_to_terminal(process):
@@ -147,47 +679,134 @@ async def pipe_process_stderr_to_terminal(process):
     try:
         while True:
             # Read data from process stderr
-            data = await asyncio.get_event_loop().run_in_executor(
-                None, process.stderr.readline
-            )
-            
+            data = await process.stderr.readline()
+
             if not data:  # If no data, the process may have ended
                 logger.info("Process has ended stderr output")
                 break
-                
-            # Print stderr data to terminal (in text mode, data is already a string)
-            sys.stderr.write(data)
+
+            # Print stderr data to terminal
+            sys.stderr.write(data.decode('utf-8', errors='replace'))
             sys.stderr.flush()
     except Exception as e:
         logger.error(f"Error in process stderr pipe: {e}")
         raise  # Re-throw exception to trigger reconnection
 
-def signal_handler(sig, frame):
-    """Handle interrupt signals"""
+async def terminate_process(process):
+    """Terminate the child process, kill it if it does not exit in time"""
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), timeout=TERMINATE_TIMEOUT)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+def load_endpoints(config_file: str = '') -> list:
+    """
+    Collect endpoints from a json config file and from the environment.
+    `MCP_ENDPOINT` and `MCP_ENDPOINT_<name>` are both accepted.
+    """
+    endpoints = []
+    if config_file:
+        try:
+            with open(config_file, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            items = data.get('endpoints', []) if isinstance(data, dict) else data
+            for i, item in enumerate(items):
+                if isinstance(item, str):
+                    endpoints.append(EndpointConnection(f"endpoint{i + 1}", item))
+                else:
+                    endpoints.append(EndpointConnection(item.get('name', f"endpoint{i + 1}"), item['url']))
+        except FileNotFoundError:
+            logger.error(f"Config file not found '{config_file}'")
+        except (json.JSONDecodeError, KeyError, AttributeError) as e:
+            logger.error(f"Invalid config file '{config_file}': {e}")
+
+    if os.environ.get('MCP_ENDPOINT'):
+        endpoints.append(EndpointConnection('default', os.environ['MCP_ENDPOINT']))
+    for key in sorted(os.environ):
+        if key.startswith('MCP_ENDPOINT_') and os.environ[key]:
+            endpoints.append(EndpointConnection(key[len('MCP_ENDPOINT_'):].lower(), os.environ[key]))
+
+    # Connection names are used to route responses, keep them unique
+    seen = {}
+    for endpoint in endpoints:
+        if endpoint.name in seen:
+            seen[endpoint.name] += 1
+            endpoint.name = f"{endpoint.name}-{seen[endpoint.name]}"
+            endpoint.logger = logging.getLogger(f'MCP_PIPE.{endpoint.name}')
+        else:
+            seen[endpoint.name] = 1
+    return endpoints
+
+def request_shutdown(task):
+    """Handle interrupt signals by cancelling the main task, so cleanup still runs inside the loop"""
     logger.info("Received interrupt signal, shutting down...")
-    sys.exit(0)
+    task.cancel()
+
+def install_signal_handlers():
+    """Route SIGINT/SIGTERM to request_shutdown for the current task"""
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, task)
+        except (NotImplementedError, RuntimeError):
+            # Windows has no loop signal handlers, Ctrl+C still ends up as KeyboardInterrupt
+            pass
+
+async def run_endpoints(endpoints: list, shared: bool, in_process: bool = False, workers: int = 0):
+    """Run every endpoint connection loop in one event loop"""
+    install_signal_handlers()
+    if workers >= 1:
+        servers = [MCPWorkerPool(mcp_script, workers)] * len(endpoints)
+        await servers[0].start()
+    elif in_process:
+        servers = [InProcessServer(mcp_script)] * len(endpoints)
+        await servers[0].start()
+    elif shared:
+        servers = [MCPProcess(mcp_script)] * len(endpoints)
+    else:
+        # A private child per endpoint, kept across reconnects
+        servers = [MCPProcess(mcp_script) for _ in endpoints]
+    try:
+        await asyncio.gather(*(connect_with_retry(endpoint, server) for endpoint, server in zip(endpoints, servers)))
+    finally:
+        for server in set(servers):
+            await server.stop()
 
 if __name__ == "__main__":
-    # Register signal handler
-    signal.signal(signal.SIGINT, signal_handler)
-    
-    # mcp_script
-    if len(sys.argv) < 2:
-        logger.error("Usage: mcp_pipe.py <mcp_script>")
-        sys.exit(1)
-    
-    mcp_script = sys.argv[1]
-    
-    # Get token from environment variable or command line arguments
-    endpoint_url = os.environ.get('MCP_ENDPOINT')
-    if not endpoint_url:
+    parser = argparse.ArgumentParser(description='Pipe MCP endpoints to a local MCP server script')
+    parser.add_argument('mcp_script', help='MCP server script to run')
+    parser.add_argument('--config', '-c', type=str, default='',
+                        help='json file with a list of endpoints')
+    parser.add_argument('--shared', action='store_true',
+                        help='share one mcp_script process between all endpoints')
+    parser.add_argument('--in-process', action='store_true',
+                        help='import the FastMCP server from mcp_script instead of starting a child process')
+    parser.add_argument('--workers', '-w', type=int, default=0,
+                        help='pre-start a pool of N mcp_script workers shared by all endpoints')
+    args = parser.parse_args()
+    if args.workers < 0:
+        parser.error('--workers must be 0 (no pool) or a positive number')
+
+    mcp_script = args.mcp_script
+
+    # Get endpoints from the config file or environment variables
+    endpoints = load_endpoints(args.config)
+    if not endpoints:
         logger.error("Please set the `MCP_ENDPOINT` environment variable")
         sys.exit(1)
-    
+    logger.info(f"Serving {len(endpoints)} endpoint(s): {', '.join(e.name for e in endpoints)}")
+
     # Start main loop
     try:
-        asyncio.run(connect_with_retry(endpoint_url))
-    except KeyboardInterrupt:
+        asyncio.run(run_endpoints(endpoints, args.shared, args.in_process, args.workers))
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Program interrupted by user")
     except Exception as e:
-        logger.error(f"Program execution error: {e}")
\ No newline at end of file
+        logger.error(f"Program execution error: {e}")
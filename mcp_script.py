@@ -3,9 +3,8 @@ import asyncio
 from mcp.server.fastmcp import FastMCP
 import sys
 import logging
+import importlib
 #from ast import literal_eval
-from taiwan_hsr import tawinhsr_mcp_call
-from go_sheet import account_book_mcp_call
 
 logger = logging.getLogger('MyFirstMCP')
 logger.setLevel(logging.INFO)
@@ -19,9 +18,6 @@ if sys.platform == 'win32':
     sys.stderr.reconfigure(encoding='utf-8')
     sys.stdout.reconfigure(encoding='utf-8')
 
-import math
-import random
-
 # Create an MCP server
 mcp = FastMCP(name="UtilityTools", 
         instructions="""
@@ -29,32 +25,58 @@ mcp = FastMCP(name="UtilityTools",
             """
         )
 
-def safe_math_eval(expr: str):
-    allowed_names = {
-        k: v for k, v in math.__dict__.items() 
-        if not k.startswith("_")  # Exclude private methods
-    }
-    allowed_names.update({"abs": abs, "min": min, "max": max})
-    
-    return eval(expr, {"__builtins__": None}, allowed_names)
-    
+async def load_tool_module(name: str):
+    """
+    Import a tool backend on the first call of its tool. The tools and their
+    schemas are registered at start-up, so `initialize` and `tools/list` are
+    answered without loading aiohttp, gspread or google-auth; the import runs
+    in a thread so it does not block other calls.
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        module = await asyncio.to_thread(importlib.import_module, name)
+    return module
+
 # an calculator
 @mcp.tool()
-def calculator(python_expression: str) -> dict:
+async def calculator(python_expression: str) -> dict:
     """For mathamatical calculation, always use this tool to calculate the result of a python expression. `math` and `random` are available."""
-    try:
-        # 使用更安全的評估方式
-        result = safe_math_eval(python_expression) 
-        #result = eval(python_expression)
-        logger.info(f"Calculating formula: {python_expression}, result: {result}")
-        return {"success": True, "result": result}
-    except Exception as e:
-        logger.error(f"Calculation error: {e}")
-        return {"success": False, "error": str(e)}
+    # 算式先做 AST 檢查，再交給有時間限制的 worker 行程計算
+    calculator_module = await load_tool_module("calculator")
+    result = await calculator_module.calculator_mcp_call_async(python_expression)
+    if result["success"]:
+        logger.info(f"Calculating formula: {python_expression}, result: {result['result']}")
+    else:
+        logger.error(f"Calculation error: {result['error']}")
+    return result
+
+# an calculator for many values at once
+@mcp.tool()
+async def calculator_batch(python_expression: str, variables: dict[str, list[float]]) -> dict:
+    """
+    Evaluate one python expression for many values in a single call, instead of calling `calculator` once per value.
+    For example monthly payments for several interest rates, or a unit conversion over a list of numbers.
+
+    Args:
+        python_expression (str): The expression using the variable names, e.g. "p * r / 12 / (1 - (1 + r / 12) ** (-n))".
+            `math` functions and constants are available.
+        variables (dict[str, list[float]]): The values of each variable, e.g. {"r": [0.01, 0.02, 0.03], "p": [1000000], "n": [240]}.
+            All lists must have the same length; a list with a single value is used for every row.
+
+    Returns:
+        dict: A table with `columns` (the variable names and "result") and one row per set of values in `rows`.
+    """
+    calculator_module = await load_tool_module("calculator")
+    result = await calculator_module.calculator_batch_mcp_call_async(python_expression, variables)
+    if result["success"]:
+        logger.info(f"Calculating formula: {python_expression} over {len(result['rows'])} rows ({result['engine']})")
+    else:
+        logger.error(f"Calculation error: {result['error']}")
+    return result
 
 # taiwan hgig speed railway timetable 
 @mcp.tool()
-async def taiwan_high_speed_rail_timetable(start_station: str, destination_station: str, query_date: str, query_time: str) -> dict:
+async def taiwan_high_speed_rail_timetable(start_station: str, destination_station: str, query_date: str, query_time: str, query_type: str = "depart_after") -> dict:
     """
     For timetable of taiwan high speed rail, always use this tool to search the timetable of a train.
     please provide these paramters below:
@@ -67,25 +89,61 @@ async def taiwan_high_speed_rail_timetable(start_station: str, destination_stati
             **Allowed values: "TaiPei", "NanGang", "BanQiao", "TaoYuan", "XinZhu", "MiaoLi", "TaiZhong", "ZhangHua", "YunLin", "JiaYi", "TaiNan", "ZuoYing".**
             For example, "TaiZhong" means 台中
         query_date (str): The date for the train query in 'YYYY/MM/DD' format. For example, "2025/05/27".
-        query_time (str): The desired departure time for the train query in 'HH:MM' format (24-hour clock). For example, "14:30".
+        query_time (str): The desired time for the train query in 'HH:MM' format (24-hour clock). For example, "14:30".
+        query_type (str): How `query_time` is used. Defaults to "depart_after".
+            **Allowed values: "depart_after", "depart_before", "arrive_by".**
+            - "depart_after": the next trains departing after `query_time`.
+            - "depart_before": the last trains departing before `query_time`.
+            - "arrive_by": the last trains arriving at the destination by `query_time`.
 
     Returns:
         dict: A dictionary containing the train timetable information.
    
     """
-    result = tawinhsr_mcp_call(
+    taiwan_hsr = await load_tool_module("taiwan_hsr")
+    result = await taiwan_hsr.tawinhsr_mcp_call_async(
         start_station,
         destination_station,
         query_date,
-        query_time
+        query_time,
+        query_type
     )
     
     logger.info(f"twhsr timetable: result: {result}")
     return {"success": True, "result": result}
 
+# fastest train over several nearby stations
+@mcp.tool()
+async def taiwan_high_speed_rail_fastest_route(start_stations: list[str], destination_stations: list[str], query_date: str, query_time: str) -> dict:
+    """
+    For "from an area to an area" questions, find the trains of taiwan high speed rail that arrive earliest,
+    searching every combination of the given start and destination stations at once.
+    For example from "TaiPei area" use ["NanGang", "TaiPei", "BanQiao"], to "Kaohsiung area" use ["ZuoYing"].
+
+    Args:
+        start_stations (list[str]): The possible starting stations.
+            **Allowed values: "TaiPei", "NanGang", "BanQiao", "TaoYuan", "XinZhu", "MiaoLi", "TaiZhong", "ZhangHua", "YunLin", "JiaYi", "TaiNan", "ZuoYing".**
+        destination_stations (list[str]): The possible destination stations, same allowed values as `start_stations`.
+        query_date (str): The date for the train query in 'YYYY/MM/DD' format. For example, "2025/05/27".
+        query_time (str): Only trains departing after this time in 'HH:MM' format (24-hour clock). For example, "14:30".
+
+    Returns:
+        dict: The trains departing after `query_time`, ordered by arrival time, with their start and destination stations.
+    """
+    taiwan_hsr = await load_tool_module("taiwan_hsr")
+    result = await taiwan_hsr.tawinhsr_fastest_route_async(
+        start_stations,
+        destination_stations,
+        query_date,
+        query_time
+    )
+
+    logger.info(f"twhsr fastest route: result: {result}")
+    return {"success": True, "result": result}
+
 # an account book (帳本)
 @mcp.tool()
-def account_book(method:str, item_id:int, item_name:str, item_count:int, total_price:int):
+async def account_book(method:str, item_id:int, item_name:str, item_count:int, total_price:int):
     """
     This tool is used to manage ledger(帳本) entries, supporting standard Create, Read, Update, and Delete (CRUD) operations.
 
@@ -113,12 +171,102 @@ def account_book(method:str, item_id:int, item_name:str, item_count:int, total_p
              and might include relevant details about the item or the outcome.
     """
 
-    result = account_book_mcp_call(
+    go_sheet = await load_tool_module("go_sheet")
+    result = await go_sheet.account_book_mcp_call_async(
         method, item_id, item_name, item_count, total_price)
     
     logger.info(f"twhsr timetable: result: {result}")
     return {"success": True, "result": result}
 
+# several account book entries at once (帳本多筆修改)
+@mcp.tool()
+async def account_book_batch(entries: list[dict]):
+    """
+    This tool creates, updates or deletes several ledger(帳本) entries in one call, for example all items of a shopping receipt.
+    Prefer it over calling `account_book` once per item.
+
+    Args:
+        entries (list[dict]): The entries to write. Each entry is a dict with these keys:
+                      - method (str): **'create'**, **'update'** or **'delete'**.
+                      - item_id (int): **0** for 'create', the exact ID of the existing item for 'update' and 'delete'.
+                      - item_name (str): The name or description of the item (ignored for 'delete').
+                      - item_count (int): The quantity of the item (ignored for 'delete').
+                      - total_price (int): The total price of the item(s) (ignored for 'delete').
+
+    Returns:
+        str: One numbered result line per entry, in the same order as `entries`.
+             Created entries include their newly assigned item ID.
+    """
+
+    go_sheet = await load_tool_module("go_sheet")
+    result = await go_sheet.account_book_batch_mcp_call_async(entries)
+
+    logger.info(f"account book batch: result: {result}")
+    return {"success": True, "result": result}
+
+# account book queries (帳本查詢)
+@mcp.tool()
+async def account_book_query(query: str, start_date: str = "", end_date: str = "", item_name: str = "", status: str = "", top_n: int = 10):
+    """
+    This tool answers questions over many ledger(帳本) entries at once, like "how much did I spend this month" or "find all entries named X".
+
+    Args:
+        query (str): The query to run.
+                     - If **'sum'**: the number of entries, the total item count and the total price of the matching entries.
+                     - If **'list'**: the matching entries with their item IDs.
+                     - If **'top'**: the `top_n` matching entries with the highest total price.
+        start_date (str): The first date in 'YYYY-MM-DD' format. Leave empty for no lower bound.
+        end_date (str): The last date in 'YYYY-MM-DD' format. Leave empty for no upper bound.
+        item_name (str): Only entries with this item name, or names containing it. Leave empty for all items.
+        status (str): Only entries with this status: 'create' (never updated or deleted), 'update' or 'deleted'. Leave empty for all entries that are not deleted.
+        top_n (int): How many entries to return for 'top'. Defaults to 10.
+
+    Returns:
+        str: The totals or the list of matching entries.
+    """
+
+    # The first query loads the whole sheet through gspread, run it in a thread
+    go_sheet = await load_tool_module("go_sheet")
+    result = await asyncio.to_thread(
+        go_sheet.account_book_query_mcp_call, query, start_date, end_date, item_name, status, top_n)
+
+    logger.info(f"account book query: result: {result}")
+    return {"success": True, "result": result}
+
+async def close_tool_clients():
+    """
+    Close the HTTP connection pools of the tool backends that were loaded, so
+    aiohttp does not warn about unclosed client sessions when the server exits.
+    """
+    go_sheet = sys.modules.get("go_sheet")
+    if go_sheet is not None:
+        await go_sheet.close_async_client()
+    taiwan_hsr = sys.modules.get("taiwan_hsr")
+    if taiwan_hsr is not None and taiwan_hsr.shared_client is not None:
+        await taiwan_hsr.shared_client.aclose()
+
+async def run_stdio():
+    """
+    Run the server on stdio. The tools print progress with print(), which must
+    not end up between JSON-RPC messages, so stdout is reserved for the protocol
+    and print() is sent to stderr.
+    """
+    import anyio
+    from io import TextIOWrapper
+    from mcp.server.stdio import stdio_server
+
+    protocol_stdout = anyio.wrap_file(TextIOWrapper(sys.stdout.buffer, encoding='utf-8'))
+    sys.stdout = sys.stderr
+    try:
+        async with stdio_server(stdout=protocol_stdout) as (read_stream, write_stream):
+            await mcp._mcp_server.run(
+                read_stream,
+                write_stream,
+                mcp._mcp_server.create_initialization_options()
+            )
+    finally:
+        await close_tool_clients()
+
 # Start the server
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    asyncio.run(run_stdio())
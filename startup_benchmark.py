@@ -0,0 +1,138 @@
+"""
+Measure the cold-start cost of an MCP server script, i.e. what mcp_pipe pays
+every time it spawns a child.
+
+Usage:
+
+python startup_benchmark.py [mcp_script.py] [--runs 5] [--top 15]
+                            [--max-import-ms 900] [--max-start-ms 1500]
+
+It reports:
+  - the `python -X importtime` breakdown of importing the script, with the
+    slowest direct imports first,
+  - the wall time from starting `python mcp_script.py` until the answer to
+    `initialize` arrives,
+  - tool backends that were imported at start-up although they should only be
+    loaded on the first tool call (see `--lazy`).
+
+The exit code is 1 when a limit is exceeded or a lazy module was imported, so
+the script can guard against cold-start regressions.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules that mcp_script.py only imports when a tool is first called
+LAZY_MODULES = ['taiwan_hsr', 'go_sheet', 'calculator', 'aiohttp', 'gspread', 'google.oauth2']
+
+INITIALIZE_REQUEST = {
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "initialize",
+    "params": {
+        "protocolVersion": "2024-11-05",
+        "capabilities": {},
+        "clientInfo": {"name": "startup_benchmark", "version": "1.0"}
+    }
+}
+
+def script_env(script_dir):
+    env = os.environ.copy()
+    env['PYTHONPATH'] = script_dir + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+def parse_importtime(stderr):
+    """Return [(name, depth, self_us, cumulative_us)] from `-X importtime` output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+def measure_import(module, script_dir, workdir):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=workdir, env=script_env(script_dir), capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+    return parse_importtime(result.stderr)
+
+def measure_start(script, workdir):
+    """Seconds from process start until the initialize response is read"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, script], cwd=workdir, env=script_env(os.path.dirname(script)),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    try:
+        process.stdin.write(json.dumps(INITIALIZE_REQUEST) + '\n')
+        process.stdin.flush()
+        line = process.stdout.readline()
+        elapsed = time.perf_counter() - start
+        if not line:
+            raise RuntimeError(f"{script} exited without answering initialize")
+        return elapsed
+    finally:
+        process.kill()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold-start time of an MCP server script')
+    parser.add_argument('mcp_script', nargs='?', default='mcp_script.py', help='MCP server script to measure')
+    parser.add_argument('--runs', '-n', type=int, default=5, help='number of measurements, the median is reported')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports to list')
+    parser.add_argument('--max-import-ms', type=float, default=0, help='fail when importing the script takes longer')
+    parser.add_argument('--max-start-ms', type=float, default=0, help='fail when answering initialize takes longer')
+    parser.add_argument('--lazy', nargs='*', default=LAZY_MODULES,
+                        help='modules that must not be imported at start-up')
+    args = parser.parse_args()
+
+    script = os.path.abspath(args.mcp_script)
+    script_dir = os.path.dirname(script)
+    module = os.path.splitext(os.path.basename(script))[0]
+    failed = False
+
+    # Run in a scratch directory so the log files of the script end up there
+    with tempfile.TemporaryDirectory() as workdir:
+        import_runs = [measure_import(module, script_dir, workdir) for _ in range(args.runs)]
+        start_runs = [measure_start(script, workdir) for _ in range(args.runs)]
+
+    totals = [next(e[3] for e in entries if e[0] == module) for entries in import_runs]
+    import_ms = statistics.median(totals) / 1000
+    start_ms = statistics.median(start_runs) * 1000
+
+    # Direct imports of the script from the median run, slowest first
+    entries = import_runs[totals.index(sorted(totals)[len(totals) // 2])]
+    script_depth = next(e[1] for e in entries if e[0] == module)
+    direct = [e for e in entries if e[1] == script_depth + 1]
+    print(f"import {module}: {import_ms:.1f} ms (median of {args.runs})")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for name, _, self_us, cumulative_us in sorted(direct, key=lambda e: e[3], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {name}")
+    print(f"start until initialize answered: {start_ms:.1f} ms (median of {args.runs})")
+
+    imported = {e[0] for e in entries}
+    eager = [name for name in args.lazy if name in imported]
+    if eager:
+        print(f"FAIL: imported at start-up: {', '.join(eager)}")
+        failed = True
+    if args.max_import_ms and import_ms > args.max_import_ms:
+        print(f"FAIL: import time {import_ms:.1f} ms > {args.max_import_ms} ms")
+        failed = True
+    if args.max_start_ms and start_ms > args.max_start_ms:
+        print(f"FAIL: start time {start_ms:.1f} ms > {args.max_start_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
 import asyncio
+import atexit
+import bisect
 import aiohttp
 import requests
 import argparse
 import sys
 import logging
+import threading
+import codecs
+import difflib
+import heapq
 import json
-from typing import Dict, Any, Optional
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple, Union
 from datetime import datetime
+from http_session import close_session
 
 logger = logging.getLogger('TaiwanHSR_MCP')
 logger.setLevel(logging.INFO)
@@ -15,10 +29,44 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
+# HTTP 連線池設定
+HTTP_POOL_LIMIT = 10            # 連線池最大連線數
+HTTP_POOL_LIMIT_PER_HOST = 4    # 每個主機最大連線數
+HTTP_KEEPALIVE_TIMEOUT = 60     # 閒置連線保留秒數
+HTTP_TIMEOUT = 20               # 請求超時秒數
+HTTP_STREAM_CHUNK = 16 * 1024   # 串流解析時每次讀取的位元組數
+
 class AsyncTHSRClient:
-    """台灣高鐵非同步 HTTP 客戶端"""
+    """
+    台灣高鐵非同步 HTTP 客戶端
+
+    客戶端自己持有長期的連線池 (aiohttp connector / requests.Session)，
+    多次查詢共用同一組 TCP/TLS 連線，不再每次查詢重新建立連線。
+    """
     
-    def __init__(self):
+    def __init__(
+        self,
+        limit: int = HTTP_POOL_LIMIT,
+        limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+        timeout: float = HTTP_TIMEOUT
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session = None          # aiohttp.ClientSession，綁定建立時的 event loop
+        self._session_loop = None
+        self._sync_session = None     # requests.Session
+        self._inflight = {}           # 進行中的非同步查詢 {flight_key: asyncio.Task}
+        self._sync_inflight = {}      # 進行中的同步查詢 {flight_key: {'done', 'result'}}
+        self._sync_lock = threading.Lock()
+        self._stats = {
+            'async_requests': 0,
+            'async_connections_created': 0,
+            'async_connections_reused': 0,
+            'coalesced_requests': 0
+        }
         self.base_url = "https://www.thsrc.com.tw/TimeTable/Search"
         self.headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -30,7 +78,107 @@ class AsyncTHSRClient:
             'Referer': 'https://www.thsrc.com.tw',
             'X-Requested-With': 'XMLHttpRequest'
         }
-    # Donot use the aysnc funcation in FastMCP stdio
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """取得共用的 aiohttp 會話，不同 event loop 會重新建立"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._session_loop is loop:
+            return self._session
+        # 舊的 event loop 已經不能使用，換上新的會話後再關閉舊的
+        old_session, old_loop = self._session, self._session_loop
+        
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers=self.headers,
+            trace_configs=[trace_config]
+        )
+        self._session_loop = loop
+        await close_session(old_session, old_loop)
+        return self._session
+
+    @staticmethod
+    def flight_key(form_data: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        """
+        查詢表單正規化後的 key，相同 key 的查詢結果相同
+
+        單程查詢 (SearchType 'S') 回傳的是去程日期全天的班次，與去程時間、
+        回程日期時間都無關，不列入 key；不同時間的查詢共用同一個請求，
+        由呼叫端依時間過濾。
+        """
+        normalized = {name: str(value).strip() for name, value in form_data.items()}
+        if normalized.get('SearchType') == 'S':
+            normalized.pop('OutWardSearchTime', None)
+            normalized.pop('ReturnSearchDate', None)
+            normalized.pop('ReturnSearchTime', None)
+        return tuple(sorted(normalized.items()))
+
+    def get_sync_session(self) -> requests.Session:
+        """取得共用的 requests 會話"""
+        if self._sync_session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self.limit,
+                pool_maxsize=self.limit_per_host
+            )
+            self._sync_session = requests.Session()
+            self._sync_session.headers.update(self.headers)
+            self._sync_session.mount('https://', adapter)
+            self._sync_session.mount('http://', adapter)
+        return self._sync_session
+
+    async def _on_request_start(self, session, ctx, params):
+        self._stats['async_requests'] += 1
+
+    async def _on_connection_create_end(self, session, ctx, params):
+        self._stats['async_connections_created'] += 1
+
+    async def _on_connection_reuseconn(self, session, ctx, params):
+        self._stats['async_connections_reused'] += 1
+
+    def connection_stats(self) -> Dict[str, int]:
+        """連線重用統計"""
+        stats = dict(self._stats)
+        sync_requests = 0
+        sync_connections = 0
+        if self._sync_session is not None:
+            for adapter in set(self._sync_session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    sync_requests += pool.num_requests
+                    sync_connections += pool.num_connections
+        stats['sync_requests'] = sync_requests
+        stats['sync_connections_created'] = sync_connections
+        stats['sync_connections_reused'] = max(sync_requests - sync_connections, 0)
+        return stats
+
+    async def aclose(self):
+        """關閉所有連線"""
+        session, self._session = self._session, None
+        await close_session(session, self._session_loop)
+        self.close_sync()
+
+    def close_sync(self):
+        """關閉同步連線池"""
+        if self._sync_session is not None:
+            self._sync_session.close()
+            self._sync_session = None
     async def search_timetable(
         self,
         start_station: str = 'NanGang',
@@ -41,8 +189,9 @@ class AsyncTHSRClient:
         return_time: str = '18:00',
         search_type: str = 'S',
         lang: str = 'TW',
-        discount_type: str = ''
-    ) -> Dict[Any, Any]:
+        discount_type: str = '',
+        stream: bool = False
+    ) -> Union[Dict[Any, Any], 'RouteTimetable']:
         """
         非同步查詢高鐵時刻表
         
@@ -56,9 +205,11 @@ class AsyncTHSRClient:
             search_type: 搜尋類型 ('S' 為標準搜尋)
             lang: 語言 ('TW' 為繁體中文)
             discount_type: 折扣類型
+            stream: 邊讀邊解析回應，直接回傳 RouteTimetable，不保留原始 JSON
             
         Returns:
-            Dict: 時刻表查詢結果的 JSON 數據
+            Dict: 時刻表查詢結果的 JSON 數據；stream=True 時成功回傳 RouteTimetable，
+                  失敗仍回傳錯誤的 dict
         """
         
         # 準備 POST 表單數據
@@ -74,58 +225,105 @@ class AsyncTHSRClient:
             'DiscountType': discount_type
         }
         
+        # 相同的查詢正在進行時，等待同一個結果，不再送出新的請求
+        loop = asyncio.get_running_loop()
+        key = self.flight_key(form_data)
+        if stream:
+            key += (('stream', True),)
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not loop:
+            if stream:
+                task = loop.create_task(self._stream_timetable(form_data))
+            else:
+                task = loop.create_task(self._post_timetable(form_data))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key, None) if self._inflight.get(key) is done else None)
+        else:
+            self._stats['coalesced_requests'] += 1
+        # 呼叫端被取消時不影響其他等待同一個查詢的呼叫端
+        return await asyncio.shield(task)
+
+    async def _post_timetable(self, form_data: Dict[str, str]) -> Dict[Any, Any]:
         #print(f"發送請求到: {self.base_url}")
         #print(f"表單數據: {form_data}")
         
         try:
-            # 創建 aiohttp 會話
-            timeout = aiohttp.ClientTimeout(total=20)  # 20秒超時
-            
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    self.base_url,
-                    data=form_data,
-                    headers=self.headers
-                ) as response:
-                    
-                    # print(f"HTTP 狀態碼: {response.status}")
-                    # print(f"響應標頭: {dict(response.headers)}")
+            # 使用共用的 aiohttp 會話 (連線池)
+            session = await self.get_session()
+            async with session.post(
+                self.base_url,
+                data=form_data
+            ) as response:
+                
+                # print(f"HTTP 狀態碼: {response.status}")
+                # print(f"響應標頭: {dict(response.headers)}")
+                
+                if response.status == 200:
+                    content_type = response.headers.get('content-type', '')
                     
-                    if response.status == 200:
-                        content_type = response.headers.get('content-type', '')
-                        
-                        if 'application/json' in content_type:
-                            # 如果是 JSON 響應
-                            json_data = await response.json()
-                            print("成功獲取 JSON 數據")
-                            return json_data
-                        else:
-                            # 如果不是 JSON，獲取文本內容
-                            text_data = await response.text()
-                            print(f"獲取文本響應，長度: {len(text_data)}")
-                            
-                            # 嘗試解析 JSON（有時服務器返回 JSON 但 content-type 不正確）
-                            try:
-                                json_data = json.loads(text_data)
-                                print("成功從文本解析 JSON 數據")
-                                return json_data
-                            except json.JSONDecodeError:
-                                print("無法解析為 JSON，返回原始文本")
-                                return {
-                                    "error": "非 JSON 響應",
-                                    "content_type": content_type,
-                                    "raw_text": text_data[:500]  # 只返回前1000字符
-                                }
+                    if 'application/json' in content_type:
+                        # 如果是 JSON 響應
+                        json_data = await response.json()
+                        print("成功獲取 JSON 數據")
+                        return json_data
                     else:
-                        error_text = await response.text()
-                        return {
-                            "error": f"HTTP 錯誤 {response.status}",
-                            "status": response.status,
-                            "response": error_text[:500]
-                        }
+                        # 如果不是 JSON，獲取文本內容
+                        text_data = await response.text()
+                        print(f"獲取文本響應，長度: {len(text_data)}")
                         
+                        # 嘗試解析 JSON（有時服務器返回 JSON 但 content-type 不正確）
+                        try:
+                            json_data = json.loads(text_data)
+                            print("成功從文本解析 JSON 數據")
+                            return json_data
+                        except json.JSONDecodeError:
+                            print("無法解析為 JSON，返回原始文本")
+                            return {
+                                "error": "非 JSON 響應",
+                                "content_type": content_type,
+                                "raw_text": text_data[:500]  # 只返回前1000字符
+                            }
+                else:
+                    error_text = await response.text()
+                    return {
+                        "error": f"HTTP 錯誤 {response.status}",
+                        "status": response.status,
+                        "response": error_text[:500]
+                    }
+                    
+        except asyncio.TimeoutError:
+            return {"error": "請求超時", "timeout": self.timeout}
+        except aiohttp.ClientError as e:
+            return {"error": f"客戶端錯誤: {str(e)}"}
+        except Exception as e:
+            return {"error": f"未知錯誤: {str(e)}"}
+
+    async def _stream_timetable(self, form_data: Dict[str, str]) -> Union[Dict[Any, Any], 'RouteTimetable']:
+        try:
+            session = await self.get_session()
+            async with session.post(
+                self.base_url,
+                data=form_data
+            ) as response:
+                
+                if response.status != 200:
+                    error_text = await response.text()
+                    return {
+                        "error": f"HTTP 錯誤 {response.status}",
+                        "status": response.status,
+                        "response": error_text[:500]
+                    }
+                
+                parser = TrainItemStream(response.charset or 'utf-8')
+                async for chunk in response.content.iter_chunked(HTTP_STREAM_CHUNK):
+                    parser.feed(chunk)
+                result = parser.result()
+                if isinstance(result, RouteTimetable):
+                    print(f"串流解析 {len(result)} 班次，讀取 {parser.size} bytes")
+                return result
+                    
         except asyncio.TimeoutError:
-            return {"error": "請求超時", "timeout": 30}
+            return {"error": "請求超時", "timeout": self.timeout}
         except aiohttp.ClientError as e:
             return {"error": f"客戶端錯誤: {str(e)}"}
         except Exception as e:
@@ -174,13 +372,34 @@ class AsyncTHSRClient:
             'DiscountType': discount_type
         }
         
+        # 相同的查詢正在進行時，等待同一個結果，不再送出新的請求
+        key = self.flight_key(form_data)
+        with self._sync_lock:
+            flight = self._sync_inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'result': {"error": "請求中斷"}}
+                self._sync_inflight[key] = flight
+            else:
+                self._stats['coalesced_requests'] += 1
+        if not leader:
+            flight['done'].wait()
+            return flight['result']
+        try:
+            flight['result'] = self._post_timetable_sync(form_data)
+        finally:
+            with self._sync_lock:
+                del self._sync_inflight[key]
+            flight['done'].set()
+        return flight['result']
+
+    def _post_timetable_sync(self, form_data: Dict[str, str]) -> Dict[Any, Any]:
         try:
-            # 使用 requests 發送同步 POST 請求
-            response = requests.post(
+            # 使用共用的 requests 會話 (連線池) 發送同步 POST 請求
+            response = self.get_sync_session().post(
                 self.base_url,
                 data=form_data,
-                headers=self.headers,
-                timeout=20  # 20秒超時
+                timeout=self.timeout
             )
             
             if response.status_code == 200:
@@ -217,46 +436,537 @@ class AsyncTHSRClient:
                 }
                 
         except requests.Timeout:
-            return {"error": "請求超時", "timeout": 20}
+            return {"error": "請求超時", "timeout": self.timeout}
         except requests.RequestException as e:
             return {"error": f"請求錯誤: {str(e)}"}
         except Exception as e:
             return {"error": f"未知錯誤: {str(e)}"}
+
+    async def get_station_info(self) -> Dict[str, str]:
+        """
+        獲取高鐵站點資訊
         
-        async def get_station_info(self) -> Dict[str, str]:
-            """
-            獲取高鐵站點資訊
-            
-            Returns:
-                Dict: 站點代碼對應表
-            """
-            return stationinfo_list()
+        Returns:
+            Dict: 站點代碼對應表
+        """
+        return stationinfo_list()
        
 
+# 時刻表快取設定
+TIMETABLE_CACHE_TTL = 6 * 60 * 60   # 快取保留秒數
+TIMETABLE_CACHE_SIZE = 256          # 最多保留的路線/日期數
+
+class TimetableCache:
+    """
+    時刻表快取 (LRU + TTL)
+
+    同一天同一路線的時刻表回應是全天的班次，查詢時間只用來過濾，
+    所以用 (起站, 迄站, 日期) 當 key，保存解析好的 RouteTimetable，
+    不同的查詢時間都由快取回答。
+    跨日後舊資料一律視為過期，避免時刻表異動後還回答舊班次。
+    """
+
+    def __init__(self, ttl: float = TIMETABLE_CACHE_TTL, maxsize: int = TIMETABLE_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (過期時間, 建立日期, 結果)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(params: Dict[str, str]) -> Tuple[str, str, str]:
+        return (params['start_station'], params['end_station'], params['outward_date'])
+
+    def get(self, key) -> Optional['RouteTimetable']:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, fetched_day, result = entry
+            if time.monotonic() < expires and fetched_day == datetime.now().date():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, timetable: 'RouteTimetable'):
+        if timetable is None:
+            return
+        # 從本地索引讀出的時刻表只保留剩下的有效時間
+        age = max(time.time() - timetable.fetched_at, 0)
+        self._entries[key] = (time.monotonic() + self.ttl - age, datetime.now().date(), timetable)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+timetable_cache = TimetableCache()
+
+# 全線時刻表本地索引設定
+THSR_INDEX_FILE = 'thsr_timetable.db'  # SQLite 索引檔
+THSR_SYNC_CONCURRENCY = 6              # 同步全線時刻表時的併發查詢數
+THSR_ROUTE_CONCURRENCY = HTTP_POOL_LIMIT_PER_HOST  # 多起迄站查詢時的併發查詢數
+
+class TimetableIndex:
+    """
+    全線時刻表本地索引 (SQLite)
+
+    routes 表保存每條路線/日期的標題與票價，trains 表保存每個班次，
+    以 (起站, 迄站, 日期, 發車分鐘) 建索引，查詢一條路線只需要一次索引掃描。
+    --sync 寫入的路線 (synced=1) 一直有效到日期過去被 prune 為止；
+    一般查詢順便寫入的路線只在 ttl 秒內有效，和記憶體快取相同。
+    非同步查詢在執行緒裡讀寫索引，連線可以跨執行緒使用，由 lock 保護。
+    """
+
+    def __init__(self, path: str = THSR_INDEX_FILE, ttl: float = TIMETABLE_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self, create: bool = False) -> Optional[sqlite3.Connection]:
+        """開啟索引檔，create=False 時檔案不存在就回傳 None (呼叫端要持有 lock)"""
+        if self.conn is not None:
+            return self.conn
+        if not create and not os.path.exists(self.path):
+            return None
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS routes (
+                start TEXT, dest TEXT, date TEXT,
+                title TEXT, price TEXT, fetched_at REAL, synced INTEGER DEFAULT 0,
+                PRIMARY KEY (start, dest, date)
+            );
+            CREATE TABLE IF NOT EXISTS trains (
+                start TEXT, dest TEXT, date TEXT, dep_min INTEGER,
+                train_no TEXT, dep TEXT, arr TEXT, duration TEXT
+            );
+            CREATE INDEX IF NOT EXISTS trains_route ON trains (start, dest, date, dep_min);
+        """)
+        # 舊版的索引檔沒有 synced 欄位，裡面的路線都當成一般查詢的結果
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(routes)')]
+        if 'synced' not in columns:
+            self.conn.execute('ALTER TABLE routes ADD COLUMN synced INTEGER DEFAULT 0')
+        return self.conn
+
+    def store(self, key: Tuple[str, str, str], timetable: 'RouteTimetable', synced: bool = False) -> bool:
+        """把一條路線完整的全天時刻表寫入索引，synced=True 表示由 --sync 寫入"""
+        if timetable is None:
+            return False
+        rows = [key + (dep_min,) + train for dep_min, train in zip(timetable.dep_minutes, timetable.trains)]
+        with self.lock, self.connect(create=True) as conn:
+            conn.execute('DELETE FROM trains WHERE start=? AND dest=? AND date=?', key)
+            conn.executemany('INSERT INTO trains VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO routes (start, dest, date, title, price, fetched_at, synced) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', key + (
+                json.dumps(timetable.title, ensure_ascii=False),
+                json.dumps(timetable.price_table, ensure_ascii=False),
+                timetable.fetched_at,
+                int(synced)
+            ))
+        return True
+
+    def lookup(self, key: Tuple[str, str, str]) -> Optional['RouteTimetable']:
+        """從索引讀出一條路線的時刻表，沒有資料或資料已經過期時回傳 None"""
+        with self.lock:
+            conn = self.connect()
+            if conn is None:
+                return None
+            route = conn.execute(
+                'SELECT title, price, fetched_at, synced FROM routes WHERE start=? AND dest=? AND date=?', key).fetchone()
+            if route is None:
+                return None
+            title, price, fetched_at, synced = route
+            if not synced and (fetched_at or 0) < time.time() - self.ttl:
+                return None
+            trains = conn.execute(
+                'SELECT train_no, dep, arr, duration FROM trains '
+                'WHERE start=? AND dest=? AND date=? ORDER BY dep_min', key).fetchall()
+        # --sync 的資料在記憶體快取裡也保留完整的 ttl
+        return RouteTimetable(json.loads(title), json.loads(price), trains,
+                              fetched_at=None if synced else fetched_at)
+
+    def prune(self, before_date: str):
+        """刪除 before_date 之前的舊日期"""
+        with self.lock:
+            conn = self.connect()
+            if conn is None:
+                return
+            with conn:
+                conn.execute('DELETE FROM trains WHERE date < ?', (before_date,))
+                conn.execute('DELETE FROM routes WHERE date < ?', (before_date,))
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+timetable_index = TimetableIndex()
+
+def time_to_minutes(hhmm: str) -> int:
+    """'HH:MM' 轉成當天的分鐘數"""
+    hour, minute = hhmm.split(':')[:2]
+    return int(hour) * 60 + int(minute)
+
+# 時刻表查詢方式
+QUERY_DEPART_AFTER = 'depart_after'    # 指定時間之後出發的班次
+QUERY_DEPART_BEFORE = 'depart_before'  # 指定時間之前出發的最後幾班
+QUERY_ARRIVE_BY = 'arrive_by'          # 指定時間之前抵達的最後幾班
+QUERY_TYPES = (QUERY_DEPART_AFTER, QUERY_DEPART_BEFORE, QUERY_ARRIVE_BY)
+QUERY_TIME_PATTERN = re.compile(r'([01]?\d|2[0-3]):[0-5]\d')  # 24 小時制 HH:MM
+
+def check_timetable_query(query_time: str, query_type: str = QUERY_DEPART_AFTER) -> str:
+    """檢查查詢時間與查詢方式，有問題時回傳錯誤訊息，沒有問題回傳空字串"""
+    if query_type not in QUERY_TYPES:
+        return f"不支援的查詢方式: {query_type}，請使用 {', '.join(QUERY_TYPES)}"
+    if not isinstance(query_time, str) or not QUERY_TIME_PATTERN.fullmatch(query_time):
+        return f"查詢時間格式錯誤: {query_time}，請使用 24 小時制 HH:MM"
+    return ''
+
+class RouteTimetable:
+    """
+    一條路線一天的時刻表
+
+    班次依發車時間排序，另外保存發車分鐘與抵達分鐘的排序陣列，
+    「某時間之後/之前的 N 班」都是一次 bisect 加上切片。
+    班次是 (車次, 發車時間, 到達時間, 行車時間) 的 tuple。
+    fetched_at 是資料從網路取得的時間 (time.time())，預設為現在。
+    """
+
+    def __init__(self, title: Dict[str, Any], price_table: Dict[str, Any], trains: list,
+                 fetched_at: Optional[float] = None):
+        self.title = title
+        self.price_table = price_table
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        trains = sorted(trains, key=lambda train: time_to_minutes(train[1]))
+        self.trains = trains
+        self.dep_minutes = [time_to_minutes(train[1]) for train in trains]
+        # 跨午夜抵達的班次，抵達時間加一天
+        arr_minutes = []
+        for dep_min, train in zip(self.dep_minutes, trains):
+            arr_min = time_to_minutes(train[2])
+            arr_minutes.append(arr_min + 24 * 60 if arr_min < dep_min else arr_min)
+        self.train_arr_minutes = arr_minutes    # 依發車順序的抵達分鐘
+        self.arr_order = sorted(range(len(trains)), key=lambda i: arr_minutes[i])
+        self.arr_minutes = [arr_minutes[i] for i in self.arr_order]
+
+    @classmethod
+    def from_result(cls, result: Dict[Any, Any]) -> Optional['RouteTimetable']:
+        """從高鐵 API 的 JSON 回應建立時刻表，查詢失敗時回傳 None"""
+        if 'error' in result or not result.get('success', False):
+            return None
+        data = result.get('data', {})
+        departure_table = data.get('DepartureTable', {})
+        trains = []
+        for train in departure_table.get('TrainItem', []):
+            departure_time = train.get('DepartureTime', 'N/A')
+            destination_time = train.get('DestinationTime', 'N/A')
+            if departure_time == 'N/A' or destination_time == 'N/A':
+                continue
+            trains.append((
+                train.get('TrainNumber', 'N/A'),
+                departure_time,
+                destination_time,
+                train.get('Duration', 'N/A')
+            ))
+        return cls(departure_table.get('Title', {}), data.get('PriceTable', {}), trains)
+
+    def __len__(self) -> int:
+        return len(self.trains)
+
+    def depart_after(self, minutes: int, count: int) -> list:
+        """minutes 之後 (不含) 出發的前 count 班"""
+        start = bisect.bisect_right(self.dep_minutes, minutes)
+        return self.trains[start:start + count] if count > 0 else self.trains[start:]
+
+    def depart_before(self, minutes: int, count: int) -> list:
+        """minutes 之前 (不含) 出發的最後 count 班"""
+        end = bisect.bisect_left(self.dep_minutes, minutes)
+        return self.trains[max(end - count, 0) if count > 0 else 0:end]
+
+    def arrive_by(self, minutes: int, count: int) -> list:
+        """minutes 之前 (含) 抵達的最後 count 班，依發車時間排列"""
+        end = bisect.bisect_right(self.arr_minutes, minutes)
+        indexes = self.arr_order[max(end - count, 0) if count > 0 else 0:end]
+        return [self.trains[i] for i in sorted(indexes)]
+
+    def arrive_first(self, minutes: int, count: int) -> list:
+        """
+        minutes 之後 (不含) 出發、最早抵達的 count 班，依抵達時間排列
+
+        晚發車的直達車可能比早發車的班次先到，所以依發車時間往後掃描，
+        已經有 count 班而下一班發車時已晚於其中最晚的抵達時間就停止。
+        """
+        count = count if count > 0 else len(self.trains)
+        best = []   # (-抵達分鐘, -班次位置)，堆頂是目前最晚抵達的一班
+        for i in range(bisect.bisect_right(self.dep_minutes, minutes), len(self.trains)):
+            if len(best) >= count and self.dep_minutes[i] > -best[0][0]:
+                break
+            heapq.heappush(best, (-self.train_arr_minutes[i], -i))
+            if len(best) > count:
+                heapq.heappop(best)
+        return [self.trains[-i] for _, i in sorted(best, reverse=True)]
+
+    def query(self, query_type: str, hhmm: str, count: int) -> list:
+        if query_type not in QUERY_TYPES:
+            raise ValueError(f"unknown query_type: {query_type}")
+        if hhmm == 'N/A':
+            return self.trains[:count] if count > 0 else list(self.trains)
+        minutes = time_to_minutes(hhmm)
+        if query_type == QUERY_DEPART_BEFORE:
+            return self.depart_before(minutes, count)
+        if query_type == QUERY_ARRIVE_BY:
+            return self.arrive_by(minutes, count)
+        return self.depart_after(minutes, count)
+
+# TrainItem 陣列的開頭，以及班次之間的空白與逗號
+TRAIN_ITEM_START = re.compile(r'"TrainItem"\s*:\s*\[')
+TRAIN_ITEM_GAP = re.compile(r'[\s,]*')
+
+class TrainItemStream:
+    """
+    高鐵時刻表回應的串流解析器
+
+    回應分段餵入，TrainItem 陣列裡每讀完一筆班次就轉成 RouteTimetable 用的 tuple，
+    不保留原始 dict；陣列以外的部分 (success、Title、PriceTable) 很小，保留下來最後一次解析。
+    回應一定讀到最後：success 可能排在 data 之後，班次也不保證依發車時間排列，
+    讀到一半就停止的話，無法確認查詢成功，也可能漏掉較早出發的班次。
+    """
+
+    def __init__(self, encoding: str = 'utf-8'):
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.json_decoder = json.JSONDecoder()
+        self.state = 'head'   # head: 還沒讀到 TrainItem，items: 陣列內，tail: 陣列之後
+        self.buffer = ''      # 還沒處理的文字
+        self.scanned = 0      # head 狀態下已經找過 TrainItem 的長度
+        self.outside = []     # TrainItem 陣列以外的文字
+        self.trains = []
+        self.size = 0
+
+    def feed(self, chunk: bytes):
+        """餵入一段回應"""
+        self.size += len(chunk)
+        self.buffer += self.decoder.decode(chunk)
+        if self.state == 'head':
+            match = TRAIN_ITEM_START.search(self.buffer, max(self.scanned - 64, 0))
+            if match is None:
+                self.scanned = len(self.buffer)
+                return
+            self.outside.append(self.buffer[:match.end()])
+            self.buffer = self.buffer[match.end():]
+            self.state = 'items'
+        if self.state == 'items':
+            self.read_items()
+        if self.state == 'tail':
+            self.outside.append(self.buffer)
+            self.buffer = ''
+
+    def read_items(self):
+        buffer = self.buffer
+        pos = 0
+        while True:
+            pos = TRAIN_ITEM_GAP.match(buffer, pos).end()
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                self.outside.append(']')
+                self.state = 'tail'
+                pos += 1
+                break
+            try:
+                item, pos = self.json_decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # 這一筆還沒收完整，等下一段
+                break
+            if isinstance(item, dict):
+                self.add_train(item)
+        self.buffer = buffer[pos:]
+
+    def add_train(self, item: Dict[str, Any]):
+        departure_time = item.get('DepartureTime', 'N/A')
+        destination_time = item.get('DestinationTime', 'N/A')
+        if departure_time == 'N/A' or destination_time == 'N/A':
+            return
+        self.trains.append((
+            item.get('TrainNumber', 'N/A'),
+            departure_time,
+            destination_time,
+            item.get('Duration', 'N/A')
+        ))
+
+    def result(self) -> Union[Dict[Any, Any], RouteTimetable]:
+        """解析結果：成功回傳 RouteTimetable，失敗回傳與 search_timetable 相同格式的 dict"""
+        self.buffer += self.decoder.decode(b'', final=True)
+        if self.state == 'head':
+            # 沒有 TrainItem 的回應 (查詢失敗或不是 JSON)，整份解析
+            try:
+                data = json.loads(self.buffer)
+            except json.JSONDecodeError:
+                return {"error": "非 JSON 響應", "raw_text": self.buffer[:500]}
+            timetable = RouteTimetable.from_result(data) if isinstance(data, dict) else None
+            # 沒有班次的時刻表也是查詢成功
+            return timetable if timetable is not None else data
+        if self.state == 'items':
+            return {"error": "回應不完整", "raw_text": self.buffer[:500]}
+        text = ''.join(self.outside)
+        try:
+            meta = json.loads(text)
+        except json.JSONDecodeError:
+            return {"error": "非 JSON 響應", "raw_text": text[:500]}
+        if 'error' in meta or not meta.get('success', False):
+            return meta
+        data = meta.get('data', {})
+        title = data.get('DepartureTable', {}).get('Title', {})
+        return RouteTimetable(title, data.get('PriceTable', {}), self.trains)
+
+async def sync_timetable_index(query_date: str, concurrency: int = THSR_SYNC_CONCURRENCY,
+                               index: TimetableIndex = None) -> Dict[str, int]:
+    """
+    下載指定日期全線所有起迄站組合的時刻表，寫入本地索引
+
+    Args:
+        query_date: 日期 (YYYY/MM/DD)
+        concurrency: 同時進行的查詢數
+        index: 寫入的索引，預設為 timetable_index
+
+    Returns:
+        Dict: 成功與失敗的路線數
+    """
+    index = index or timetable_index
+    codes = list(stationinfo_list().keys())
+    pairs = [(start, dest) for start in codes for dest in codes if start != dest]
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async with AsyncTHSRClient(limit=concurrency, limit_per_host=concurrency) as client:
+        async def fetch(start: str, dest: str):
+            async with semaphore:
+                return await client.search_timetable(start, dest, query_date, '00:00', query_date, '00:00', stream=True)
+        
+        print(f"正在同步 {query_date} 全線 {len(pairs)} 條路線...")
+        start_time = datetime.now()
+        results = await asyncio.gather(*(fetch(start, dest) for start, dest in pairs), return_exceptions=True)
+        elapsed = (datetime.now() - start_time).total_seconds()
+    
+    summary = {'routes': len(pairs), 'stored': 0, 'failed': 0}
+    for (start, dest), result in zip(pairs, results):
+        if isinstance(result, RouteTimetable) and await asyncio.to_thread(index.store, (start, dest, query_date), result, True):
+            summary['stored'] += 1
+        else:
+            summary['failed'] += 1
+            logger.warning(f"sync failed: {start} -> {dest} {query_date}: {result if isinstance(result, Exception) else result.get('error', '查詢失敗')}")
+    await asyncio.to_thread(index.prune, get_current_datetime()['date_str'])
+    print(f"同步完成，耗時: {elapsed:.2f} 秒，成功 {summary['stored']} 條，失敗 {summary['failed']} 條")
+    logger.info(f"sync {query_date}: {summary}")
+    return summary
+
+# 行程內共用的客戶端，多次工具呼叫共用同一個連線池
+shared_client = None
+
+def get_shared_client() -> AsyncTHSRClient:
+    """取得行程共用的高鐵客戶端"""
+    global shared_client
+    if shared_client is None:
+        shared_client = AsyncTHSRClient()
+        atexit.register(shared_client.close_sync)
+    return shared_client
+
+# 站點代碼與中文站名
+STATION_NAMES = MappingProxyType({
+    "NanGang": "南港",
+    "TaiPei": "台北",
+    "BanQiao": "板橋",
+    "TaoYuan": "桃園",
+    "XinZhu": "新竹",
+    "MiaoLi": "苗栗",
+    "TaiZhong": "台中",
+    "ZhangHua": "彰化",
+    "YunLin": "雲林",
+    "JiaYi": "嘉義",
+    "TaiNan": "台南",
+    "ZuoYing": "左營"
+})
+
+# 站名的其他說法 (英文拼音、所在城市)，異體字與簡體字由 normalize_station_name 處理
+STATION_ALIASES = {
+    "NanGang": ["Nangang", "Nankang"],
+    "TaiPei": ["Taipei"],
+    "BanQiao": ["Banqiao", "Banciao", "新北"],
+    "TaoYuan": ["Taoyuan"],
+    "XinZhu": ["Hsinchu", "Xinzhu"],
+    "MiaoLi": ["Miaoli"],
+    "TaiZhong": ["Taichung", "Taizhong"],
+    "ZhangHua": ["Changhua", "Zhanghua"],
+    "YunLin": ["Yunlin"],
+    "JiaYi": ["Chiayi", "Jiayi"],
+    "TaiNan": ["Tainan"],
+    "ZuoYing": ["Zuoying", "Tsoying", "高雄", "Kaohsiung"]
+}
+
+# 簡體字、異體字轉成 STATION_NAMES 使用的寫法
+STATION_CHAR_MAP = str.maketrans({
+    '臺': '台', '桥': '橋', '园': '園', '云': '雲', '义': '義', '营': '營', '乡': '鄉'
+})
+STATION_PREFIXES = ('高鐵', '高铁', 'thsr', 'hsr')
+STATION_SUFFIXES = ('高鐵站', '高铁站', '車站', '车站', '站', 'hsrstation', 'station', 'hsr')
+STATION_FUZZY_CUTOFF = 0.75
+
+def normalize_station_name(station_name: str) -> str:
+    """去掉空白、大小寫、異體字、「高鐵」前綴與「車站」後綴"""
+    name = ''.join(station_name.split()).lower().translate(STATION_CHAR_MAP)
+    for prefix in STATION_PREFIXES:
+        if name.startswith(prefix) and len(name) > len(prefix):
+            name = name[len(prefix):]
+    for suffix in STATION_SUFFIXES:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name
+
+def build_station_index() -> MappingProxyType:
+    """正規化站名 → 站點代碼，載入模組時建立一次"""
+    index = {}
+    for code, name in STATION_NAMES.items():
+        for alias in [code, name] + STATION_ALIASES.get(code, []):
+            index[normalize_station_name(alias)] = code
+    return MappingProxyType(index)
+
+STATION_INDEX = build_station_index()
+
 def stationinfo_list()-> Dict[str, str]:
-    return {
-        "NanGang": "南港",
-        "TaiPei": "台北", 
-        "BanQiao": "板橋",
-        "TaoYuan": "桃園",
-        "XinZhu": "新竹",
-        "MiaoLi": "苗栗",
-        "TaiZhong": "台中",
-        "ZhangHua": "彰化",
-        "YunLin": "雲林",
-        "JiaYi": "嘉義",
-        "TaiNan": "台南",
-        "ZuoYing": "左營",
-        "ZuoYing": "高雄"
-    }
+    return STATION_NAMES
+
+@lru_cache(maxsize=256)
+def resolve_station_fuzzy(name: str) -> str:
+    """正規化後查不到時，找包含的站名或最相近的站名，無法判斷是哪一站時回傳空字串"""
+    # 「我要到台中」這類句子裡包含完整站名
+    contained = [key for key in STATION_INDEX if len(key) >= 2 and key in name]
+    if contained:
+        # 被其他較長站名包含的部分不算，剩下的要全部指向同一站
+        contained = [key for key in contained if not any(key != other and key in other for other in contained)]
+        codes = {STATION_INDEX[key] for key in contained}
+        # 「台北到台中」同時包含兩個站名，不猜是哪一站
+        return codes.pop() if len(codes) == 1 else ''
+    matches = difflib.get_close_matches(name, STATION_INDEX.keys(), n=1, cutoff=STATION_FUZZY_CUTOFF)
+    return STATION_INDEX[matches[0]] if matches else ''
 
 def stationinfo_code(station_name: str) -> str:
-    stations = stationinfo_list()
-    for code, name in stations.items():
-        #print(f"search {station_name} {name}")
-        if  station_name == code or station_name == name:
-            return code
-    return ''
+    """站名、站點代碼或常見說法轉成站點代碼，無法辨識時回傳空字串"""
+    name = normalize_station_name(station_name)
+    code = STATION_INDEX.get(name)
+    if code is None:
+        code = resolve_station_fuzzy(name) if name else ''
+        if code:
+            logger.info(f"station '{station_name}' resolved fuzzily to '{code}'")
+        else:
+            logger.warning(f"station '{station_name}' could not be resolved")
+    return code
 
 def get_current_datetime() -> Dict[Any, Any]:
     # 取得當前日期與時間
@@ -300,25 +1010,27 @@ def get_current_datetime() -> Dict[Any, Any]:
         'time_str': time_str
     }
 
-def format_timetable_result(result: Dict[Any, Any], max: int=5, aftertime: str='N/A'):
+def format_timetable_result(result, max: int=5, aftertime: str='N/A', query_type: str=QUERY_DEPART_AFTER):
     """
     格式化時刻表查詢結果並美化輸出
     
     Args:
-        result: 高鐵 API 回應的 JSON 數據
+        result: 高鐵 API 回應的 JSON 數據，或解析好的 RouteTimetable
+        max: 最多列出的班次數，0 表示全部
+        aftertime: 查詢時間 (HH:MM)
+        query_type: 查詢方式，QUERY_TYPES 其中之一
     """
     mcp_result = "查詢失敗\n"
     try:
-        if not result.get('success', False):
+        timetable = result if isinstance(result, RouteTimetable) else RouteTimetable.from_result(result)
+        if timetable is None:
             print("查詢失敗")
             return mcp_result
         
-        data = result.get('data', {})
-        departure_table = data.get('DepartureTable', {})
-        price_table = data.get('PriceTable', {})
+        price_table = timetable.price_table
         
         # 輸出標題資訊
-        title = departure_table.get('Title', {})
+        title = timetable.title
         start_station = title.get('StartStationName', '未知')
         end_station = title.get('EndStationName', '未知')
         search_time = title.get('TitleSplit1', '未知時間')
@@ -331,49 +1043,23 @@ def format_timetable_result(result: Dict[Any, Any], max: int=5, aftertime: str='
         print(f"{'='*60}")
         mcp_result = f"台灣高鐵時刻表查詢結果\n"
         mcp_result += f"路線: 從 {start_station} 到 {end_station}\n"
+        if query_type == QUERY_DEPART_BEFORE:
+            mcp_result += f"條件: {aftertime} 之前出發\n"
+        elif query_type == QUERY_ARRIVE_BY:
+            mcp_result += f"條件: {aftertime} 之前抵達\n"
         
         # 輸出列車時刻表
-        train_items = departure_table.get('TrainItem', [])
-        if train_items:
-            print(f"\n🕐 列車時刻表 (全天共 {len(train_items)} 班次)")
+        if len(timetable) > 0:
+            print(f"\n🕐 列車時刻表 (全天共 {len(timetable)} 班次)")
             print(f"{'-'*80}")
-            #print(f"{'車次':^6} {'發車時間':^8} {'到達時間':^8} {'行車時間':^8} {'標準座':^8} {'商務座':^8} {'自由座':^8}")
-            #print(f"{'-'*80}")
             print(f"{'車次':^6} {'發車時間':^6} {'到達時間':^6} {'行車時間':^8}")
             print(f"{'-'*80}")
             mcp_result += f"\n{'車次':^6} {'發車時間':^6} {'到達時間':^6} {'行車時間':^8}\n"
             mcp_result += f"{'-'*60}\n"
             
-            #獲取票價資訊
-            coach_prices = price_table.get('Coach', [])
-            business_prices = price_table.get('Business', [])
-            unreserved_prices = price_table.get('Unreserved', [])
-            
-            listNum = 0
-            for i, train in enumerate(train_items):
-                train_number = train.get('TrainNumber', 'N/A')
-                departure_time = train.get('DepartureTime', 'N/A')
-                destination_time = train.get('DestinationTime', 'N/A')
-                duration = train.get('Duration', 'N/A')
-            
-                if departure_time == 'N/A':
-                    continue
-                if aftertime != 'N/A':
-                    if aftertime >= departure_time:
-                        continue
-            
-                # 獲取對應的票價（如果有的話
-                # coach_price = coach_prices[0] if listNum < 1 else '-'
-                # business_price = business_prices[0] if listNum < 1 else '-'
-                # unreserved_price = unreserved_prices[0] if listNum < 1 else '-'
-                
-                #print(f"{train_number:^8} {departure_time:^10} {destination_time:^10} {duration:^10} {coach_price:^8} {business_price:^8} {unreserved_price:^8}")
+            for train_number, departure_time, destination_time, duration in timetable.query(query_type, aftertime, max):
                 print(f"{train_number:^8} {departure_time:^10} {destination_time:^10} {duration:^10}")
                 mcp_result += f"{train_number:^8} {departure_time:^10} {destination_time:^10} {duration:^10}\n"
-                
-                listNum = listNum + 1
-                if max > 0 and listNum >= max:
-                    break
             print(f"{'-'*80}")
             mcp_result += f"{'-'*60}\n"
         else:
@@ -402,60 +1088,227 @@ def format_timetable_result(result: Dict[Any, Any], max: int=5, aftertime: str='
                 mcp_result += f"自由座:   {', '.join(unreserved_prices)}\n"
         
         print(f"\n{'='*60}")
-        mcp_result == f"\n{'='*60}\n"
         return mcp_result
         
     except Exception as e:
         print(f"格式化輸出時發生錯誤: {e}")
         mcp_result += "格式化輸出時發生錯誤\n"
-        print("原始 JSON 資料:")
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if isinstance(result, dict):
+            print("原始 JSON 資料:")
+            print(json.dumps(result, ensure_ascii=False, indent=2))
         return mcp_result
 
-def tawinhsr_mcp_call(start_station: str, end_station: str, query_date: str, query_time: str):
-    """主程式 - 示範如何使用非同步客戶端"""
+def timetable_query_params(start_station: str, end_station: str, query_date: str, query_time: str) -> Optional[Dict[str, str]]:
+    """把站名轉成站點代碼並組出查詢參數，站名無法辨識時回傳 None"""
+    start_code = stationinfo_code(start_station)
+    end_code = stationinfo_code(end_station)
+    if len(start_code) == 0 or len(end_code) == 0:
+        return None
+    now_dt = get_current_datetime()
+    return {
+        'start_station': start_code,
+        'end_station': end_code,
+        'outward_date': query_date,
+        'outward_time': query_time,
+        'return_date': now_dt['date_str'],
+        'return_time': now_dt['time_str']
+    }
+
+def timetable_mcp_result(result, query_time: str, query_type: str = QUERY_DEPART_AFTER) -> str:
+    """把查詢結果整理成工具回傳的文字"""
+    print("\n=== 查詢結果 ===")
+    if isinstance(result, dict) and 'error' in result:
+        print(f"發生錯誤: {result['error']}")
+        if 'raw_text' in result:
+            print(f"原始響應: {result['raw_text'][:200]}...")
+        return "網路查詢發生錯誤\n"
+    else:
+        print("查詢成功！")
+        return format_timetable_result(result=result, max=5, aftertime=query_time, query_type=query_type)
+
+def load_timetable(cache_key: Tuple[str, str, str]) -> Optional[RouteTimetable]:
+    """先查記憶體快取，再查本地索引"""
+    timetable = timetable_cache.get(cache_key)
+    if timetable is None:
+        timetable = timetable_index.lookup(cache_key)
+        timetable_cache.put(cache_key, timetable)
+    return timetable
+
+def remember_timetable(cache_key: Tuple[str, str, str], result) -> Optional[RouteTimetable]:
+    """把網路查詢結果 (JSON 或串流解析好的 RouteTimetable) 寫入本地索引與快取"""
+    timetable = result if isinstance(result, RouteTimetable) else RouteTimetable.from_result(result)
+    if timetable is not None:
+        timetable_index.store(cache_key, timetable)
+        timetable_cache.put(cache_key, timetable)
+    return timetable
+
+async def load_timetable_async(cache_key: Tuple[str, str, str]) -> Optional[RouteTimetable]:
+    """load_timetable 的非同步版本，本地索引在執行緒裡查詢"""
+    timetable = timetable_cache.get(cache_key)
+    if timetable is None:
+        timetable = await asyncio.to_thread(timetable_index.lookup, cache_key)
+        timetable_cache.put(cache_key, timetable)
+    return timetable
+
+async def remember_timetable_async(cache_key: Tuple[str, str, str], result) -> Optional[RouteTimetable]:
+    """remember_timetable 的非同步版本，本地索引在執行緒裡寫入"""
+    timetable = result if isinstance(result, RouteTimetable) else RouteTimetable.from_result(result)
+    if timetable is not None:
+        await asyncio.to_thread(timetable_index.store, cache_key, timetable)
+        timetable_cache.put(cache_key, timetable)
+    return timetable
+
+async def fetch_timetable(client: AsyncTHSRClient, params: Dict[str, str]):
+    """
+    同一天同一路線先查快取與本地索引，都沒有才上網查詢；查詢失敗時回傳 API 的錯誤結果
+
+    網路查詢時串流解析回應，解析出的全天時刻表寫入快取與索引。
+    """
+    cache_key = timetable_cache.key(params)
+    timetable = await load_timetable_async(cache_key)
+    if timetable is None:
+        result = await client.search_timetable(**params, stream=True)
+        timetable = await remember_timetable_async(cache_key, result)
+        if timetable is None:
+            timetable = result
+    return timetable
+
+def tawinhsr_mcp_call(start_station: str, end_station: str, query_date: str, query_time: str,
+                      query_type: str = QUERY_DEPART_AFTER):
+    """同步查詢 - 給命令列使用，會阻塞呼叫端"""
     
-    logger.info(f"params: {start_station} {end_station} {query_date} {query_time}")
+    logger.info(f"params: {start_station} {end_station} {query_date} {query_time} {query_type}")
     
     print("=== 台灣高鐵時刻表查詢 ===")
     print()
     
-    # 創建客戶端實例
-    client = AsyncTHSRClient()
+    error = check_timetable_query(query_time, query_type)
+    if error:
+        print(error)
+        return error
+    
+    # 使用共用的客戶端實例 (保留連線)
+    client = get_shared_client()
     
     # 查詢時刻表（使用您提供的參數）
-    start_code = stationinfo_code(start_station)
-    end_code = stationinfo_code(end_station)
-    if len(start_code) == 0 or len(end_code) == 0:
+    params = timetable_query_params(start_station, end_station, query_date, query_time)
+    if params is None:
         print(f"查無從{start_station}到{end_station}的時刻表")
         return f"查無從{start_station}到{end_station}的時刻表"
-    now_dt = get_current_datetime()
-    print("正在查詢時刻表...")
+    # 同一天同一路線先查快取與本地索引
+    cache_key = timetable_cache.key(params)
+    timetable = load_timetable(cache_key)
+    if timetable is None:
+        print("正在查詢時刻表...")
+        result = client.search_timetable_sync(**params)
+        timetable = remember_timetable(cache_key, result)
+        if timetable is None:
+            timetable = result
     
-    result = client.search_timetable_sync(
-        start_station = start_code,
-        end_station   = end_code,
-        outward_date  = query_date,
-        outward_time  = query_time,
-        return_date=now_dt['date_str'],
-        return_time=now_dt['time_str']
-    )
+    logger.info(f"connection stats: {client.connection_stats()}, cache: {timetable_cache.stats()}")
+    return timetable_mcp_result(timetable, query_time, query_type)
+
+async def tawinhsr_mcp_call_async(start_station: str, end_station: str, query_date: str, query_time: str,
+                                  query_type: str = QUERY_DEPART_AFTER):
+    """非同步查詢 - 給 MCP 工具使用，等待網路時不會卡住 event loop"""
     
-    print("\n=== 查詢結果 ===")
-    if 'error' in result:
-        print(f"發生錯誤: {result['error']}")
-        if 'raw_text' in result:
-            print(f"原始響應: {result['raw_text'][:200]}...")
-        return "網路查詢發生錯誤\n"
+    logger.info(f"params: {start_station} {end_station} {query_date} {query_time} {query_type}")
+    
+    error = check_timetable_query(query_time, query_type)
+    if error:
+        print(error)
+        return error
+    
+    # 使用共用的客戶端實例 (保留連線)
+    client = get_shared_client()
+    
+    params = timetable_query_params(start_station, end_station, query_date, query_time)
+    if params is None:
+        print(f"查無從{start_station}到{end_station}的時刻表")
+        return f"查無從{start_station}到{end_station}的時刻表"
+    
+    timetable = await fetch_timetable(client, params)
+    
+    logger.info(f"connection stats: {client.connection_stats()}, cache: {timetable_cache.stats()}")
+    return timetable_mcp_result(timetable, query_time, query_type)
+
+async def tawinhsr_fastest_route_async(start_stations: List[str], end_stations: List[str], query_date: str,
+                                       query_time: str, max: int = 5,
+                                       concurrency: int = THSR_ROUTE_CONCURRENCY) -> str:
+    """
+    多起站、多迄站的最早抵達查詢
+
+    每一組起迄站的時刻表同時查詢 (共用同一個連線池，最多 concurrency 個同時進行)，
+    把 query_time 之後出發的班次合在一起，依抵達時間排出最早抵達的 max 班。
+    """
+    
+    logger.info(f"params: {start_stations} {end_stations} {query_date} {query_time}")
+    error = check_timetable_query(query_time)
+    if error:
+        return error
+    client = get_shared_client()
+    
+    routes = []
+    unknown = []
+    for start_station in start_stations:
+        for end_station in end_stations:
+            params = timetable_query_params(start_station, end_station, query_date, query_time)
+            if params is None:
+                unknown.append(f"{start_station}→{end_station}")
+            elif params['start_station'] != params['end_station'] and params not in routes:
+                routes.append(params)
+    if not routes:
+        return f"查無從{'/'.join(start_stations)}到{'/'.join(end_stations)}的時刻表"
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    async def fetch(params):
+        async with semaphore:
+            return await fetch_timetable(client, params)
+    
+    start_time = datetime.now()
+    timetables = await asyncio.gather(*(fetch(params) for params in routes), return_exceptions=True)
+    elapsed = (datetime.now() - start_time).total_seconds()
+    print(f"查詢 {len(routes)} 條路線，耗時: {elapsed:.2f} 秒")
+    
+    # (抵達分鐘, 起站, 迄站, 車次, 發車時間, 到達時間, 行車時間)
+    candidates = []
+    failed = []
+    stations = stationinfo_list()
+    for params, timetable in zip(routes, timetables):
+        start_name = stations[params['start_station']]
+        end_name = stations[params['end_station']]
+        if not isinstance(timetable, RouteTimetable):
+            failed.append(f"{start_name}→{end_name}")
+            continue
+        # 晚發車的直達車可能先到，每條路線取最早抵達的 max 班，而不是最早出發的 max 班
+        for train in timetable.arrive_first(time_to_minutes(query_time), max):
+            dep_min = time_to_minutes(train[1])
+            arr_min = time_to_minutes(train[2])
+            if arr_min < dep_min:
+                arr_min += 24 * 60
+            candidates.append((arr_min, start_name, end_name) + train)
+    candidates.sort(key=lambda candidate: (candidate[0], candidate[4]))
+    
+    start_names = dict.fromkeys(stations[params['start_station']] for params in routes)
+    end_names = dict.fromkeys(stations[params['end_station']] for params in routes)
+    mcp_result = f"台灣高鐵最早抵達查詢結果\n"
+    mcp_result += f"路線: 從 {'/'.join(start_names)} 到 {'/'.join(end_names)}\n"
+    mcp_result += f"條件: {query_date} {query_time} 之後出發，依抵達時間排序\n"
+    if candidates:
+        mcp_result += f"\n{'起站':^4} {'迄站':^4} {'車次':^6} {'發車時間':^6} {'到達時間':^6} {'行車時間':^8}\n"
+        mcp_result += f"{'-'*60}\n"
+        for _, start_name, end_name, train_number, departure_time, destination_time, duration in candidates[:max]:
+            mcp_result += f"{start_name:^4} {end_name:^4} {train_number:^8} {departure_time:^10} {destination_time:^10} {duration:^10}\n"
+        mcp_result += f"{'-'*60}\n"
     else:
-        print("查詢成功！")
-        #print(json.dumps(result, ensure_ascii=False, indent=2))
-        return format_timetable_result(result=result, max=5, aftertime=query_time)
+        mcp_result += '沒有找到合適的班次\n'
+    if failed:
+        mcp_result += f"查詢失敗的路線: {', '.join(failed)}\n"
+    if unknown:
+        mcp_result += f"無法辨識的站名: {', '.join(unknown)}\n"
     
-    #print("\n=== 站點資訊 ===")
-    #stations = await client.get_station_info()
-    #for code, name in stations.items():
-    #    print(f"{code}: {name}")
+    logger.info(f"connection stats: {client.connection_stats()}, cache: {timetable_cache.stats()}")
+    return mcp_result
 
 async def main():
     """主程式 - 示範如何使用非同步客戶端"""
@@ -493,6 +1346,7 @@ async def main():
     stations = await client.get_station_info()
     for code, name in stations.items():
         print(f"{code}: {name}")
+    await client.aclose()
 
 # 併發查詢多個路線的範例
 async def batch_search_example():
@@ -526,22 +1380,29 @@ async def batch_search_example():
         else:
             print(f"查詢 {i+1} 成功")
             format_timetable_result(result)
+    
+    print(f"連線統計: {client.connection_stats()}")
+    await client.aclose()
 
 if __name__ == "__main__":
     # print(f"程式名稱: {sys.argv[0]}")
     now_dt = get_current_datetime()
     parser = argparse.ArgumentParser(description='高鐡時刻表查詢')
-    parser.add_argument('--start', '-s', type=str, required=True, default='台北', 
+    parser.add_argument('--start', '-s', type=str, default='台北', 
                        help='起始站名')
-    parser.add_argument('--dest', '-d', type=str, required=True, default='新竹', 
+    parser.add_argument('--dest', '-d', type=str, default='新竹', 
                        help='目的站名')
     parser.add_argument('--date', '-D', type=str, default=now_dt['date_str'], 
                         help='日期')
     parser.add_argument('--time', '-T', type=str, default=now_dt['time_str'], 
                         help='時間')
+    parser.add_argument('--sync', action='store_true',
+                        help='下載指定日期的全線時刻表到本地索引')
     args = parser.parse_args()
 
-    if len(sys.argv) > 4:
+    if args.sync:
+        asyncio.run(sync_timetable_index(args.date))
+    elif len(sys.argv) > 4:
         result = tawinhsr_mcp_call(
             args.start, 
             args.dest, 
@@ -0,0 +1,58 @@
+"""Ledger query index"""
+
+from go_sheet import LedgerIndex
+
+HEADER = ['日期', '時間', '名稱', '個數', '小計價格', '狀態', '備註']
+
+
+def make_index():
+    rows = [
+        HEADER,
+        ['2025/5/1', '09:00', 'Coffee', '1', '60', '', ''],
+        ['2025-05-03', '12:00', '便當', '2', '200', 'update', '12:05 2025-05-03 更新'],
+        ['2025-05-02', '18:00', 'Iced Coffee', '1', '1,200', '', ''],
+        ['2025-05-02', '08:00', 'Tea', '3', '90', 'deleted', ''],
+        ['', '', '', '', '', '', ''],
+        ['2025-06-01', '10:00', 'coffee', '', '75', '', ''],
+    ]
+    return LedgerIndex(rows, version=1)
+
+
+def names(index, rows):
+    return [index.names[i] for i in rows]
+
+
+def test_dates_are_zero_padded_and_sorted():
+    index = make_index()
+    assert index.dates[0] == '2025-05-01'
+    assert names(index, index.select()) == ['Coffee', 'Iced Coffee', '便當', 'coffee']
+
+
+def test_date_range_totals_skip_deleted_entries():
+    index = make_index()
+    assert index.totals('2025-05-01', '2025-05-31') == {'entries': 3, 'count': 4, 'total_price': 1460}
+    assert index.totals('2025-05-02', '2025-05-02') == {'entries': 1, 'count': 1, 'total_price': 1200}
+    assert index.totals() == {'entries': 4, 'count': 4, 'total_price': 1535}
+    assert index.totals('2025-07-01') == {'entries': 0, 'count': 0, 'total_price': 0}
+
+
+def test_select_by_name():
+    index = make_index()
+    assert names(index, index.select(name='COFFEE ')) == ['Coffee', 'coffee']
+    # No exact match falls back to names containing the text
+    assert names(index, index.select(name='ice')) == ['Iced Coffee']
+    assert names(index, index.select(name='coffee', end_date='2025-05-31')) == ['Coffee']
+
+
+def test_select_by_status():
+    index = make_index()
+    assert names(index, index.select(status='create')) == ['Coffee', 'Iced Coffee', 'coffee']
+    assert names(index, index.select(status='deleted')) == ['Tea']
+    assert index.totals(status='update') == {'entries': 1, 'count': 2, 'total_price': 200}
+
+
+def test_top_and_entry():
+    index = make_index()
+    top = index.top(index.select(), 2)
+    assert names(index, top) == ['Iced Coffee', '便當']
+    assert index.entry(top[0]) == '4, 2025-05-02, 18:00, Iced Coffee, 1, 1200'
@@ -0,0 +1,119 @@
+"""Local SQLite ledger store"""
+
+import threading
+
+import pytest
+
+from go_sheet import SQLiteLedgerStore
+
+HEADER = ['日期', '時間', '名稱', '個數', '小計價格', '狀態', '備註']
+
+
+class FakeReplica:
+    def __init__(self):
+        self.cells = []
+
+    def enqueue(self, *cells):
+        self.cells.extend(cells)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'ledger.db')
+
+
+@pytest.fixture
+def store(db_path):
+    store = SQLiteLedgerStore(db_path)
+    yield store
+    store.close()
+
+
+def entry(item_id=0, name='Coffee', count=1, subtotal=60, method='create'):
+    return {'method': method, 'id': item_id, 'name': name, 'count': count, 'subtotal': subtotal}
+
+
+def test_create_read_update_delete(store):
+    assert store.is_empty()
+    assert store.account_book_create(entry()) == \
+        "Successfully created entry. Item ID is 2, available for future reference."
+    assert store.account_book_create(entry(name='Tea')).startswith("Successfully created entry. Item ID is 3")
+
+    assert store.account_book_update(entry(2, 'Latte', 2, 150)) == "Successfully updated entry. Item ID: 2."
+    row = store.account_book_read(entry(2)).splitlines()[-1].split(', ')
+    assert row[2:6] == ['Latte', '2', '150', 'update']
+
+    assert store.account_book_delete(entry(3)) == "Successfully deleted entry with Item ID: 3."
+    assert store.account_book_read(entry(3)).splitlines()[-1].split(', ')[5] == 'deleted'
+
+
+def test_missing_rows_are_not_found(store):
+    assert store.account_book_update(entry(5)) == "Error: Item ID 5 not found."
+    assert store.account_book_delete(entry(5)) == "Error: Item ID 5 not found."
+    # A missing row reads as the header line without any fields
+    assert store.account_book_read(entry(5)).endswith('\n')
+
+
+def test_ids_follow_imported_sheet_rows(store):
+    store.import_rows([HEADER, ['2025-05-01', '09:00', 'Coffee', '1', '60'], ['2025-05-02', '09:00', 'Tea', '1', '40']])
+    assert not store.is_empty()
+    assert store.insert([['2025-05-03', '09:00', 'Cake', 1, 90]]) == [4]
+    assert store.index().totals() == {'entries': 3, 'count': 3, 'total_price': 190}
+
+
+def test_batch(store):
+    store.account_book_create(entry())
+    results = store.account_book_batch([
+        entry(name='Tea'),
+        entry(2, 'Latte', method='update'),
+        entry(9, method='delete'),
+        entry(name='Cake'),
+    ])
+    assert results == [
+        "Successfully created entry. Item ID is 3.",
+        "Successfully updated entry. Item ID: 2.",
+        "Error: Item ID 9 not found.",
+        "Successfully created entry. Item ID is 4.",
+    ]
+
+
+def test_writes_are_replicated(store):
+    store.replica = FakeReplica()
+    store.account_book_create(entry())
+    store.account_book_delete(entry(2))
+    store.account_book_update(entry(7))
+    assert [(row, col) for row, col, _ in store.replica.cells] == [(2, 1), (2, 6)]
+    assert store.replica.cells[1][2] == ['deleted']
+
+
+def test_index_sees_writes_of_another_connection(store, db_path):
+    store.account_book_create(entry())
+    first = store.index()
+    assert store.index() is first
+
+    other = SQLiteLedgerStore(db_path)
+    try:
+        other.account_book_create(entry(name='Tea', subtotal=40))
+    finally:
+        other.close()
+    index = store.index()
+    assert index is not first
+    assert index.totals() == {'entries': 2, 'count': 2, 'total_price': 100}
+
+
+def test_concurrent_stores_get_unique_ids(db_path):
+    stores = [SQLiteLedgerStore(db_path) for _ in range(4)]
+    ids = []
+
+    def create(store):
+        for _ in range(25):
+            ids.extend(store.insert([['2025-05-01', '09:00', 'Coffee', 1, 60]]))
+
+    threads = [threading.Thread(target=create, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for store in stores:
+        store.close()
+    assert sorted(ids) == list(range(2, 102))
@@ -0,0 +1,153 @@
+"""Request id rewriting of MCPProcess and MCPWorkerPool"""
+
+import asyncio
+import json
+
+from mcp_pipe import MCPProcess, MCPWorkerPool
+
+
+class FakeProcess:
+    returncode = None
+
+
+def make_process():
+    process = MCPProcess('mcp_script.py')
+    process.process = FakeProcess()
+    process.written = []
+
+    async def write(data):
+        process.written.append(data)
+
+    process.write = write
+    return process
+
+
+def request(request_id, method='tools/call'):
+    return {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': {}}
+
+
+def cancelled(request_id):
+    return {'jsonrpc': '2.0', 'method': 'notifications/cancelled', 'params': {'requestId': request_id, 'reason': 'timeout'}}
+
+
+def test_process_gives_channels_unique_ids():
+    async def run():
+        process = make_process()
+        a = process.attach('a')
+        b = process.attach('b')
+        await process.send('a', json.dumps(request(1)))
+        await process.send('b', json.dumps(request(1)))
+        first, second = process.written
+        assert first['id'] != second['id']
+
+        process.route_message({'jsonrpc': '2.0', 'id': second['id'], 'result': 'b'})
+        process.route_message({'jsonrpc': '2.0', 'id': first['id'], 'result': 'a'})
+        assert json.loads(a.get_nowait()) == {'jsonrpc': '2.0', 'id': 1, 'result': 'a'}
+        assert json.loads(b.get_nowait()) == {'jsonrpc': '2.0', 'id': 1, 'result': 'b'}
+        assert process.pending == {}
+
+    asyncio.run(run())
+
+
+def test_process_rewrites_cancelled_request_id():
+    async def run():
+        process = make_process()
+        process.attach('a')
+        process.attach('b')
+        await process.send('a', json.dumps(request(7)))
+        await process.send('b', json.dumps(request(7)))
+        child_id = process.written[1]['id']
+
+        await process.send('b', json.dumps(cancelled(7)))
+        assert process.written[2]['params'] == {'requestId': child_id, 'reason': 'timeout'}
+
+    asyncio.run(run())
+
+
+def test_process_drops_cancellation_of_finished_request():
+    async def run():
+        process = make_process()
+        process.attach('a')
+        await process.send('a', json.dumps(request(3)))
+        process.route_message({'jsonrpc': '2.0', 'id': process.written[0]['id'], 'result': None})
+
+        await process.send('a', json.dumps(cancelled(3)))
+        await process.send('a', json.dumps([cancelled(3), request(4)]))
+        assert len(process.written) == 2
+        assert [item['id'] for item in process.written[1]] == [process.next_id]
+
+    asyncio.run(run())
+
+
+class FakeWorker:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, name, message):
+        self.sent.append(json.loads(message))
+
+
+def make_pool(size=2):
+    pool = MCPWorkerPool('mcp_script.py', size)
+    pool.workers = [FakeWorker() for _ in range(size)]
+    return pool
+
+
+def test_pool_routes_response_to_the_calling_channel():
+    async def run():
+        pool = make_pool()
+        a = pool.attach('a')
+        b = pool.attach('b')
+        await pool.send('a', json.dumps(request(1)))
+        await pool.send('b', json.dumps(request(1)))
+        (to_first,), (to_second,) = [worker.sent for worker in pool.workers]
+        assert to_first['id'] != to_second['id']
+
+        queue = asyncio.Queue()
+        queue.put_nowait(json.dumps({'jsonrpc': '2.0', 'id': to_second['id'], 'result': 'b'}))
+        task = asyncio.create_task(pool.pipe_worker_to_channels(1, queue))
+        assert json.loads(await asyncio.wait_for(b.get(), 1)) == {'jsonrpc': '2.0', 'id': 1, 'result': 'b'}
+        task.cancel()
+        assert a.empty()
+        assert pool.in_flight == [1, 0]
+
+    asyncio.run(run())
+
+
+def test_pool_sends_cancellation_only_to_the_owning_worker():
+    async def run():
+        pool = make_pool()
+        pool.attach('a')
+        pool.attach('b')
+        await pool.send('a', json.dumps(request(5)))
+        await pool.send('b', json.dumps(request(5)))
+        pool_id = pool.workers[1].sent[0]['id']
+
+        await pool.send('b', json.dumps(cancelled(5)))
+        assert len(pool.workers[0].sent) == 1
+        assert pool.workers[1].sent[1]['params'] == {'requestId': pool_id, 'reason': 'timeout'}
+
+        # Nothing is in flight for this id, the cancellation goes nowhere
+        await pool.send('a', json.dumps(cancelled(99)))
+        assert [len(worker.sent) for worker in pool.workers] == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_pool_answers_worker_request_on_that_worker_only():
+    async def run():
+        pool = make_pool()
+        a = pool.attach('a')
+        await pool.send('a', json.dumps(request(1)))
+
+        queue = asyncio.Queue()
+        queue.put_nowait(json.dumps(request(1, 'sampling/createMessage')))
+        task = asyncio.create_task(pool.pipe_worker_to_channels(0, queue))
+        asked = json.loads(await asyncio.wait_for(a.get(), 1))
+        task.cancel()
+
+        await pool.send('a', json.dumps({'jsonrpc': '2.0', 'id': asked['id'], 'result': {}}))
+        assert pool.workers[0].sent[-1] == {'jsonrpc': '2.0', 'id': 1, 'result': {}}
+        assert pool.workers[1].sent == []
+
+    asyncio.run(run())
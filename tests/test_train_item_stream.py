@@ -0,0 +1,84 @@
+"""Streaming parse of THSR timetable responses"""
+
+import json
+
+import pytest
+
+from taiwan_hsr import RouteTimetable, TrainItemStream
+
+TRAINS = [
+    ('0803', '08:00', '10:30', '2:30'),
+    ('0805', '08:10', '10:40', '2:30'),
+    ('0609', '08:30', '09:55', '1:25'),
+    ('0111', '23:40', '00:50', '1:10'),
+]
+
+
+def train_item(number, departure, arrival, duration):
+    return {'TrainNumber': number, 'DepartureTime': departure, 'DestinationTime': arrival,
+            'Duration': duration, 'StationInfo': [{'StationName': '台北', 'DepartureTime': departure}]}
+
+
+def response(trains=TRAINS, success=True, success_last=False):
+    data = {
+        'DepartureTable': {'Title': {'TitleSplit1': '台北→左營'},
+                           'TrainItem': [train_item(*train) for train in trains]},
+        'PriceTable': {'Column': [{'ColumnName': '標準座'}]}
+    }
+    doc = {'data': data, 'success': success} if success_last else {'success': success, 'data': data}
+    return json.dumps(doc, ensure_ascii=False).encode('utf-8')
+
+
+def parse(raw, size):
+    parser = TrainItemStream()
+    for i in range(0, len(raw), size):
+        parser.feed(raw[i:i + size])
+    return parser
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64, 1 << 20])
+def test_chunk_boundaries(size):
+    # Size 1 and 2 split the UTF-8 station names and the "TrainItem" key across chunks
+    parser = parse(response(), size)
+    result = parser.result()
+    assert isinstance(result, RouteTimetable)
+    assert result.trains == TRAINS
+    assert result.title == {'TitleSplit1': '台北→左營'}
+    assert result.price_table == {'Column': [{'ColumnName': '標準座'}]}
+    assert parser.size == len(response())
+
+
+@pytest.mark.parametrize('success_last', [False, True])
+def test_success_is_read_after_data(success_last):
+    assert isinstance(parse(response(success_last=success_last), 16).result(), RouteTimetable)
+    failed = parse(response(success=False, success_last=success_last), 16).result()
+    assert isinstance(failed, dict) and failed['success'] is False
+
+
+def test_missing_success_is_a_failure():
+    raw = json.dumps({'data': {'DepartureTable': {'TrainItem': [train_item(*TRAINS[0])]}}}).encode()
+    assert isinstance(parse(raw, 16).result(), dict)
+
+
+def test_unsorted_input_keeps_every_train():
+    unsorted = [TRAINS[2], TRAINS[0], TRAINS[3], TRAINS[1]]
+    result = parse(response(unsorted), 16).result()
+    assert result.trains == TRAINS
+    assert [train[0] for train in result.depart_after(7 * 60, 2)] == ['0803', '0805']
+
+
+def test_truncated_response_is_an_error():
+    raw = response()
+    result = parse(raw[:len(raw) // 2], 16).result()
+    assert result['error'] == '回應不完整'
+
+
+def test_empty_timetable_is_a_success():
+    raw = json.dumps({'success': True, 'data': {'DepartureTable': {'Title': {}}, 'PriceTable': {}}}).encode()
+    result = parse(raw, 16).result()
+    assert isinstance(result, RouteTimetable) and len(result) == 0
+
+
+def test_non_json_response():
+    result = parse(b'<html>busy</html>', 4).result()
+    assert result['error'] == '非 JSON 響應'